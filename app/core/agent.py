@@ -1,54 +1,179 @@
 import os
-import re
-import datetime
-import pandas as pd
-from app.core.retrieval import chunks
+import json
+import fcntl
+import asyncio
 
-# Directory to save reports
-BASE_DIR   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-REPORT_DIR = os.path.join(BASE_DIR, "reports")
-os.makedirs(REPORT_DIR, exist_ok=True)
+from app.core import metrics, retrieval
+from app.core.reports import write_report
 
-async def run_agent(question: str):
+# Analyzer settings
+SIMILARITY      = float(os.getenv("ANALYZER_SIMILARITY", "0.95"))  # cosine for near-duplicates
+OUTDATED_BEFORE = int(os.getenv("ANALYZER_OUTDATED_BEFORE", "2022"))
+STATE_PATH      = os.path.join(retrieval.STORE_DIR, "analyzer_state.json")
+FINDINGS_PATH   = os.path.join(retrieval.STORE_DIR, "analyzer_findings.jsonl")
+LOCK_PATH       = STATE_PATH + ".lock"
+COLUMNS         = ["chunk_id", "issue", "detail", "snippet"]
+
+# ─── Persistent state ─────────────────────────────────────────────────────
+# Findings are appended to a JSONL file next to the vector store, and the
+# state records the chunk id they cover up to, so each run only analyzes
+# chunks added since the last one and the report is streamed from disk.
+# Findings for chunks deleted since are left out of the report. A run holds
+# an flock() on LOCK_PATH from reading the state to writing the report, so
+# concurrent runs (in this process or another worker) never analyze the same
+# chunks twice.
+
+def _load_state() -> dict:
+    fresh = {"analyzed": 0, "similarity": SIMILARITY, "outdated_before": OUTDATED_BEFORE, "issues": 0}
+    state = fresh
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    # first run, settings changed or the store shrank: start over
+    if (state is fresh
+            or state.get("similarity") != SIMILARITY
+            or state.get("outdated_before") != OUTDATED_BEFORE
+            or state.get("analyzed", 0) > retrieval.store.next_id
+            or not os.path.exists(FINDINGS_PATH)):
+        open(FINDINGS_PATH, "w").close()
+        return fresh
+    return state
+
+def _append_findings(rows: list[dict]):
+    with open(FINDINGS_PATH, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+def _findings(count: list[int]):
     """
-    Document Analyzer Agent:
-     - Flags outdated (year < 2022) 
-     - Flags exact duplicates (redundant chunks)
-     - Writes an Excel report with chunk_id, issue, snippet, details
+    Stored findings whose chunk still exists; count[0] tracks how many.
     """
-    rows = []
+    store = retrieval.store
+    with open(FINDINGS_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if store.contains(row["chunk_id"]):
+                count[0] += 1
+                yield row
 
-    # 1) Outdated: look for any year < 2022 in chunk text
-    year_pattern = re.compile(r"\b(19[0-9]{2}|20[0-9]{2})\b")
-    for idx, chunk in enumerate(chunks):
-        for match in year_pattern.findall(chunk):
-            year = int(match)
-            if year < 2022:
-                rows.append({
-                    "chunk_id": idx,
-                    "issue": "outdated",
-                    "detail": f"Found year {year}",
-                    "snippet": chunk[:200]
-                })
+def _save_state(state: dict):
+    with open(STATE_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(STATE_PATH + ".tmp", STATE_PATH)
+
+# ─── Near-duplicate search ────────────────────────────────────────────────
+def _similar_pairs(ids, embs) -> dict[int, tuple[int, float]]:
+    """
+    For every new chunk (ids[j]), the most similar *earlier* live chunk at
+    or above SIMILARITY, found with one batched range search over the index.
+    Index types without range search fall back to a segment-by-segment scan
+    of the stored embeddings.
+    """
+    best: dict[int, tuple[int, float]] = {}
+    store = retrieval.store
+
+    def consider(chunk_id: int, other: int, sim: float):
+        if other < chunk_id and (chunk_id not in best or sim > best[chunk_id][1]) \
+                and not store.is_deleted(other):
+            best[chunk_id] = (other, sim)
+
+    try:
+        with retrieval.index_lock:
+            lims, D, I = retrieval.index.range_search(embs, SIMILARITY)
+        for j in range(len(embs)):
+            for sim, other in zip(D[lims[j]:lims[j + 1]], I[lims[j]:lims[j + 1]]):
+                consider(int(ids[j]), int(other), float(sim))
+    except RuntimeError:
+        segments, _ = store.snapshot()
+        for seg in segments:
+            if not len(seg) or seg.ids[0] > ids[-1]:
                 break
+            sims = embs @ seg.embeddings.T
+            for j, col in zip(*(sims >= SIMILARITY).nonzero()):
+                consider(int(ids[j]), int(seg.ids[col]), float(sims[j, col]))
+    return best
+
+def _analyze(first: int) -> tuple[list[dict], int]:
+    """
+    Findings for the live chunks with ids in [first, end); returns them with
+    end.
+    """
+    retrieval.load_all()
+    store = retrieval.store
+    rows = []
+    end = store.next_id
+    if first >= end or retrieval.index is None:
+        return rows, end
+    ids, embs, alive = store.columns("ids", "embeddings", "alive", since=first)
+    keep = alive & (ids < end)
+    ids, embs = ids[keep], embs[keep]
+    if not len(ids):
+        return rows, end
 
-    # 2) Redundant: exact duplicate text
-    seen = {}
-    for idx, chunk in enumerate(chunks):
-        if chunk in seen:
+    # 1) Outdated: any year < OUTDATED_BEFORE in the new chunks, read from
+    #    the year-token postings of the lexical index instead of the text
+    years = retrieval.lexical.years(OUTDATED_BEFORE, since=first)
+    for idx in ids.tolist():
+        if idx in years:
             rows.append({
                 "chunk_id": idx,
-                "issue": "redundant",
-                "detail": f"Duplicate of chunk_id {seen[chunk]}",
-                "snippet": chunk[:200]
+                "issue": "outdated",
+                "detail": f"Found year {years[idx]}",
+                "snippet": store.chunks[idx][:200]
             })
-        else:
-            seen[chunk] = idx
 
-    # 3) Write to Excel
-    df = pd.DataFrame(rows)
-    ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    report_file = os.path.join(REPORT_DIR, f"doc_analysis_{ts}.xlsx")
-    df.to_excel(report_file, index=False)
+    # 2) Redundant: new chunks nearly identical to an earlier chunk
+    for pos, (other, sim) in sorted(_similar_pairs(ids, embs).items()):
+        exact = store.hash_at(pos) == store.hash_at(other)
+        rows.append({
+            "chunk_id": pos,
+            "issue": "redundant",
+            "detail": (f"Duplicate of chunk_id {other}" if exact
+                       else f"Near-duplicate of chunk_id {other} (similarity {sim:.3f})"),
+            "snippet": store.chunks[pos][:200]
+        })
+    return rows, end
+
+async def run_agent(question: str):
+    """
+    Document Analyzer Agent:
+     - Flags outdated (year < 2022)
+     - Flags duplicates and near-duplicates (redundant chunks) by embedding
+       similarity against the index
+     - Only analyzes chunks added since the previous run and merges the
+       findings into the earlier ones
+     - Writes a report (Excel by default) with chunk_id, issue, snippet, details
+    """
+    metrics.AGENT_RUNS.inc(agent="analyzer")
+    return await asyncio.to_thread(_run)
+
+def _run() -> dict:
+    """
+    One locked analyzer run: new findings, state, report. Blocking.
+    """
+    fd = os.open(LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        state = _load_state()
+        first = state["analyzed"]
+        with metrics.stage("analyzer", "analyze"):
+            new_rows, analyzed = _analyze(first)
+
+        _append_findings(new_rows)
+        state["issues"] += len(new_rows)
+        state["analyzed"] = analyzed
+        _save_state(state)
+
+        # 3) Stream all findings into the report
+        reported = [0]
+        with metrics.stage("analyzer", "report"):
+            report_file = write_report("doc_analysis", COLUMNS, _findings(reported), "Sheet1")
+    finally:
+        os.close(fd)   # releases the flock
 
-    return {"report_path": report_file, "issues_found": len(rows)}
+    return {
+        "report_path": str(report_file),
+        "issues_found": reported[0],
+        "new_issues": len(new_rows),
+        "chunks_analyzed": state["analyzed"] - first,
+    }
@@ -0,0 +1,386 @@
+import os
+import json
+import uuid
+
+import faiss
+import numpy as np
+
+# ─── PLUGGABLE ANN INDEX ──────────────────────────────────────────────────────
+#
+# INDEX_TYPE selects the FAISS index built over the stored embeddings:
+#   flat       exact inner-product search (default)
+#   ivf_flat   inverted lists over full vectors          (INDEX_NLIST, INDEX_NPROBE)
+#   ivf_pq     inverted lists over PQ-compressed vectors (+ INDEX_PQ_M, INDEX_PQ_NBITS)
+#   hnsw       graph index                               (INDEX_HNSW_M, INDEX_EF_SEARCH)
+#
+# Trained types are trained on a random sample of at most INDEX_TRAIN_SAMPLE
+# vectors. Until the corpus is large enough to train them, a flat index is
+# used instead; once it has grown INDEX_REBUILD_FACTOR times past the training
+# size, the index is retrained from the stored embeddings.
+#
+# Vectors are added under their stable chunk ids (IVF natively, flat and HNSW
+# through an IDMap), so store compaction never renumbers the index and
+# deleted chunks can be removed by id.
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+SEARCH_KEYS = ("nprobe", "ef_search")  # query-time only; no rebuild needed
+
+
+def index_config() -> dict:
+    return {
+        "type":           os.getenv("INDEX_TYPE", "flat"),
+        "nlist":          int(os.getenv("INDEX_NLIST", "1024")),
+        "nprobe":         int(os.getenv("INDEX_NPROBE", "16")),
+        "pq_m":           int(os.getenv("INDEX_PQ_M", "48")),
+        "pq_nbits":       int(os.getenv("INDEX_PQ_NBITS", "8")),
+        "hnsw_m":         int(os.getenv("INDEX_HNSW_M", "32")),
+        "ef_construction": int(os.getenv("INDEX_EF_CONSTRUCTION", "80")),
+        "ef_search":      int(os.getenv("INDEX_EF_SEARCH", "64")),
+        "train_sample":   int(os.getenv("INDEX_TRAIN_SAMPLE", "100000")),
+        "rebuild_factor": float(os.getenv("INDEX_REBUILD_FACTOR", "4")),
+    }
+
+
+def _min_train(cfg: dict) -> int:
+    if cfg["type"] == "ivf_flat":
+        return 39
+    if cfg["type"] == "ivf_pq":
+        return 39 * (1 << cfg["pq_nbits"])
+    return 0
+
+
+def _factory_string(cfg: dict, n: int) -> str:
+    kind = cfg["type"]
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"INDEX_TYPE must be one of {INDEX_TYPES}, got {kind!r}")
+    if kind == "flat" or n < _min_train(cfg):
+        return "IDMap,Flat"
+    if kind == "hnsw":
+        return f"IDMap,HNSW{cfg['hnsw_m']}"
+    # keep ~39+ training points per centroid on small corpora
+    nlist = max(1, min(cfg["nlist"], n // 39))
+    if kind == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    return f"IVF{nlist},PQ{cfg['pq_m']}x{cfg['pq_nbits']}"
+
+
+def build_index(embs: np.ndarray, cfg: dict | None = None, dim: int | None = None,
+                ids: np.ndarray | None = None) -> faiss.Index:
+    """
+    Build (and train, if needed) an index of the configured type over `embs`,
+    labelled with `ids` (default 0..n-1).
+    """
+    cfg   = cfg or index_config()
+    dim   = dim or embs.shape[1]
+    embs  = np.ascontiguousarray(embs, dtype=np.float32)
+    index = faiss.index_factory(dim, _factory_string(cfg, len(embs)), faiss.METRIC_INNER_PRODUCT)
+
+    hnsw = _hnsw(index)
+    if hnsw is not None:
+        hnsw.efConstruction = cfg["ef_construction"]
+    if not index.is_trained:
+        n = min(len(embs), cfg["train_sample"])
+        sample = embs[np.random.default_rng(0).choice(len(embs), n, replace=False)]
+        index.train(sample)
+    set_search_params(index, nprobe=cfg["nprobe"], ef_search=cfg["ef_search"])
+    if len(embs):
+        index.add_with_ids(embs, np.arange(len(embs)) if ids is None else np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def remove_ids(index: faiss.Index, ids) -> bool:
+    """
+    Remove vectors by id. Returns False if the index type cannot remove
+    (HNSW), in which case callers must exclude the ids at search time.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return True
+    if _hnsw(index) is not None:
+        return False
+    index.remove_ids(faiss.IDSelectorBatch(ids))
+    return True
+
+
+def needs_rebuild(index: faiss.Index, trained_on: int, cfg: dict | None = None) -> bool:
+    """
+    True when the index should be retrained from the stored embeddings: it
+    is a flat stand-in that can now be trained, or it has outgrown its
+    training set.
+    """
+    cfg = cfg or index_config()
+    if cfg["type"] == "flat":
+        return False
+    n = index.ntotal
+    if describe(index)["type"] == "flat":
+        return n >= _min_train(cfg)
+    return cfg["type"] != "hnsw" and n > max(trained_on, 1) * cfg["rebuild_factor"]
+
+
+def _ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _hnsw(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return getattr(index, "hnsw", None)
+
+
+def set_search_params(index: faiss.Index, nprobe: int | None = None, ef_search: int | None = None):
+    """
+    Set the index-wide defaults for nprobe (IVF) / efSearch (HNSW).
+    """
+    ivf = _ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = _hnsw(index)
+    if hnsw is not None and ef_search:
+        hnsw.efSearch = ef_search
+
+
+def search_params(index: faiss.Index, nprobe: int | None = None, ef_search: int | None = None,
+                  sel: faiss.IDSelector | None = None):
+    """
+    Per-call SearchParameters overriding nprobe/efSearch and/or restricting
+    the search to the ids in `sel`, or None to use the index defaults.
+    """
+    ivf = _ivf(index)
+    if ivf is not None and (nprobe or sel is not None):
+        return faiss.SearchParametersIVF(nprobe=min(nprobe or ivf.nprobe, ivf.nlist), sel=sel)
+    hnsw = _hnsw(index)
+    if hnsw is not None and (ef_search or sel is not None):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or hnsw.efSearch, sel=sel)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+def describe(index: faiss.Index | None) -> dict:
+    """
+    Index type and the parameters that matter for tuning.
+    """
+    if index is None:
+        return {"type": None, "ntotal": 0}
+    if isinstance(index, LayeredIndex):
+        return {**describe(index.base), "ntotal": index.ntotal, "snapshot_next_id": index.covered,
+                "delta": index.delta.ntotal, "excluded": len(index.excluded)}
+    info = {"class": type(faiss.downcast_index(index)).__name__, "d": index.d, "ntotal": index.ntotal}
+    ivf  = _ivf(index)
+    hnsw = _hnsw(index)
+    if ivf is not None:
+        pq = getattr(faiss.downcast_index(ivf), "pq", None)
+        info.update(type="ivf_pq" if pq is not None else "ivf_flat", nlist=ivf.nlist, nprobe=ivf.nprobe)
+        if pq is not None:
+            info.update(pq_m=pq.M, pq_nbits=pq.nbits)
+    elif hnsw is not None:
+        info.update(type="hnsw", M=hnsw.nb_neighbors(1),
+                    ef_construction=hnsw.efConstruction, ef_search=hnsw.efSearch)
+    else:
+        info.update(type="flat")
+    return info
+
+
+# ─── SNAPSHOTS ────────────────────────────────────────────────────────────────
+# Trained indexes are expensive to rebuild, so the index is served from a
+# snapshot. Each snapshot is written to a fresh data file, then published by
+# atomically replacing <path>.json, which names the file and records the
+# chunk-id watermark it covers; older data files are then unlinked (processes
+# that still map them keep a valid view). Readers therefore never see a data
+# file and metadata from different snapshots.
+
+SNAPSHOT_VERSION = 1
+
+# read-only and memory-mapped: the vectors stay in the page cache, shared by
+# every process that opens the same snapshot (older FAISS: IO_FLAG_MMAP)
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def _build_keys(cfg: dict) -> dict:
+    return {k: v for k, v in cfg.items() if k not in SEARCH_KEYS}
+
+
+def save_snapshot(index: faiss.Index, path: str, trained_on: int, cfg: dict, next_id: int):
+    folder, stem = os.path.split(path)
+    name = f"{stem}.data-{uuid.uuid4().hex[:8]}"
+    faiss.write_index(index, os.path.join(folder, name))
+    with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "file": name, "config": _build_keys(cfg),
+                   "trained_on": trained_on, "ntotal": index.ntotal, "next_id": next_id}, f)
+    os.replace(path + ".json.tmp", path + ".json")
+    for old in os.listdir(folder):
+        if old.startswith(f"{stem}.data-") and old != name:
+            try:
+                os.unlink(os.path.join(folder, old))
+            except FileNotFoundError:
+                pass
+
+
+def snapshot_key(path: str):
+    """
+    Identity of the published snapshot (None if there is none); it changes
+    whenever a new one is published.
+    """
+    try:
+        st = os.stat(path + ".json")
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+def load_snapshot(path: str, cfg: dict, mmap: bool = False):
+    """
+    Returns (index, trained_on, next_id) if a snapshot built with the same
+    config exists, else (None, 0, 0). With `mmap`, the index is mapped
+    read-only: it can be searched, but adding to it is not allowed.
+    """
+    for _ in range(5):
+        try:
+            with open(path + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None, 0, 0
+        if meta.get("version") != SNAPSHOT_VERSION or meta["config"] != _build_keys(cfg):
+            return None, 0, 0
+        data = os.path.join(os.path.dirname(path), meta["file"])
+        if not os.path.exists(data):
+            continue  # replaced by a newer snapshot in the meantime
+        try:
+            index = faiss.read_index(data, MMAP_FLAGS if mmap else 0)
+        except RuntimeError:
+            if os.path.exists(data):
+                raise
+            continue
+        set_search_params(index, nprobe=cfg["nprobe"], ef_search=cfg["ef_search"])
+        return index, meta["trained_on"], meta["next_id"]
+    return None, 0, 0
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """
+    Sorted ids of the vectors held by an index.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        ids = faiss.vector_to_array(index.id_map)
+    else:
+        invlists = _ivf(index).invlists
+        parts = []
+        for lst in range(invlists.nlist):
+            n = invlists.list_size(lst)
+            if n:
+                ptr = invlists.get_ids(lst)
+                parts.append(faiss.rev_swig_ptr(ptr, n).copy())
+                invlists.release_ids(lst, ptr)
+        ids = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+    return np.sort(ids.astype(np.int64))
+
+
+# ─── SHARED BASE + DELTA ──────────────────────────────────────────────────────
+# Each worker process maps the same snapshot read-only, so memory stays about
+# flat as workers are added. A mapped index cannot take new vectors: chunks
+# committed after the snapshot go to a small exact in-memory delta, and chunks
+# deleted since are excluded from the base at search time. Once the delta (or
+# the exclusions) grow large, the writer publishes a new snapshot and every
+# worker swaps over to it.
+
+class LayeredIndex:
+    """
+    A read-only base index (or None) covering chunk ids below `covered`,
+    plus an in-memory IDMap,Flat delta. Search, range_search and ntotal
+    follow the faiss.Index interface; `synced` is the store watermark the
+    owner has caught up to.
+    """
+
+    def __init__(self, base: faiss.Index | None, dim: int, covered: int = 0, trained_on: int = 0,
+                 key=None):
+        self.base       = base
+        self.d          = dim
+        self.covered    = covered
+        self.trained_on = trained_on
+        self.key        = key
+        self.synced     = covered
+        self.seen_deleted = None
+        self.delta      = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        self._base_ids  = index_ids(base) if base is not None else np.zeros(0, dtype=np.int64)
+        self.excluded   = np.zeros(0, dtype=np.int64)   # base ids removed since the snapshot
+        self._exclusion: tuple = (None, None, None)     # (excluded, selector, inner selector)
+
+    @property
+    def ntotal(self) -> int:
+        return len(self._base_ids) - len(self.excluded) + self.delta.ntotal
+
+    def add_with_ids(self, embs: np.ndarray, ids: np.ndarray):
+        if len(ids):
+            self.delta.add_with_ids(np.ascontiguousarray(embs, dtype=np.float32),
+                                    np.asarray(ids, dtype=np.int64))
+
+    def remove_ids(self, ids) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        self.delta.remove_ids(faiss.IDSelectorBatch(ids))
+        gone = np.intersect1d(ids, self._base_ids, assume_unique=True)
+        if len(np.setdiff1d(gone, self.excluded, assume_unique=True)):
+            self.excluded = np.union1d(self.excluded, gone)
+
+    def _exclude(self):
+        """
+        Selector skipping the excluded base ids, cached until they change;
+        None when there are none.
+        """
+        excluded = self.excluded
+        if not len(excluded):
+            return None
+        if self._exclusion[0] is not excluded:
+            inner = faiss.IDSelectorBatch(len(excluded), faiss.swig_ptr(excluded))
+            self._exclusion = (excluded, faiss.IDSelectorNot(inner), inner)
+        return self._exclusion[1]
+
+    def search(self, x: np.ndarray, k: int, sel: faiss.IDSelector | None = None):
+        """
+        Top-k over base and delta, merged. `sel` restricts the search to
+        live ids (the exclusions are then implied).
+        """
+        parts = []
+        if self.base is not None and len(self._base_ids):
+            base_sel = sel if sel is not None else self._exclude()
+            parts.append(self.base.search(x, k, params=search_params(self.base, sel=base_sel)))
+        if self.delta.ntotal:
+            params = faiss.SearchParameters(sel=sel) if sel is not None else None
+            parts.append(self.delta.search(x, k, params=params))
+        if not parts:
+            return np.zeros((len(x), k), dtype=np.float32), np.full((len(x), k), -1, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        D = np.hstack([p[0] for p in parts])
+        I = np.hstack([p[1] for p in parts])
+        D[I < 0] = -np.inf
+        top = np.argsort(-D, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(D, top, axis=1), np.take_along_axis(I, top, axis=1)
+
+    def range_search(self, x: np.ndarray, thresh: float):
+        """
+        (lims, D, I) like faiss.Index.range_search; raises RuntimeError if
+        the base index type has none (HNSW).
+        """
+        parts = []
+        if self.base is not None and len(self._base_ids):
+            parts.append(self.base.range_search(
+                x, thresh, params=search_params(self.base, sel=self._exclude())))
+        parts.append(self.delta.range_search(x, thresh))
+        if len(parts) == 1:
+            return parts[0]
+        lims, D, I = [0], [], []
+        for j in range(len(x)):
+            for p_lims, p_D, p_I in parts:
+                D.append(p_D[p_lims[j]:p_lims[j + 1]])
+                I.append(p_I[p_lims[j]:p_lims[j + 1]])
+            lims.append(lims[-1] + sum(len(a) for a in I[-len(parts):]))
+        return (np.array(lims, dtype=np.int64),
+                np.concatenate(D) if D else np.zeros(0, dtype=np.float32),
+                np.concatenate(I) if I else np.zeros(0, dtype=np.int64))
@@ -0,0 +1,103 @@
+import os
+import time
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+# ─── SEMANTIC ANSWER CACHE ────────────────────────────────────────────────────
+#
+# Chatbot answers keyed by query embedding. A lookup hits when a cached
+# question retrieved exactly the same chunk ids and its embedding is within
+# ANSWER_CACHE_THRESHOLD cosine similarity of the new one. Entries are bucketed
+# by chunk ids, so a lookup only compares against questions that could hit.
+# Every entry belongs to one store generation; when the index changes the
+# whole cache is dropped. Lexical-only retrievals have no query embedding and
+# are never cached.
+
+ANSWER_CACHE_SIZE      = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL       = float(os.getenv("ANSWER_CACHE_TTL", "3600"))     # seconds
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self.threshold   = threshold
+        self.generation  = None
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # key -> (emb, ids, answer, t)
+        self._buckets: dict[tuple, set[int]] = {}
+        self._keys = itertools.count()
+        # counters
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _drop(self, key: int):
+        _, ids, _, _ = self._entries.pop(key)
+        bucket = self._buckets[ids]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[ids]
+
+    def _check_generation(self, generation: int):
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += 1
+            self.clear()
+            self.generation = generation
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def lookup(self, q_emb: np.ndarray | None, chunk_ids, generation: int) -> str | None:
+        if q_emb is None:
+            return None
+        self._check_generation(generation)
+        ids = tuple(int(i) for i in chunk_ids)
+        now = time.monotonic()
+        best, best_sim = None, self.threshold
+        for key in list(self._buckets.get(ids, ())):
+            emb, _, _, t = self._entries[key]
+            if now - t > self.ttl:
+                self._drop(key)
+                continue
+            sim = float(np.dot(emb, q_emb))
+            if sim >= best_sim:
+                best, best_sim = key, sim
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(best)
+        return self._entries[best][2]
+
+    def put(self, q_emb: np.ndarray | None, chunk_ids, answer: str, generation: int):
+        if q_emb is None:
+            return
+        self._check_generation(generation)
+        ids = tuple(int(i) for i in chunk_ids)
+        key = next(self._keys)
+        self._entries[key] = (np.array(q_emb, dtype=np.float32), ids, answer, time.monotonic())
+        self._buckets.setdefault(ids, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries":       len(self._entries),
+            "max_entries":   self.max_entries,
+            "ttl_s":         self.ttl,
+            "threshold":     self.threshold,
+            "hits":          self.hits,
+            "misses":        self.misses,
+            "hit_rate":      round(self.hits / total, 4) if total else 0.0,
+            "evictions":     self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = AnswerCache()
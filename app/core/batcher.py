@@ -0,0 +1,100 @@
+import os
+import asyncio
+import contextvars
+from collections import Counter
+
+# ─── RETRIEVAL MICRO-BATCHER ──────────────────────────────────────────────────
+#
+# Concurrent retrieve() calls are collected for up to RETRIEVAL_BATCH_WINDOW_MS
+# (or until RETRIEVAL_MAX_BATCH are waiting), encoded with one embedder call
+# and searched with one index.search in a worker thread. While a batch runs,
+# new callers queue up and form the next, larger batch.
+
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "2"))
+RETRIEVAL_MAX_BATCH       = int(os.getenv("RETRIEVAL_MAX_BATCH", "32"))
+
+
+class RetrievalBatcher:
+    """
+    `search_fn(questions, k)` is a blocking call returning (embeddings, D, I)
+    for all questions; submit() hands each caller back its own row.
+    """
+
+    def __init__(self, search_fn, window_ms: float = RETRIEVAL_BATCH_WINDOW_MS,
+                 max_batch: int = RETRIEVAL_MAX_BATCH):
+        self.search_fn = search_fn
+        self.window    = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue    = None
+        self._worker   = None
+        self._loop     = None
+        # metrics
+        self.batches   = 0
+        self.requests  = 0
+        self.sizes     = Counter()
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker.done():
+            self._queue  = asyncio.Queue()
+            # a context of its own: the worker serves every caller, not the
+            # request that happened to start it (see metrics traces)
+            self._worker = loop.create_task(self._run(), name="retrieval-batcher",
+                                            context=contextvars.Context())
+            self._loop   = loop
+
+    async def submit(self, question: str, k: int):
+        """
+        Queue one question; resolves to (embedding, scores[:k], ids[:k]).
+        """
+        self._ensure_worker()
+        fut = self._loop.create_future()
+        await self._queue.put((question, k, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [item for item in batch if not item[2].cancelled()]
+            if not batch:
+                continue
+            questions = [q for q, _, _ in batch]
+            k_max     = max(k for _, k, _ in batch)
+            try:
+                embs, D, I = await asyncio.to_thread(self.search_fn, questions, k_max)
+            except Exception as e:
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.batches  += 1
+            self.requests += len(batch)
+            self.sizes[len(batch)] += 1
+            for row, (_, k, fut) in enumerate(batch):
+                if not fut.done():
+                    fut.set_result((embs[row], D[row, :k], I[row, :k]))
+
+    def stats(self) -> dict:
+        return {
+            "window_ms":      self.window * 1000,
+            "max_batch":      self.max_batch,
+            "batches":        self.batches,
+            "requests":       self.requests,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes":    dict(sorted(self.sizes.items())),
+        }
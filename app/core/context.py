@@ -0,0 +1,173 @@
+import os
+import re
+
+import numpy as np
+
+from app.core import metrics, retrieval
+
+# ─── CONTEXT BUILDER ──────────────────────────────────────────────────────────
+#
+# What goes into an LLM prompt, under a token budget. Retrieval over-fetches
+# CONTEXT_CANDIDATES chunks; from those, maximal marginal relevance picks a
+# diverse order using the candidates' stored embeddings (no re-encoding):
+#
+#     mmr(c) = λ · sim(question, c) − (1 − λ) · max sim(c, already picked)
+#
+# Candidates nearly identical to a picked excerpt (cosine ≥ CONTEXT_DUP_SIM) or
+# whose text mostly repeats picked excerpts (share of word 5-grams already
+# present ≥ CONTEXT_OVERLAP) are dropped. Excerpts are then packed in that
+# order until CONTEXT_TOKEN_BUDGET is reached; the last one may be cut at a
+# sentence boundary. Without a query embedding (lexical retrieval) the
+# retrieval rank stands in for relevance.
+#
+# Token counts are estimated from the text length (CONTEXT_CHARS_PER_TOKEN;
+# Mistral's tokenizer averages ~3.5 characters per token on English prose).
+# Ollama's exact prompt counts are on qa_llm_tokens_total{kind="prompt"} for
+# calibration.
+
+CONTEXT_TOKEN_BUDGET    = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))   # tokens of excerpts per prompt
+CONTEXT_CANDIDATES      = int(os.getenv("CONTEXT_CANDIDATES", "20"))      # chunks fetched before selection
+CONTEXT_MAX_CHUNKS      = int(os.getenv("CONTEXT_MAX_CHUNKS", "5"))       # the former top-k
+CONTEXT_MMR_LAMBDA      = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))   # 1: relevance only
+CONTEXT_DUP_SIM         = float(os.getenv("CONTEXT_DUP_SIM", "0.95"))
+CONTEXT_OVERLAP         = float(os.getenv("CONTEXT_OVERLAP", "0.6"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "3.5"))
+MIN_EXCERPT_TOKENS      = 48    # a shorter cut-off tail is not worth including
+
+SEPARATOR = "\n\n---\n\n"
+SHINGLE   = 5
+WORD      = re.compile(r"\w+")
+
+CONTEXT_TOKENS = metrics.Histogram(
+    "qa_context_tokens", "Estimated tokens of excerpts packed into a prompt", ("pipeline",),
+    buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192),
+)
+
+
+def count_tokens(text: str) -> int:
+    return int(len(text) / CONTEXT_CHARS_PER_TOKEN + 0.5)
+
+
+def _shingles(text: str) -> set:
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1)}
+
+
+def _truncate(text: str, tokens: int) -> str:
+    """
+    The start of `text` within `tokens`, ending at a sentence boundary when
+    one falls in the second half.
+    """
+    cut = text[:int(tokens * CONTEXT_CHARS_PER_TOKEN)]
+    end = cut.rfind(". ")
+    if end >= len(cut) // 2:
+        return cut[:end + 1]
+    return cut.rsplit(" ", 1)[0] + " …"
+
+
+def mmr_order(q_emb: np.ndarray | None, embs: np.ndarray, lam: float = CONTEXT_MMR_LAMBDA) -> list[int]:
+    """
+    Indices of `embs` (rows L2-normalized, in retrieval order) by maximal
+    marginal relevance to `q_emb`.
+    """
+    n = len(embs)
+    if q_emb is None:
+        relevance = 1.0 - np.arange(n, dtype=np.float32) / max(n, 1)
+    else:
+        relevance = embs @ q_emb
+    sims = embs @ embs.T
+    order: list[int] = []
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    left = np.ones(n, dtype=bool)
+    for _ in range(n):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        score = np.where(left, lam * relevance - (1 - lam) * penalty, -np.inf)
+        best = int(np.argmax(score))
+        order.append(best)
+        left[best] = False
+        redundancy = np.maximum(redundancy, sims[best])
+    return order
+
+
+def build_context(q_emb: np.ndarray | None, ids: list[int], texts: list[str],
+                  budget: int = CONTEXT_TOKEN_BUDGET, max_chunks: int = CONTEXT_MAX_CHUNKS,
+                  pipeline: str = "query") -> tuple[list[int], list[str], dict]:
+    """
+    Select and pack retrieved candidates (best first) into at most `budget`
+    tokens; candidates deleted in the meantime are skipped. Returns the
+    chosen (ids, excerpts), best first, and stats.
+    """
+    with metrics.stage(pipeline, "context"):
+        stats = {"candidates": len(ids), "gone": 0, "duplicates": 0, "overlaps": 0, "over_budget": 0,
+                 "chunks": 0, "tokens": 0, "budget": budget}
+        # a delete or compaction since retrieval returned may have removed some
+        store = retrieval.store
+        live = [j for j, i in enumerate(ids) if store.contains(i)]
+        stats["gone"] = len(ids) - len(live)
+        ids, texts = [ids[j] for j in live], [texts[j] for j in live]
+        if not ids:
+            CONTEXT_TOKENS.observe(0, pipeline=pipeline)
+            return [], [], stats
+        embs = np.stack([store.embedding_at(i) for i in ids]).astype(np.float32, copy=False)
+        order = mmr_order(q_emb, embs)
+
+        picked: list[int] = []
+        out_ids, out_texts, seen = [], [], set()
+        used = 0
+        sep = count_tokens(SEPARATOR)
+        for j in order:
+            if len(out_ids) >= max_chunks or budget - used < MIN_EXCERPT_TOKENS:
+                break
+            if picked and float(np.max(embs[picked] @ embs[j])) >= CONTEXT_DUP_SIM:
+                stats["duplicates"] += 1
+                continue
+            shingles = _shingles(texts[j])
+            if shingles and len(shingles & seen) >= CONTEXT_OVERLAP * len(shingles):
+                stats["overlaps"] += 1
+                continue
+            text = texts[j]
+            cost = count_tokens(text) + (sep if out_ids else 0)
+            if used + cost > budget:
+                room = budget - used - (sep if out_ids else 0)
+                if room < MIN_EXCERPT_TOKENS:
+                    stats["over_budget"] += 1
+                    continue
+                text = _truncate(text, room)
+                cost = count_tokens(text) + (sep if out_ids else 0)
+            picked.append(j)
+            seen |= shingles
+            out_ids.append(ids[j])
+            out_texts.append(text)
+            used += cost
+        stats.update(chunks=len(out_ids), tokens=used)
+        CONTEXT_TOKENS.observe(used, pipeline=pipeline)
+        return out_ids, out_texts, stats
+
+
+async def retrieve_context(question: str, budget: int = CONTEXT_TOKEN_BUDGET, filters: dict | None = None,
+                           mode: str | None = None, max_chunks: int = CONTEXT_MAX_CHUNKS,
+                           pipeline: str = "query") -> tuple[np.ndarray | None, list[int], list[str], dict]:
+    """
+    Over-fetch CONTEXT_CANDIDATES chunks for `question` and build its context.
+    Returns (query embedding, chosen ids, excerpts, stats).
+    """
+    q_emb, ids, texts = await retrieval.retrieve_hits(
+        question, max(CONTEXT_CANDIDATES, max_chunks), filters=filters, mode=mode
+    )
+    ids, texts, stats = build_context(q_emb, ids, texts, budget, max_chunks, pipeline)
+    return q_emb, ids, texts, stats
+
+
+async def retrieve_contexts(questions: list[str], budget: int = CONTEXT_TOKEN_BUDGET, filters: dict | None = None,
+                            mode: str | None = None, max_chunks: int = CONTEXT_MAX_CHUNKS,
+                            pipeline: str = "query") -> list[tuple[np.ndarray | None, list[int], list[str], dict]]:
+    """
+    retrieve_context() for many questions, retrieved in one batch.
+    """
+    hits = await retrieval.retrieve_hits_many(
+        questions, max(CONTEXT_CANDIDATES, max_chunks), filters=filters, mode=mode
+    )
+    return [(q_emb, *build_context(q_emb, ids, texts, budget, max_chunks, pipeline))
+            for q_emb, ids, texts in hits]
@@ -0,0 +1,157 @@
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+# ─── EMBEDDING BACKENDS ───────────────────────────────────────────────────────
+#
+# EMBED_BACKEND selects how chunks and questions are embedded; every backend
+# returns L2-normalized float32 vectors of the same model, so they can be
+# swapped without re-embedding the store:
+#   torch      SentenceTransformer (the reference)
+#   onnx       the same transformer exported to ONNX, run by ONNX Runtime
+#   onnx-int8  that export with dynamically int8-quantized weights
+#
+# The ONNX export is done once (it needs torch and transformers) and cached
+# under EMBED_ONNX_DIR; afterwards only onnxruntime and tokenizers are loaded.
+# EMBED_THREADS caps the intra-op threads of either runtime (0: all cores).
+
+EMBED_MODEL    = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_BACKEND  = os.getenv("EMBED_BACKEND", "torch")
+EMBED_THREADS  = int(os.getenv("EMBED_THREADS", "0"))
+EMBED_MAX_SEQ  = int(os.getenv("EMBED_MAX_SEQ", "256"))    # tokens; the model's max_seq_length
+EMBED_ONNX_DIR = os.getenv(
+    "EMBED_ONNX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+)
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+class Embedder(ABC):
+    """
+    encode(texts) -> (n, dim) float32, rows L2-normalized. A backend that
+    does not implement encode cannot be instantiated.
+    """
+    backend = ""
+    dim = 0
+
+    @abstractmethod
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        ...
+
+
+class TorchEmbedder(Embedder):
+    backend = "torch"
+
+    def __init__(self, model: str = EMBED_MODEL, threads: int = EMBED_THREADS):
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model)
+        self.dim   = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        return np.asarray(self.model.encode(
+            texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ), dtype=np.float32)
+
+
+def export_onnx(model: str = EMBED_MODEL, out_dir: str = EMBED_ONNX_DIR, quantize: bool = False) -> str:
+    """
+    Path of the ONNX export of `model` (int8-quantized with `quantize`),
+    exporting it first if it is not cached yet. The tokenizer is saved next
+    to it.
+    """
+    model_dir = os.path.join(out_dir, model.replace("/", "__"))
+    fp32 = os.path.join(model_dir, "model.onnx")
+    int8 = os.path.join(model_dir, "model-int8.onnx")
+    if not os.path.exists(fp32):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        name = model if "/" in model else f"sentence-transformers/{model}"
+        os.makedirs(model_dir, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        tokenizer.save_pretrained(model_dir)
+        net = AutoModel.from_pretrained(name).eval()
+        net.config.return_dict = False
+        sample = tokenizer(["an example sentence"], return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+        with torch.no_grad():
+            torch.onnx.export(
+                net, tuple(sample[n] for n in names), fp32 + ".tmp",
+                input_names=names, output_names=["last_hidden_state"],
+                dynamic_axes={n: {0: "batch", 1: "seq"} for n in [*names, "last_hidden_state"]},
+                opset_version=14,
+            )
+        os.replace(fp32 + ".tmp", fp32)
+    if quantize and not os.path.exists(int8):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32, int8 + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(int8 + ".tmp", int8)
+    return int8 if quantize else fp32
+
+
+class OnnxEmbedder(Embedder):
+    """
+    The transformer in ONNX Runtime, followed by the same mean pooling and
+    normalization as the sentence-transformers pipeline.
+    """
+
+    def __init__(self, model: str = EMBED_MODEL, quantize: bool = False, threads: int = EMBED_THREADS,
+                 max_seq: int = EMBED_MAX_SEQ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.backend = "onnx-int8" if quantize else "onnx"
+        path = export_onnx(model, quantize=quantize)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.inputs  = {i.name for i in self.session.get_inputs()}
+        self.dim     = int(self.session.get_outputs()[0].shape[-1])
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(path), "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_seq)
+        self.tokenizer.enable_padding()
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        # longest first, so each batch is padded to similar lengths
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        for at in range(0, len(texts), batch_size):
+            rows = order[at:at + batch_size]
+            enc  = self.tokenizer.encode_batch([texts[i] for i in rows])
+            mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+            feed = {"input_ids": np.array([e.ids for e in enc], dtype=np.int64), "attention_mask": mask}
+            if "token_type_ids" in self.inputs:
+                feed["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+            hidden = self.session.run(None, feed)[0]
+            m = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+            out[rows] = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+
+def make_embedder(backend: str = EMBED_BACKEND, model: str = EMBED_MODEL,
+                  threads: int = EMBED_THREADS) -> Embedder:
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBED_BACKEND must be one of {BACKENDS}, got {backend!r}")
+    if backend == "torch":
+        return TorchEmbedder(model, threads)
+    return OnnxEmbedder(model, quantize=backend == "onnx-int8", threads=threads)
+
+
+def parity(embedder: Embedder, texts: list[str], reference: np.ndarray) -> dict:
+    """
+    Cosine similarity of the embedder's vectors for `texts` against
+    reference vectors of the same texts (e.g. stored torch embeddings).
+    """
+    if not len(texts):
+        return {"n": 0, "min": 1.0, "mean": 1.0}
+    sims = np.sum(embedder.encode(list(texts)) * reference, axis=1)
+    return {"n": len(texts), "min": round(float(sims.min()), 6), "mean": round(float(sims.mean()), 6)}
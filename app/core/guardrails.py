@@ -1,9 +1,151 @@
+import os
 import re
+import time
+import threading
 from fastapi import HTTPException
 
 bad_words = ["classified", "confidential", "insider", "slur", "hate", "bully", "damn", "hell", "ass", "bitch", "shit", "fuck", "racist", "sexist", "homophobic", "bigot", "weed", "coke", "meth", "stoned", "kill", "murder", "assault", "weapon", "cheat", "plagiarize", "copycat", "douche", "loser", "suck", "crap", "porn", "nude", "sex", "kink"]
 
+# Optional term list (one per line, '#' comments) that replaces bad_words.
+# It is re-read whenever its mtime changes, checked at most every
+# GUARDRAIL_RELOAD_S seconds, so edits apply without a restart.
+TERMS_FILE = os.getenv("GUARDRAIL_TERMS_FILE", "")
+RELOAD_S   = float(os.getenv("GUARDRAIL_RELOAD_S", "1"))
+
+# ─── Compiled matcher ─────────────────────────────────────────────────────
+def _trie_regex(terms: list[str]) -> str:
+    """
+    Fold the terms into a prefix trie and emit it as one regex, so matching
+    at a position costs the depth of the trie, not the number of terms.
+    """
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        end = "" in node
+        branches = [
+            (r"\s+" if ch == " " else re.escape(ch)) + emit(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not end:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if end else group
+
+    return emit(trie)
+
+class TermMatcher:
+    """
+    All terms compiled once into a single case-insensitive regex with
+    word-boundary semantics (a term never matches inside a longer word).
+    """
+
+    def __init__(self, terms: list[str]):
+        self.terms   = sorted({t.strip().lower() for t in terms if t.strip()})
+        self.max_len = max((len(t) for t in self.terms), default=0)
+        body = _trie_regex(self.terms) if self.terms else r"(?!x)x"
+        self.pattern = re.compile(rf"(?<!\w)(?:{body})(?!\w)", re.IGNORECASE)
+
+    def find(self, text: str) -> str | None:
+        m = self.pattern.search(text)
+        return m.group(0).lower() if m else None
+
+    def stream(self) -> "StreamScanner":
+        return StreamScanner(self)
+
+class StreamScanner:
+    """
+    Incremental scan of streamed output. feed() returns (safe_text, term):
+    text that can no longer be part of a match is released, and the last
+    max_len characters are held back until the next token (or close()) so
+    a banned term is never partially emitted.
+    """
+
+    def __init__(self, matcher: TermMatcher):
+        self.matcher = matcher
+        self.hold    = matcher.max_len + 1
+        self.buffer  = ""   # held-back text not yet released
+        self.context = ""   # one released char, for the word-boundary lookbehind
+
+    def _scan(self, final: bool) -> str | None:
+        text = self.context + self.buffer
+        for m in self.matcher.pattern.finditer(text, len(self.context)):
+            # a match touching the end may still grow into a longer word
+            if final or m.end() < len(text):
+                return m.group(0).lower()
+        return None
+
+    def feed(self, token: str) -> tuple[str, str | None]:
+        self.buffer += token
+        term = self._scan(final=False)
+        if term:
+            return "", term
+        if len(self.buffer) <= self.hold:
+            return "", None
+        cut = len(self.buffer) - self.hold
+        safe, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        self.context = safe[-1:]
+        return safe, None
+
+    def close(self) -> tuple[str, str | None]:
+        term = self._scan(final=True)
+        rest, self.buffer = ("" if term else self.buffer), ""
+        return rest, term
+
+# ─── Hot-reloadable engine ────────────────────────────────────────────────
+class Guardrail:
+    def __init__(self, default_terms: list[str], path: str = "", reload_s: float = 1.0):
+        self.default_terms = default_terms
+        self.path          = path
+        self.reload_s      = reload_s
+        self._mtime        = None
+        self._checked      = 0.0
+        self._lock         = threading.Lock()
+        self.matcher       = TermMatcher(default_terms)
+        self._maybe_reload(force=True)
+
+    def _read_terms(self) -> list[str]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+
+    def _maybe_reload(self, force: bool = False):
+        if not self.path:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_s:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                # build first, then swap: readers always see a complete matcher
+                self.matcher = TermMatcher(self._read_terms())
+                self._mtime  = mtime
+
+    def current(self) -> TermMatcher:
+        self._maybe_reload()
+        return self.matcher
+
+    def find(self, text: str) -> str | None:
+        return self.current().find(text)
+
+    def stream(self) -> StreamScanner:
+        return self.current().stream()
+
+guardrail = Guardrail(bad_words, TERMS_FILE, RELOAD_S)
+
 async def check_query(q: str):
-    for term in banned_terms:
-        if re.search(rf"\b{term}\b", q, re.IGNORECASE):
-            raise HTTPException(400, f"Query contains banned term: {term}")
\ No newline at end of file
+    term = guardrail.find(q)
+    if term:
+        raise HTTPException(400, f"Query contains banned term: {term}")
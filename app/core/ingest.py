@@ -0,0 +1,344 @@
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+from contextlib import aclosing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from app.core import metrics
+from app.core.retrieval import Chunker, PendingBatch, delete_doc, store
+from app.utils.file_utils import (
+    PAGE_WINDOW, file_sha256, is_pdf, iter_pages, pdf_page_count, read_pages,
+)
+
+# ─── INGESTION JOB QUEUE ──────────────────────────────────────────────────────
+#
+# /upload only saves the files and enqueues a job. A single worker task drains
+# the queue and streams each file through pages -> chunks -> fixed-size
+# embedding batches: PDF page windows are parsed in a process pool a few
+# windows ahead, the chunker carries partial sentences across pages, and every
+# INGEST_BATCH_SIZE new chunks are encoded and committed in a thread. Memory
+# stays bounded by the window and batch sizes, not the document size, and the
+# event loop never runs extraction or encoding itself.
+#
+# Files whose content hash was ingested before are skipped outright, and
+# chunks whose normalized text is already stored are reused rather than
+# re-encoded and re-added. A file's record is committed with its last chunks.
+#
+# A replace job streams the new version under the existing document id, then
+# deletes the old version's chunks that the new one did not reuse, so queries
+# see the old version until the new one is fully committed.
+
+INGEST_PROCESSES   = int(os.getenv("INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) - 1))))
+INGEST_BATCH_SIZE  = int(os.getenv("INGEST_BATCH_SIZE", "256"))   # chunks per encode + commit
+INGEST_MAX_FILES   = int(os.getenv("INGEST_MAX_FILES", "64"))     # files per commit
+CHUNK_SIZE         = int(os.getenv("CHUNK_SIZE", "500"))
+MAX_JOBS_KEPT      = 1000
+
+jobs: "OrderedDict[str, dict]" = OrderedDict()
+
+# async callables run (in the background) after each successful commit
+after_commit: list = []
+_hook_tasks: set = set()
+
+_queue: asyncio.Queue | None = None
+_worker: asyncio.Task | None = None
+_pool: ProcessPoolExecutor | None = None
+
+
+def _ensure_worker():
+    global _queue, _worker, _pool
+    if _queue is None:
+        _queue = asyncio.Queue()
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=INGEST_PROCESSES)
+    if _worker is None or _worker.done():
+        # not tied to the request that happened to start it
+        _worker = asyncio.create_task(_run_worker(), name="ingest-worker", context=contextvars.Context())
+
+
+def _set(job: dict, **fields):
+    job.update(fields, updated_at=time.time())
+
+
+async def enqueue(paths: list[str], filenames: list[str], tags: list[str] | None = None,
+                  replace: int | None = None, shas: list[str] | None = None) -> str:
+    """
+    Register a new ingestion job for already-saved files and return its id.
+    `tags` are attached to every document of the job, for filtered search.
+    With `replace`, the single file becomes the new version of that document
+    id, keeping its tags when `tags` is None (an empty list clears them).
+    `shas` are the files' SHA-256 digests when the caller computed them
+    while saving.
+    """
+    _ensure_worker()
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {
+        "job_id":     job_id,
+        "status":     "queued",
+        "files":      filenames,
+        "files_skipped": [],
+        "files_failed": [],
+        "doc_ids":    [],
+        "chunks":     0,
+        "chunks_new": 0,
+        "chunks_reused": 0,
+        "chunks_deleted": 0,
+        "replaces":   replace,
+        "error":      None,
+        "created_at": time.time(),
+        "updated_at": time.time(),
+    }
+    while len(jobs) > MAX_JOBS_KEPT:
+        jobs.popitem(last=False)
+    files = list(zip(paths, filenames, shas or [None] * len(paths)))
+    await _queue.put((job_id, files, None if tags is None else list(tags), replace))
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    return jobs.get(job_id)
+
+
+def queue_depth() -> int:
+    return _queue.qsize() if _queue is not None else 0
+
+
+async def _run_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        # coalesce whatever else is already waiting into the same commit
+        n_files = len(batch[0][1])
+        while not _queue.empty() and n_files < INGEST_MAX_FILES:
+            item = _queue.get_nowait()
+            batch.append(item)
+            n_files += len(item[1])
+
+        try:
+            # one trace per commit batch, named after its first job
+            with metrics.trace(batch[0][0][:16]) as t:
+                await _ingest(loop, batch)
+            metrics.log_trace(t, f"ingest jobs={len(batch)} files={n_files}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+class _CommitError(Exception):
+    pass
+
+
+async def _ingest(loop, batch: list[tuple[str, list[tuple[str, str, str | None]], list[str] | None, int | None]]):
+    for job_id, _, _, _ in batch:
+        if job_id in jobs:
+            metrics.record("ingest", "queued", time.time() - jobs[job_id]["created_at"])
+            _set(jobs[job_id], status="running")
+
+    # 1) whole-file dedup: hash (unless the upload already did), then skip
+    #    files already ingested (or repeated within this batch) before doing
+    #    any parsing
+    seen_files: dict[str, str] = {}
+    todo: dict[str, list[tuple[str, str, str]]] = {}
+    tags = {job_id: job_tags for job_id, _, job_tags, _ in batch}
+    replaces = {job_id: replace for job_id, _, _, replace in batch if replace is not None}
+    for job_id, files, _, replace in batch:
+        with metrics.stage("ingest", "hash"):
+            hashed = iter(await asyncio.gather(*(
+                asyncio.to_thread(file_sha256, p) for p, _, sha in files if not sha
+            )))
+            shas = [sha or next(hashed) for _, _, sha in files]
+        todo[job_id] = []
+        if tags[job_id] is None:
+            # not given: a new version keeps the document's tags
+            tags[job_id] = list((store.doc(replace) or {}).get("tags", [])) if replace is not None else []
+        for (path, name, _), sha in zip(files, shas):
+            prior = store.find_file(sha)
+            if prior is not None or sha in seen_files:
+                dup_of = prior["name"] if prior is not None else seen_files[sha]
+                metrics.INGEST_FILES.inc(result="skipped")
+                if job_id in jobs:
+                    unchanged = prior is not None and prior.get("doc") == replace
+                    jobs[job_id]["files_skipped"].append(
+                        {"file": name, "unchanged": True} if unchanged else {"file": name, "duplicate_of": dup_of}
+                    )
+                try:
+                    os.unlink(path)   # the saved upload adds nothing
+                except FileNotFoundError:
+                    pass
+                continue
+            seen_files[sha] = name
+            todo[job_id].append((path, name, sha))
+
+    # 2) stream every file into a shared batch that is committed whenever
+    #    it fills, then commit the remainder (and the last file records). A
+    #    file that fails is dropped from the batch and the job goes on with
+    #    its other files.
+    pending = PendingBatch(INGEST_BATCH_SIZE)
+    committed = 0
+    errors: dict[str, list[dict]] = {job_id: [] for job_id in todo}
+    ingested: dict[str, int] = {job_id: 0 for job_id in todo}
+    orphans: list[int] = []                     # doc ids of failed new files
+    replaced: dict[str, tuple[int, int]] = {}   # job -> (doc, first id of the new version)
+    try:
+        for job_id, files in todo.items():
+            counts = [0, 0]  # new, reused
+            for path, name, sha in files:
+                n = 0
+                before = list(counts)
+                if job_id in replaces:
+                    doc = replaces[job_id]
+                    replaced[job_id] = (doc, store.next_id)
+                else:
+                    doc = store.reserve_doc_id()
+                try:
+                    chunker = Chunker(CHUNK_SIZE)
+                    async with aclosing(_read_pages(loop, path)) as windows:
+                        async for pages in windows:
+                            n += await asyncio.to_thread(_plan, chunker, pages, pending, counts, doc)
+                            _progress(job_id, counts)
+                            while pending.full():
+                                committed += await _flush(pending)
+                    n += await asyncio.to_thread(_plan, chunker, None, pending, counts, doc)
+                except _CommitError:
+                    raise
+                except Exception as e:
+                    # rows already committed by an earlier flush are deleted below
+                    pending.discard(doc)
+                    counts[:] = before
+                    if job_id not in replaces:
+                        orphans.append(doc)
+                    metrics.INGEST_FILES.inc(result="failed")
+                    errors[job_id].append({"file": name, "error": f"extraction failed: {e}"})
+                    if job_id in jobs:
+                        jobs[job_id]["files_failed"].append(errors[job_id][-1])
+                    continue
+                pending.files[sha] = {
+                    "name": name, "chunks": n, "added_at": time.time(), "doc": doc, "tags": tags[job_id],
+                    "shared": sorted(pending.shared.pop(doc, ())),
+                }
+                metrics.INGEST_FILES.inc(result="ingested")
+                ingested[job_id] += 1
+                if job_id in jobs:
+                    jobs[job_id]["doc_ids"].append(doc)
+            _progress(job_id, counts)
+            metrics.INGEST_CHUNKS.inc(counts[0], result="new")
+            metrics.INGEST_CHUNKS.inc(counts[1], result="reused")
+        committed += await _flush(pending)
+    except _CommitError as e:
+        for job_id in todo:
+            if job_id in jobs:
+                _set(jobs[job_id], status="failed", error=str(e.__cause__))
+        return
+
+    # a job fails when none of its files made it
+    failed = {job_id for job_id, errs in errors.items() if errs and not ingested[job_id]}
+
+    # 3) new versions are committed: drop what is left of the old ones, and
+    #    whatever failed files committed before failing. A failed
+    #    replacement keeps the old version and loses what the new one
+    #    committed.
+    for job_id, (doc, first_new) in replaced.items():
+        if job_id in failed:
+            with metrics.stage("ingest", "delete"):
+                old = await asyncio.to_thread(store.doc_chunks, doc)
+                committed += await asyncio.to_thread(
+                    delete_doc, doc, old[old < first_new], None, False
+                )
+            continue
+        with metrics.stage("ingest", "delete"):
+            deleted = await asyncio.to_thread(
+                delete_doc, doc, pending.kept.get(doc, ()), first_new, False
+            )
+        committed += deleted
+        if job_id in jobs:
+            _set(jobs[job_id], chunks_deleted=deleted)
+    for doc in orphans:
+        with metrics.stage("ingest", "delete"):
+            committed += await asyncio.to_thread(delete_doc, doc, (), None, False)
+
+    for job_id, _, _, _ in batch:
+        if job_id not in jobs:
+            continue
+        errs = errors.get(job_id)
+        if errs:
+            error = "; ".join(f"{e['file']}: {e['error']}" for e in errs)
+            _set(jobs[job_id], status="failed" if job_id in failed else "done", error=error)
+        else:
+            _set(jobs[job_id], status="done")
+
+    if committed:
+        for hook in after_commit:
+            task = asyncio.create_task(hook(), context=contextvars.Context())
+            _hook_tasks.add(task)
+            task.add_done_callback(_hook_tasks.discard)
+
+
+async def _read_pages(loop, path: str):
+    """
+    Yield a document's (page, text) pieces a window at a time. PDF windows
+    are parsed in the process pool, up to INGEST_PROCESSES windows ahead.
+    """
+    if not is_pdf(path):
+        pieces = iter_pages(path)
+        while True:
+            with metrics.stage("ingest", "parse"):
+                window = await asyncio.to_thread(lambda: list(islice(pieces, PAGE_WINDOW)))
+            if not window:
+                return
+            metrics.INGEST_PAGES.inc(len(window))
+            yield window
+
+    n_pages = await loop.run_in_executor(_pool, pdf_page_count, path)
+    starts  = iter(range(0, n_pages, PAGE_WINDOW))
+    ahead   = deque(
+        loop.run_in_executor(_pool, read_pages, path, s) for s in islice(starts, INGEST_PROCESSES)
+    )
+    try:
+        while ahead:
+            # waiting on the pool: the part of parsing not overlapped with the rest
+            with metrics.stage("ingest", "parse"):
+                window = await ahead.popleft()
+            metrics.INGEST_PAGES.inc(len(window))
+            nxt = next(starts, None)
+            if nxt is not None:
+                ahead.append(loop.run_in_executor(_pool, read_pages, path, nxt))
+            yield window
+    finally:
+        for fut in ahead:
+            fut.cancel()
+
+
+def _plan(chunker: Chunker, pages, pending: PendingBatch, counts: list[int], doc: int) -> int:
+    """
+    Chunk a window of pages (or flush the chunker when `pages` is None) into
+    the pending batch, tagged with document id `doc`. Returns the number of
+    chunks produced.
+    """
+    with metrics.stage("ingest", "chunk"):
+        cks = chunker.close() if pages is None else [
+            ck for page, text in pages for ck in chunker.feed(page, text)
+        ]
+        n = 0
+        for chunk, page in cks:
+            if not chunk:
+                continue
+            n += 1
+            counts[0 if pending.add(chunk, page, doc) else 1] += 1
+    return n
+
+
+async def _flush(pending: PendingBatch) -> int:
+    try:
+        return await asyncio.to_thread(pending.flush)
+    except Exception as e:
+        raise _CommitError from e
+
+
+def _progress(job_id: str, counts: list[int]):
+    if job_id in jobs:
+        new, reused = counts
+        _set(jobs[job_id], chunks=new + reused, chunks_new=new, chunks_reused=reused)
@@ -1,21 +1,21 @@
 import os
-import datetime
 import re
-from pathlib import Path
+import asyncio
+import hashlib
+import logging
 
-import pandas as pd
 from fastapi import HTTPException
 
 from langchain_community.llms import Ollama
 from langchain_core.prompts import PromptTemplate
 from langchain.chains import LLMChain
 
-from app.core.retrieval import retrieve
+from app.core import ingest, metrics, reports
+from app.core.context import SEPARATOR, retrieve_context
+from app.core.reports import write_report
+from app.core.retrieval import store
 
-# ─── Prepare reports folder ───────────────────────────────────────────────
-BASE_DIR   = Path(__file__).parent.parent
-REPORT_DIR = BASE_DIR / "reports"
-REPORT_DIR.mkdir(exist_ok=True)
+log = logging.getLogger("uvicorn.error")
 
 # ─── Initialize the Ollama LLM with configurable host ────────────────────
 ollama_host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
@@ -43,38 +43,105 @@ a) … b) … c) … d) …, and then at the end write: Correct Answer: <l
 """,
 )
 
+# Chains are stateless, so build them once
+checklist_chain = LLMChain(llm=llm, prompt=checklist_template)
+quiz_chain      = LLMChain(llm=llm, prompt=quiz_template)
+
+# ─── Materials cache ──────────────────────────────────────────────────────
+# Generated materials only change when the documents or the prompts do, so
+# they are cached under (documents signature, prompt/model hash). The
+# signature covers the id and content hash of every stored document the
+# agent retrieves from, so compaction leaves it unchanged.
+# Concurrent requests for the same key share one generation.
+PROMPT_HASH = hashlib.sha256(
+    "\0".join([llm.model, checklist_template.template, quiz_template.template]).encode("utf-8")
+).hexdigest()[:16]
+PREWARM = os.getenv("ONBOARDING_PREWARM", "0") == "1"
+
+_cache: dict[tuple, asyncio.Future] = {}
+
+def _docs_signature() -> str:
+    pairs = sorted((d["doc"], d["sha256"]) for d in store.docs())
+    return hashlib.sha256(repr(pairs).encode("utf-8")).hexdigest()[:16]
+
+def _cache_key() -> tuple:
+    return (_docs_signature(), PROMPT_HASH)
+
+async def _checklist_branch() -> list[str]:
+    # 1) Retrieve policy excerpts, packed into the context budget
+    _, _, policy_docs, _ = await retrieve_context("onboarding policy", pipeline="onboarding")
+    if not policy_docs:
+        raise ValueError("No policy docs found for 'onboarding policy'.")
+    policy_text = SEPARATOR.join(policy_docs)
+
+    # 2) Generate Week-1 checklist
+    with metrics.stage("onboarding", "checklist"):
+        checklist_text = await checklist_chain.arun(docs=policy_text)
+    return [
+        line.lstrip("-* ").strip()
+        for line in checklist_text.splitlines()
+        if line.strip()
+    ]
+
+async def _quiz_branch() -> str:
+    # 3) Retrieve safety excerpts
+    _, _, safety_docs, _ = await retrieve_context("safety", pipeline="onboarding")
+    if not safety_docs:
+        raise ValueError("No safety docs found for 'safety'.")
+    safety_text = SEPARATOR.join(safety_docs)
+
+    # 4) Generate mini-quiz
+    with metrics.stage("onboarding", "quiz"):
+        return await quiz_chain.arun(docs=safety_text)
+
 async def run_onboarding_agent_lc(question: str) -> dict:
     """
-    Runs two chains and returns:
+    Returns cached materials for the current documents, generating
+    them if needed:
      - filename: the Excel checklist filename
      - checklist: list[str]
      - quiz: list[{"question": str, "options": list[str], "answer": str}]
     """
+    metrics.AGENT_RUNS.inc(agent="onboarding")
+    key = _cache_key()
+    fut = _cache.get(key)
+    if fut is not None and fut.done() and (
+        fut.cancelled() or fut.exception() is not None
+        or not (reports.REPORT_DIR / fut.result()["filename"]).exists()
+    ):
+        fut = None  # failed, cancelled, or its report was cleaned up: regenerate
+    cached = fut is not None and fut.done()
+    if fut is None:
+        fut = asyncio.ensure_future(_generate())
+        _cache.clear()  # materials for older documents are never served again
+        _cache[key] = fut
     try:
-        # 1) Retrieve policy excerpts
-        policy_docs = await retrieve("onboarding policy")
-        if not policy_docs:
-            raise ValueError("No policy docs found for 'onboarding policy'.")
-        policy_text = "\n\n---\n\n".join(policy_docs)
-
-        # 2) Generate Week-1 checklist
-        checklist_chain = LLMChain(llm=llm, prompt=checklist_template)
-        checklist_text = await checklist_chain.arun(docs=policy_text)
-        checklist_items = [
-            line.lstrip("-* ").strip()
-            for line in checklist_text.splitlines()
-            if line.strip()
-        ]
-
-        # 3) Retrieve safety excerpts
-        safety_docs = await retrieve("safety")
-        if not safety_docs:
-            raise ValueError("No safety docs found for 'safety'.")
-        safety_text = "\n\n---\n\n".join(safety_docs)
-
-        # 4) Generate mini-quiz
-        quiz_chain = LLMChain(llm=llm, prompt=quiz_template)
-        quiz_text = await quiz_chain.arun(docs=safety_text)
+        # shield: one caller disconnecting must not cancel the shared run
+        return dict(await asyncio.shield(fut), cached=cached)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Onboarding agent error: {e}")
+
+async def prewarm():
+    """
+    Generate materials for the current documents ahead of the first
+    request (run after ingestion when ONBOARDING_PREWARM=1).
+    """
+    try:
+        await run_onboarding_agent_lc("prewarm")
+    except HTTPException:
+        pass
+
+if PREWARM:
+    ingest.after_commit.append(prewarm)
+
+async def _generate() -> dict:
+    """
+    Runs the checklist and quiz chains concurrently.
+    """
+    try:
+        checklist_items, quiz_text = await asyncio.gather(_checklist_branch(), _quiz_branch())
 
         # 5) Parse the quiz into structured form
         quiz: list[dict] = []
@@ -121,23 +188,23 @@ async def run_onboarding_agent_lc(question: str) -> dict:
                 current_q["answer"] = ""
             quiz.append(current_q)
 
-        # 6) Write checklist to Excel (no quiz in Excel)
-        ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"onboarding_{ts}.xlsx"
-        filepath = REPORT_DIR / filename
-
-        with pd.ExcelWriter(filepath, engine="openpyxl") as writer:
-            pd.DataFrame({"Week 1 Checklist": checklist_items}) \
-              .to_excel(writer, sheet_name="Week1 Checklist", index=False)
+        # 6) Write checklist to Excel (no quiz in Excel), off the event loop
+        with metrics.stage("onboarding", "report"):
+            filepath = await asyncio.to_thread(
+                write_report,
+                "onboarding",
+                ["Week 1 Checklist"],
+                ({"Week 1 Checklist": item} for item in checklist_items),
+                "Week1 Checklist",
+            )
 
         # 7) Return structured payload
         return {
-            "filename": filename,
+            "filename": filepath.name,
             "checklist": checklist_items,
             "quiz": quiz,
         }
 
     except Exception as e:
-        # log for debugging
-        print("🛑 Onboarding agent error:", e)
+        log.exception("onboarding: generation failed")
         raise HTTPException(status_code=500, detail=f"Onboarding agent error: {e}")
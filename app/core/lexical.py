@@ -0,0 +1,310 @@
+import os
+import re
+import json
+import math
+import uuid
+import shutil
+import threading
+from array import array
+
+import numpy as np
+
+# ─── LEXICAL (BM25) INDEX ─────────────────────────────────────────────────────
+#
+# An inverted index over the same chunks as the FAISS index, keyed by the same
+# chunk ids. Each term maps to an append-only postings list (chunk ids, term
+# frequencies); chunks are added in id order as they are committed, so every
+# list stays sorted without ever being rewritten. Deleted chunks are only
+# masked out until the next snapshot, which writes the lists without them.
+#
+# Snapshots record the chunk-id watermark they cover, like the ANN snapshots:
+# on start the snapshot is loaded and only chunks added since are tokenized.
+# One is written in the background after every LEXICAL_SAVE_EVERY added
+# chunks. A snapshot is a directory of .npy files (<store>/lexical-<id>/,
+# published through <store>/lexical.json) that is memory-mapped read-only,
+# so worker processes share its postings through the page cache; only the
+# chunks added since, and the per-chunk lengths, are held in each process.
+
+BM25_K1            = float(os.getenv("BM25_K1", "1.2"))
+BM25_B             = float(os.getenv("BM25_B", "0.75"))
+LEXICAL_SAVE_EVERY = int(os.getenv("LEXICAL_SAVE_EVERY", "5000"))   # chunks
+SNAPSHOT_VERSION   = 1
+
+# words, plus compounds such as policy or form numbers ("HR-104", "v2.1");
+# a compound is indexed both whole and as its parts
+TOKEN   = re.compile(r"\w+(?:[-./:]\w+)*")
+SPLIT   = re.compile(r"[-./:]")
+YEAR    = re.compile(r"(19|20)[0-9]{2}")
+
+
+def tokenize(text: str) -> list[str]:
+    out = []
+    for tok in TOKEN.findall(text.lower()):
+        out.append(tok)
+        if SPLIT.search(tok):
+            out.extend(p for p in SPLIT.split(tok) if p)
+    return out
+
+
+class LexicalIndex:
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1, self.b = k1, b
+        # snapshot postings, memory-mapped: terms (utf-8, sorted) and their
+        # posting ranges; see load()
+        self._base: dict[str, np.ndarray] | None = None
+        # postings added since the snapshot
+        self.vocab: dict[str, int] = {}
+        self._ids: list[array] = []     # term id -> chunk ids (int64, ascending)
+        self._tfs: list[array] = []     # term id -> term frequencies (int32)
+        self._lens = np.zeros(0, dtype=np.int32)   # chunk id -> tokens (0: not indexed)
+        self._removed = np.zeros(0, dtype=np.int64)
+        self.covered   = 0    # every chunk id below this was added (or never existed)
+        self.n_docs    = 0
+        self.n_terms   = 0
+        self.total_len = 0
+        self.unsaved   = 0
+        self.key          = None    # snapshot this was loaded from (see snapshot_key)
+        self.seen_deleted = None    # store deletions already removed, for the owner
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    # ── updates ─────────────────────────────────────────────────────────────
+    def add(self, ids, texts: list[str]):
+        """
+        Index chunks; `ids` must be ascending and above every id added so far.
+        """
+        rows = [(int(i), tokenize(t)) for i, t in zip(ids, texts)]
+        with self.lock:
+            if rows:
+                end = rows[-1][0] + 1
+                if end > len(self._lens):
+                    grown = np.zeros(max(end, 2 * len(self._lens)), dtype=np.int32)
+                    grown[:len(self._lens)] = self._lens
+                    self._lens = grown
+            for chunk_id, toks in rows:
+                if not toks:
+                    continue
+                counts: dict[str, int] = {}
+                for tok in toks:
+                    counts[tok] = counts.get(tok, 0) + 1
+                for tok, tf in counts.items():
+                    t = self.vocab.get(tok)
+                    if t is None:
+                        t = self.vocab[tok] = len(self._ids)
+                        self._ids.append(array("q"))
+                        self._tfs.append(array("i"))
+                        if self._base_term(tok) is None:
+                            self.n_terms += 1
+                    self._ids[t].append(chunk_id)
+                    self._tfs[t].append(tf)
+                self._lens[chunk_id] = len(toks)
+                self.n_docs    += 1
+                self.total_len += len(toks)
+            if rows:
+                self.covered = max(self.covered, rows[-1][0] + 1)
+            self.unsaved += len(rows)
+
+    def remove(self, ids):
+        """
+        Stop matching these chunk ids.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self.lock:
+            ids = ids[ids < len(self._lens)]
+            ids = np.setdiff1d(ids, self._removed)
+            ids = ids[self._lens[ids] > 0]
+            self.n_docs    -= len(ids)
+            self.total_len -= int(self._lens[ids].sum())
+            self._lens[ids] = 0
+            self._removed   = np.union1d(self._removed, ids)
+            self.unsaved   += len(ids)
+
+    # ── lookups ─────────────────────────────────────────────────────────────
+    def _base_term(self, tok: str) -> int | None:
+        # binary search over the sorted utf-8 terms of the snapshot
+        base = self._base
+        if base is None:
+            return None
+        key, blob, off = tok.encode("utf-8"), base["terms"], base["term_offsets"]
+        lo, hi = 0, len(off) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blob[off[mid]:off[mid + 1]].tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(off) - 1 and blob[off[lo]:off[lo + 1]].tobytes() == key:
+            return lo
+        return None
+
+    def _postings(self, tok: str) -> tuple[np.ndarray, np.ndarray]:
+        # copies, so no buffer of the growing arrays outlives the lock
+        ids, tfs = [], []
+        t = self._base_term(tok)
+        if t is not None:
+            lo, hi = self._base["offsets"][t], self._base["offsets"][t + 1]
+            ids.append(np.array(self._base["ids"][lo:hi]))
+            tfs.append(self._base["tfs"][lo:hi].astype(np.float32))
+        t = self.vocab.get(tok)
+        if t is not None:
+            ids.append(np.array(self._ids[t], dtype=np.int64))
+            tfs.append(np.array(self._tfs[t], dtype=np.float32))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, tfs = np.concatenate(ids), np.concatenate(tfs)
+        if len(self._removed):
+            keep = ~np.isin(ids, self._removed, assume_unique=True)
+            ids, tfs = ids[keep], tfs[keep]
+        return ids, tfs
+
+    def lookup(self, term: str) -> np.ndarray:
+        """
+        Ids of the chunks containing `term` (one token), ascending.
+        """
+        with self.lock:
+            return self._postings(term.lower())[0]
+
+    def years(self, before: int, since: int = 0) -> dict[int, int]:
+        """
+        For chunks with id >= since mentioning a year (1900-2099) below
+        `before`: chunk id -> earliest such year. Read from the year tokens'
+        postings, without touching the chunk text.
+        """
+        out: dict[int, int] = {}
+        with self.lock:
+            for year in range(1900, min(before, 2100)):
+                ids = self._postings(str(year))[0]
+                for chunk_id in ids[np.searchsorted(ids, since):].tolist():
+                    out.setdefault(chunk_id, year)
+        return out
+
+    def search(self, query: str, k: int, allowed: np.ndarray | None = None
+               ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k chunks by BM25 score as (scores, ids), best first; fewer than
+        k when fewer chunks contain a query term. With `allowed`, only those
+        chunk ids are considered.
+        """
+        terms = set(tokenize(query))
+        all_ids, all_scores = [], []
+        with self.lock:
+            if not self.n_docs:
+                return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+            n, avgdl = self.n_docs, self.total_len / self.n_docs
+            for tok in terms:
+                ids, tf = self._postings(tok)
+                if not len(ids):
+                    continue
+                idf  = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._lens[ids] / avgdl)
+                all_ids.append(ids)
+                all_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not all_ids:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        ids, at = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores  = np.bincount(at, weights=np.concatenate(all_scores)).astype(np.float32)
+        if allowed is not None:
+            keep = np.isin(ids, allowed)
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return scores[order], ids[order]
+
+    # ── persistence ─────────────────────────────────────────────────────────
+    def save(self, path: str):
+        """
+        Write a snapshot (without removed chunks) as <path>-<id>/ and
+        publish it through <path>.json. Blocking.
+        """
+        with self.lock:
+            terms: set[bytes] = set()
+            if self._base is not None:
+                blob, off = self._base["terms"], self._base["term_offsets"]
+                terms.update(blob[off[t]:off[t + 1]].tobytes() for t in range(len(off) - 1))
+            terms.update(tok.encode("utf-8") for tok in self.vocab)
+            blobs, ids, tfs, offsets = [], [], [], [0]
+            for tok in sorted(terms):
+                p_ids, p_tfs = self._postings(tok.decode("utf-8"))
+                if not len(p_ids):
+                    continue
+                blobs.append(tok)
+                ids.append(p_ids)
+                tfs.append(p_tfs.astype(np.int32))
+                offsets.append(offsets[-1] + len(p_ids))
+            lens    = self._lens[:self.covered].copy()
+            covered = self.covered
+            self.unsaved = 0
+
+        folder, stem = os.path.split(path)
+        name = f"{stem}-{uuid.uuid4().hex[:8]}"
+        tmp  = os.path.join(folder, name + ".tmp")
+        os.makedirs(tmp)
+        term_offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=term_offsets[1:])
+        for key, arr in {
+            "terms":        np.frombuffer(b"".join(blobs), dtype=np.uint8),
+            "term_offsets": term_offsets,
+            "offsets":      np.array(offsets, dtype=np.int64),
+            "ids":          np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64),
+            "tfs":          np.concatenate(tfs) if tfs else np.zeros(0, dtype=np.int32),
+            "lens":         lens,
+        }.items():
+            np.save(os.path.join(tmp, f"{key}.npy"), arr, allow_pickle=False)
+        os.rename(tmp, os.path.join(folder, name))
+        with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "dir": name, "covered": covered}, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        # mapped by other processes? their views stay valid after unlink
+        for old in os.listdir(folder):
+            if old.startswith(f"{stem}-") and old != name:
+                shutil.rmtree(os.path.join(folder, old), ignore_errors=True)
+
+    @staticmethod
+    def snapshot_key(path: str):
+        """
+        Identity of the published snapshot, None if there is none.
+        """
+        try:
+            st = os.stat(path + ".json")
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex | None":
+        """
+        Index from the published snapshot, memory-mapped, or None if there
+        is no usable one.
+        """
+        for _ in range(5):
+            key = cls.snapshot_key(path)
+            try:
+                with open(path + ".json", "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if meta.get("version") != SNAPSHOT_VERSION:
+                return None
+            folder = os.path.join(os.path.dirname(path), meta["dir"])
+            try:
+                base = {
+                    name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+                    for name in ("terms", "term_offsets", "offsets", "ids", "tfs", "lens")
+                }
+            except FileNotFoundError:
+                continue   # replaced by a newer snapshot in the meantime
+            idx = cls()
+            idx._base      = base
+            idx._lens      = np.array(base.pop("lens"), dtype=np.int32)
+            idx.covered    = meta["covered"]
+            idx.key        = key
+            idx.n_docs     = int((idx._lens > 0).sum())
+            idx.n_terms    = len(base["term_offsets"]) - 1
+            idx.total_len  = int(idx._lens.sum())
+            return idx
+        return None
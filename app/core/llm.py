@@ -1,18 +1,102 @@
 import os
-from ollama import Client, Options
+import time
+import asyncio
+from contextlib import aclosing, asynccontextmanager
 
-# Initialize Ollama client with configurable host
+import httpx
+from fastapi import HTTPException
+from ollama import AsyncClient, Options
+
+from app.core import metrics
+
+# ─── Configuration ────────────────────────────────────────────────────────
 ollama_host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-ollama = Client(host=ollama_host)
 MODEL = "mistral"  # Ollama’s default 7B model
 
+# generations allowed in flight at once, and how many more may wait for a slot
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "4"))
+OLLAMA_MAX_WAITING = int(os.getenv("OLLAMA_MAX_WAITING", "32"))
+OLLAMA_TIMEOUT     = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+
+_ollama = None
+_slots = None
+_loop = None
+_waiting = 0
+_in_flight = 0
+
+def get_client() -> AsyncClient:
+    """
+    One pooled async client per event loop: keep-alive connections are reused
+    across requests and generation never blocks the loop. (Rebuilt only if the
+    loop changes, e.g. between test clients.)
+    """
+    global _ollama, _slots, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        _ollama = AsyncClient(
+            host=ollama_host,
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_CONCURRENCY * 2,
+                max_keepalive_connections=OLLAMA_CONCURRENCY,
+            ),
+        )
+        _slots = asyncio.Semaphore(OLLAMA_CONCURRENCY)
+        _loop = loop
+    return _ollama
+
+# ─── Concurrency limiter / backpressure ───────────────────────────────────
+async def acquire_slot():
+    """
+    Wait for one of OLLAMA_CONCURRENCY generation slots and return a
+    release() for it (calling it again is a no-op). When too many callers
+    are already queued, fail fast with 503 instead of piling up on Ollama.
+    """
+    global _waiting, _in_flight
+    get_client()
+    slots = _slots
+    if slots.locked() and _waiting >= OLLAMA_MAX_WAITING:
+        metrics.LLM_REJECTED.inc()
+        raise HTTPException(503, detail="LLM is busy, retry later", headers={"Retry-After": "2"})
+    _waiting += 1
+    try:
+        with metrics.stage("llm", "queue"):
+            await slots.acquire()
+    finally:
+        _waiting -= 1
+    _in_flight += 1
+    held = True
+
+    def release():
+        global _in_flight
+        nonlocal held
+        if held:
+            held = False
+            _in_flight -= 1
+            slots.release()
+    return release
+
+@asynccontextmanager
+async def _slot():
+    release = await acquire_slot()
+    try:
+        yield
+    finally:
+        release()
+
+def llm_load() -> dict:
+    return {"in_flight": _in_flight, "waiting": _waiting}
+
+# ─── Generation ───────────────────────────────────────────────────────────
 async def generate_response(prompt: str, max_tokens: int = 256) -> str:
-    opts = Options(max_tokens=max_tokens)
-    resp = ollama.generate(
-        model=MODEL,
-        prompt=prompt,
-        options=opts
-    )
+    async with _slot():
+        with metrics.stage("llm", "generate"):
+            resp = await get_client().generate(
+                model=MODEL,
+                prompt=prompt,
+                options=Options(num_predict=max_tokens),
+            )
+    _count_tokens(resp)
     try:
         return resp.response.strip()
     except AttributeError:
@@ -20,9 +104,74 @@ async def generate_response(prompt: str, max_tokens: int = 256) -> str:
             return resp.choices[0].text.strip()
         return str(resp).strip()
 
+async def stream_response(prompt: str, max_tokens: int = 256):
+    """
+    Async generator yielding response tokens as Ollama produces them. It
+    takes no slot itself: the caller holds one from acquire_slot() for as
+    long as it reads, and releases it however the stream ends, including
+    when the generator is never iterated.
+    """
+    # llm/generate counts only the time spent waiting on Ollama, as for
+    # generate_response(): t is None while the consumer has the token
+    t0 = t = time.perf_counter()
+    waited, n = 0.0, 0
+    try:
+        parts = await get_client().generate(
+            model=MODEL,
+            prompt=prompt,
+            options=Options(num_predict=max_tokens),
+            stream=True,
+        )
+        async with aclosing(parts):
+            async for part in parts:
+                waited += time.perf_counter() - t
+                t = None
+                if part.response:
+                    if t0 is not None:
+                        metrics.record("llm", "first_token", time.perf_counter() - t0)
+                        t0 = None
+                    n += 1
+                    yield part.response
+                if part.done:
+                    _count_tokens(part)
+                    n = 0
+                t = time.perf_counter()
+    finally:
+        if t is not None:
+            waited += time.perf_counter() - t
+        metrics.record("llm", "generate", waited)
+        if n:
+            # cut off before Ollama sent its final counts
+            metrics.LLM_TOKENS.inc(n, kind="generated")
+
+def _count_tokens(resp):
+    if getattr(resp, "prompt_eval_count", None):
+        metrics.LLM_TOKENS.inc(resp.prompt_eval_count, kind="prompt")
+    if getattr(resp, "eval_count", None):
+        metrics.LLM_TOKENS.inc(resp.eval_count, kind="generated")
+
+async def warm_up():
+    """
+    Load the model into Ollama's memory (an empty prompt only loads it), so
+    the first real request does not pay for it. Raises if Ollama is down.
+    """
+    await get_client().generate(model=MODEL, prompt="")
+
 # Smoke-test when run directly
 if __name__ == "__main__":
-    import asyncio
     print("Make sure you have run: ollama run mistral in another terminal (or it’s running in the container)")
-    reply = asyncio.run(generate_response("Say hello in one sentence."))
-    print("SMOKE TEST:", reply)
\ No newline at end of file
+    print("(or the stand-in: uvicorn app.fake_ollama:app --port 11434)")
+
+    async def _smoke():
+        reply = await generate_response("Say hello in one sentence.")
+        print("SMOKE TEST:", reply)
+        print("STREAM TEST:", end=" ", flush=True)
+        release = await acquire_slot()
+        try:
+            async for tok in stream_response("Say hello in one sentence."):
+                print(tok, end="", flush=True)
+        finally:
+            release()
+        print()
+
+    asyncio.run(_smoke())
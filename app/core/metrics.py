@@ -0,0 +1,230 @@
+import os
+import time
+import uuid
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ─── METRICS / TRACING ────────────────────────────────────────────────────────
+#
+# In-process counters, gauges and histograms rendered in the Prometheus text
+# format on GET /metrics. The pipelines time their stages with
+#
+#     with metrics.stage("retrieval", "search"):
+#         ...
+#
+# which observes qa_stage_seconds{pipeline, stage} and, when a trace is
+# active, adds the time to it. Every HTTP request runs under a trace whose id
+# is taken from an X-Request-ID header (or generated), returned as
+# X-Trace-Id and logged with the request's stage breakdown. Stages that serve
+# several requests at once (a micro-batched encode + search, an ingest batch)
+# are recorded in the histograms but not in any one request's trace.
+#
+# Recording is a perf_counter pair, a lock and a bisect, so it is left on.
+# Gauges and the counters kept elsewhere (batcher, answer cache) are read
+# only when /metrics is scraped. Values are per worker process: with several
+# uvicorn workers, each scrape sees the worker that served it.
+
+TRACE_LOG_MIN_MS = float(os.getenv("TRACE_LOG_MIN_MS", "0"))   # log traces at least this slow; <0 disables
+
+# seconds; spans a lexical lookup (sub-ms) to a long generation
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+log = logging.getLogger("uvicorn.error")
+
+registry: list["Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values. With
+    `fn`, the values are read when rendering instead: fn() returns a number
+    (no labels) or a dict mapping label-value tuples to numbers.
+    """
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), fn=None):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self.fn     = fn
+        self._lock  = threading.Lock()
+        self._values: dict[tuple, float] = {} if self.labels else {(): 0}
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[n] for n in self.labels)
+
+    def _current(self) -> dict[tuple, float]:
+        if self.fn is None:
+            with self._lock:
+                return dict(self._values)
+        value = self.fn()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self._current().items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_num(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}   # labels -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        at = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][at] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = 'le="' + _num(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format.
+    A gauge whose source fails is left out rather than failing the scrape.
+    """
+    out = []
+    for metric in registry:
+        try:
+            out.extend(metric.render())
+        except Exception:
+            log.exception("metrics: rendering %s failed", metric.name)
+    return "\n".join(out) + "\n"
+
+
+# ─── Traces ───────────────────────────────────────────────────────────────
+class Trace:
+    def __init__(self, trace_id: str | None = None):
+        self.id      = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        return " ".join(f"{name}={s * 1000:.1f}ms" for name, s in self.stages.items())
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Trace | None:
+    return _trace.get()
+
+
+@contextmanager
+def trace(trace_id: str | None = None):
+    """
+    Run the block under a new trace (tasks and to_thread calls started
+    inside inherit it).
+    """
+    t = Trace(trace_id)
+    token = _trace.set(t)
+    try:
+        yield t
+    finally:
+        _trace.reset(token)
+
+
+def log_trace(t: Trace, what: str):
+    ms = t.elapsed() * 1000
+    if 0 <= TRACE_LOG_MIN_MS <= ms:
+        log.info("trace=%s %s %.1fms%s", t.id, what, ms, " " + t.summary() if t.stages else "")
+
+
+# ─── Pipeline metrics ─────────────────────────────────────────────────────
+STAGE_SECONDS = Histogram("qa_stage_seconds", "Time spent per pipeline stage", ("pipeline", "stage"))
+HTTP_SECONDS  = Histogram("qa_http_request_seconds", "HTTP request latency", ("method", "route"))
+HTTP_REQUESTS = Counter("qa_http_requests_total", "HTTP requests served", ("method", "route", "status"))
+
+LLM_TOKENS   = Counter("qa_llm_tokens_total", "Tokens generated by the LLM", ("kind",))
+LLM_REJECTED = Counter("qa_llm_rejected_total", "Generations refused because the LLM queue was full")
+CHUNKS_RETRIEVED = Counter("qa_chunks_retrieved_total", "Chunks returned by retrieval", ("mode",))
+INGEST_PAGES  = Counter("qa_ingest_pages_total", "Pages extracted by ingestion")
+INGEST_CHUNKS = Counter("qa_ingest_chunks_total", "Chunks produced by ingestion", ("result",))
+INGEST_FILES  = Counter("qa_ingest_files_total", "Files handled by ingestion", ("result",))
+AGENT_RUNS    = Counter("qa_agent_runs_total", "Agent runs", ("agent",))
+
+
+def record(pipeline: str, name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=name)
+    t = _trace.get()
+    if t is not None:
+        t.add(name, seconds)
+
+
+@contextmanager
+def stage(pipeline: str, name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(pipeline, name, time.perf_counter() - t0)
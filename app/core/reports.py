@@ -0,0 +1,152 @@
+import os
+import csv
+import time
+import uuid
+import datetime
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+
+# ─── REPORTS ──────────────────────────────────────────────────────────────────
+#
+# Agents hand write_report() an iterator of rows; it streams them to a temp
+# file (openpyxl write-only mode, CSV or Parquet) and renames the file into
+# REPORT_DIR once complete, so a download never sees a partial report and
+# memory does not grow with the report size. Call it through
+# asyncio.to_thread from async code. After every publish the retention policy
+# prunes old reports and stray Office lock files (~$*.xlsx).
+
+BASE_DIR   = Path(__file__).parent.parent
+REPORT_DIR = Path(os.getenv("REPORT_DIR", str(BASE_DIR / "reports")))
+REPORT_DIR.mkdir(parents=True, exist_ok=True)
+
+REPORT_FORMAT       = os.getenv("REPORT_FORMAT", "xlsx")             # xlsx | csv | parquet
+REPORT_KEEP_MAX     = int(os.getenv("REPORT_KEEP_MAX", "200"))       # files
+REPORT_MAX_AGE_DAYS = float(os.getenv("REPORT_MAX_AGE_DAYS", "30"))
+REPORT_MAX_TOTAL_MB = float(os.getenv("REPORT_MAX_TOTAL_MB", "500"))
+REPORT_CACHE_S      = int(os.getenv("REPORT_CACHE_S", "86400"))
+PARQUET_BATCH       = 10_000
+
+FORMATS = ("xlsx", "csv", "parquet")
+
+
+def _write_xlsx(path: Path, columns: list[str], rows, sheet: str):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet[:31])
+    ws.append(columns)
+    for row in rows:
+        ws.append([row.get(c) for c in columns])
+    wb.save(path)
+
+
+def _write_csv(path: Path, columns: list[str], rows, sheet: str):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        w.writeheader()
+        for row in rows:
+            w.writerow(row)
+
+
+def _write_parquet(path: Path, columns: list[str], rows, sheet: str):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("REPORT_FORMAT=parquet requires pyarrow") from e
+
+    writer, batch = None, []
+
+    def flush():
+        nonlocal writer
+        table = pa.Table.from_pylist(batch, schema=writer.schema if writer else None)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+        batch.clear()
+
+    for row in rows:
+        batch.append({c: row.get(c) for c in columns})
+        if len(batch) >= PARQUET_BATCH:
+            flush()
+    if batch:
+        flush()
+    if writer is None:
+        writer = pq.ParquetWriter(path, pa.schema([(c, pa.string()) for c in columns]))
+    writer.close()
+
+
+_WRITERS = {"xlsx": _write_xlsx, "csv": _write_csv, "parquet": _write_parquet}
+
+
+def write_report(prefix: str, columns: list[str], rows, sheet: str = "Report",
+                 fmt: str | None = None) -> Path:
+    """
+    Stream `rows` (dicts keyed by column) into a new report file and publish
+    it atomically. Blocking. Returns the published path.
+    """
+    fmt = fmt or REPORT_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError(f"REPORT_FORMAT must be one of {FORMATS}, got {fmt!r}")
+
+    ts   = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    path = REPORT_DIR / f"{prefix}_{ts}.{fmt}"
+    n = 1
+    while path.exists():
+        path = REPORT_DIR / f"{prefix}_{ts}_{n}.{fmt}"
+        n += 1
+
+    # temp name must keep the extension: openpyxl checks it on save
+    tmp = REPORT_DIR / f".tmp-{uuid.uuid4().hex}.{fmt}"
+    try:
+        _WRITERS[fmt](tmp, columns, rows, sheet)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    enforce_retention()
+    return path
+
+
+def enforce_retention(now: float | None = None):
+    """
+    Delete Office lock files and abandoned temp files, then the oldest
+    reports beyond REPORT_KEEP_MAX files, REPORT_MAX_AGE_DAYS days or
+    REPORT_MAX_TOTAL_MB in total.
+    """
+    now = now or time.time()
+    reports = []
+    for p in REPORT_DIR.iterdir():
+        if not p.is_file():
+            continue
+        st = p.stat()
+        if p.name.startswith("~$") or (p.name.startswith(".tmp-") and now - st.st_mtime > 3600):
+            p.unlink(missing_ok=True)
+        elif not p.name.startswith("."):
+            reports.append((st.st_mtime, st.st_size, p))
+
+    reports.sort(reverse=True)  # newest first
+    total = 0
+    for i, (mtime, size, p) in enumerate(reports):
+        total += size
+        if (i >= REPORT_KEEP_MAX
+                or now - mtime > REPORT_MAX_AGE_DAYS * 86400
+                or total > REPORT_MAX_TOTAL_MB * 2**20):
+            p.unlink(missing_ok=True)
+
+
+class ReportFiles(StaticFiles):
+    """
+    /reports mount. Report names are timestamped and never rewritten, so
+    they can be cached aggressively; lock and temp files are never served.
+    """
+
+    def lookup_path(self, path: str):
+        if os.path.basename(path).startswith(("~$", ".")):
+            return "", None
+        return super().lookup_path(path)
+
+    def file_response(self, *args, **kwargs):
+        resp = super().file_response(*args, **kwargs)
+        resp.headers["Cache-Control"] = f"public, max-age={REPORT_CACHE_S}, immutable"
+        return resp
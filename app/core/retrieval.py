@@ -1,74 +1,749 @@
 import os
+import time
+import fcntl
+import logging
+import bisect
+import asyncio
+import threading
+from contextlib import contextmanager
+
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from PyPDF2 import PdfReader
+
+from app.core import ann, embedding, metrics
+from app.core.batcher import RetrievalBatcher
+from app.core.lexical import LEXICAL_SAVE_EVERY, LexicalIndex
+from app.core.store import TOMBSTONE_RATIO, SegmentStore, chunk_hash
+from app.utils.file_utils import file_sha256, iter_pages
 
 # ─── CHUNKER ───────────────────────────────────────────────────────────────────
+class Chunker:
+    """
+    Incremental chunker over a stream of (page, text) pieces. Text that may
+    still be extended by the next piece (a partial sentence at a page end)
+    is carried over, so the chunks are exactly those chunk_text() would cut
+    from the concatenated text, while only about one chunk is buffered.
+    Each chunk is tagged with the page it starts on.
+    """
+
+    def __init__(self, size: int = 500):
+        self.size  = size
+        self.buf   = ""
+        self.marks: list[tuple[int, int]] = []   # (offset in buf, page), ascending
+
+    def _page_at(self, offset: int) -> int:
+        at = bisect.bisect_right(self.marks, (offset, float("inf"))) - 1
+        return self.marks[max(at, 0)][1] if self.marks else 0
+
+    def _cut(self, final: bool) -> list[tuple[str, int]]:
+        out, buf, size = [], self.buf, self.size
+        start, length = 0, len(self.buf)
+        while start < length:
+            end = start + size
+            if end >= length:
+                if not final:
+                    break  # the next piece may move this boundary
+                end = length
+            else:
+                split = buf.rfind(".", start, end)
+                end = split + 1 if split > start else end
+            out.append((buf[start:end].strip(), self._page_at(start)))
+            start = end
+
+        page = self._page_at(start)
+        self.buf   = buf[start:]
+        self.marks = [(0, page)] + [(o - start, p) for o, p in self.marks if o > start]
+        return out
+
+    def feed(self, page: int, text: str) -> list[tuple[str, int]]:
+        """
+        Add a piece of text; returns the (chunk, page) pairs it completed.
+        """
+        if not text:
+            return []
+        if not self.marks or self.marks[-1][1] != page:
+            self.marks.append((len(self.buf), page))
+        self.buf += text
+        return self._cut(final=False)
+
+    def close(self) -> list[tuple[str, int]]:
+        """
+        Flush the remaining text as the final chunk(s).
+        """
+        return self._cut(final=True)
+
+def iter_chunks(pages, size: int = 500):
+    """
+    Yield (chunk, page) from an iterable of (page, text) pieces.
+    """
+    chunker = Chunker(size)
+    for page, text in pages:
+        yield from chunker.feed(page, text)
+    yield from chunker.close()
+
 def chunk_text(text: str, size: int = 500) -> list[str]:
     """
     Split `text` into ~size-character chunks on sentence boundaries.
     """
-    chunks = []
-    start = 0
-    length = len(text)
-    while start < length:
-        end = min(start + size, length)
-        if end < length:
-            split = text.rfind(".", start, end)
-            end = split + 1 if split > start else end
-        chunks.append(text[start:end].strip())
-        start = end
-    return chunks
+    return [c for c, _ in iter_chunks([(0, text)], size)]
 
 # ─── VECTOR STORE SETUP ───────────────────────────────────────────────────────
 BASE_DIR   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DIR  = os.getenv("VECTORSTORE_DIR", os.path.join(BASE_DIR, "vectorstore"))
+
+# legacy single-file layout, migrated into the segment store on first start
 INDEX_PATH = os.path.join(BASE_DIR, "faiss.index")
 META_PATH  = os.path.join(BASE_DIR, "chunks.npy")
 
-# initialize embedder
-EMBED_MODEL = "all-MiniLM-L6-v2"
-embedder   = SentenceTransformer(EMBED_MODEL)
+# retrieval: dense | lexical | hybrid (reciprocal-rank fusion of both)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")   # hybrid and lexical are opt-in
+MODES          = ("dense", "lexical", "hybrid")
+RRF_K          = int(os.getenv("RRF_K", "60"))
+HYBRID_DEPTH   = int(os.getenv("HYBRID_DEPTH", "50"))   # candidates taken from each ranker
+
+# ─── LAZY RESOURCES ───────────────────────────────────────────────────────────
+# Importing this module only opens the segment store (manifest + mmaps). The
+# embedder, the legacy migration and the FAISS and BM25 indexes are loaded on
+# first use, or ahead of traffic by app.core.startup, which runs the loaders
+# in parallel threads. Each loader runs once; its duration is recorded in
+# load_times.
+EMBED_MODEL = embedding.EMBED_MODEL
+
+# a non-reference embedding backend must reproduce the stored vectors of a
+# sample of chunks to at least this cosine, or the torch backend is used
+EMBED_PARITY_MIN    = float(os.getenv("EMBED_PARITY_MIN", "0.99"))
+EMBED_PARITY_SAMPLE = int(os.getenv("EMBED_PARITY_SAMPLE", "64"))
+
+log = logging.getLogger("uvicorn.error")
+
+store  = SegmentStore(STORE_DIR)
+chunks = store.chunks
+
+embedder: embedding.Embedder | None = None
+embedder_parity: dict | None = None
+index: ann.LayeredIndex | None = None
+lexical: LexicalIndex | None = None
+
+load_times: dict[str, float] = {}
+_load_locks = {name: threading.Lock() for name in ("store", "embedder", "index", "lexical")}
+
+def _load_once(name: str, fn):
+    if name in load_times:
+        return
+    with _load_locks[name]:
+        if name in load_times:
+            return
+        t0 = time.perf_counter()
+        fn()
+        load_times[name] = time.perf_counter() - t0
+
+def _migrate_legacy():
+    if len(store) or not (os.path.exists(INDEX_PATH) and os.path.exists(META_PATH)):
+        return
+    # under the writer lock, so only the first of several workers migrates
+    with store.writer():
+        if len(store) == 0:
+            legacy = faiss.read_index(INDEX_PATH)
+            # the only pickle load left, and it runs once
+            legacy_chunks = [str(c) for c in np.load(META_PATH, allow_pickle=True)]
+            store.append(legacy.reconstruct_n(0, legacy.ntotal), legacy_chunks)
+
+def _load_embedder():
+    global embedder, embedder_parity
+    # backends import their runtime here: torch alone takes seconds to import
+    candidate = embedding.make_embedder()
+    if candidate.backend != "torch" and EMBED_PARITY_MIN > 0:
+        ids, alive = store.columns("ids", "alive")
+        ids = ids[alive]
+        sample = np.random.default_rng(0).choice(ids, min(EMBED_PARITY_SAMPLE, len(ids)), replace=False)
+        embedder_parity = embedding.parity(
+            candidate, [store.chunk(int(i)) for i in sample],
+            np.stack([store.embedding_at(int(i)) for i in sample]) if len(sample) else None,
+        )
+        if embedder_parity["min"] < EMBED_PARITY_MIN:
+            log.warning("embedder: %s parity %s below %s, using torch",
+                        candidate.backend, embedder_parity, EMBED_PARITY_MIN)
+            candidate = embedding.make_embedder("torch")
+    embedder = candidate
+
+def load_store():
+    _load_once("store", _migrate_legacy)
+
+def load_embedder():
+    """
+    Load the EMBED_BACKEND embedder, checking its parity with the stored
+    embeddings first (see embedding.py). Blocking.
+    """
+    load_store()
+    _load_once("embedder", _load_embedder)
+
+def load_index():
+    """
+    Open the FAISS snapshot (building it if there is none) and catch up
+    with the store. Blocking.
+    """
+    load_store()
+
+    def _load():
+        global index
+        index = _open_index()
+    _load_once("index", _load)
+
+def load_lexical():
+    """
+    Load the BM25 index and catch it up with the store. Blocking.
+    """
+    load_store()
+
+    def _load():
+        global lexical
+        lexical = _open_lexical()
+        if lexical.unsaved >= LEXICAL_SAVE_EVERY:
+            _save_lexical()
+    _load_once("lexical", _load)
+
+def load_all():
+    load_index()
+    load_lexical()
+
+def loaded(name: str) -> bool:
+    return name in load_times
+
+# ─── SHARED SNAPSHOTS / HOT RELOAD ────────────────────────────────────────────
+# Several worker processes can serve the same store. The segments, the FAISS
+# snapshot and the BM25 snapshot are all memory-mapped read-only, so their
+# pages are shared through the page cache; per process there is only what was
+# committed since the last snapshot (ann.LayeredIndex, LexicalIndex). Writes
+# from every process are serialized by the store's flock (SegmentStore.writer)
+# and bump the manifest generation. Each worker checks for a new generation or
+# snapshot between requests (stale(), a few stat() calls at most every
+# STORE_REFRESH_S) and catches up in refresh(): new chunks are added, deleted
+# ones dropped, and a newer snapshot is swapped in under the index lock.
+#
+# The process that commits publishes a new FAISS snapshot once the in-memory
+# delta reaches INDEX_DELTA_MAX chunks, the deletions since reach
+# TOMBSTONE_RATIO of it, or it needs retraining (ann.needs_rebuild); a BM25
+# snapshot every LEXICAL_SAVE_EVERY chunks. Only one process writes each at a
+# time.
+index_cfg       = ann.index_config()
+INDEX_SNAPSHOT  = os.path.join(STORE_DIR, "index.faiss")
+INDEX_DELTA_MAX = int(os.getenv("INDEX_DELTA_MAX", "20000"))
+LEXICAL_SNAPSHOT = os.path.join(STORE_DIR, "lexical")
+REFRESH_S       = float(os.getenv("STORE_REFRESH_S", "1"))
+
+# FAISS does not allow add() concurrently with search(); commits and
+# refreshes run in worker threads, so both sides take this lock. Catching up
+# with the store (commit, delete, refresh) is serialized by _commit_lock.
+index_lock   = threading.Lock()
+_commit_lock = threading.Lock()
+
+@contextmanager
+def _file_lock(path: str, wait: bool = True):
+    """
+    flock() on `path`, exclusive across threads and processes; yields False
+    instead of waiting when `wait` is False and it is held.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+def _gone(end: int) -> np.ndarray:
+    """
+    Ids below `end` that are not live: deleted, or compacted away.
+    """
+    ids, alive = store.columns("ids", "alive")
+    return np.setdiff1d(np.arange(end), ids[alive])
+
+def _build_snapshot(retrain: bool = False):
+    """
+    Publish a FAISS snapshot of the live chunks below store.next_id: the
+    current snapshot plus the chunks added and minus those deleted since or,
+    with `retrain` (or when HNSW would have to drop vectors), a freshly
+    built index. Caller holds the snapshot lock.
+    """
+    next_id = store.next_id
+    idx, trained, covered = (None, 0, 0) if retrain else ann.load_snapshot(INDEX_SNAPSHOT, index_cfg)
+    if idx is not None and covered <= next_id:
+        gone = np.intersect1d(_gone(covered), ann.index_ids(idx))
+        if ann.remove_ids(idx, gone):
+            ids, embs, alive = store.columns("ids", "embeddings", "alive", since=covered)
+            keep = alive & (ids < next_id)
+            if keep.any():
+                idx.add_with_ids(embs[keep], ids[keep])
+            ann.save_snapshot(idx, INDEX_SNAPSHOT, trained, index_cfg, next_id)
+            return
+    ids, embs, alive = store.columns("ids", "embeddings", "alive")
+    keep = alive & (ids < next_id)
+    idx  = ann.build_index(embs[keep], index_cfg, dim=store.dim, ids=ids[keep])
+    ann.save_snapshot(idx, INDEX_SNAPSHOT, int(keep.sum()), index_cfg, next_id)
+
+def _catch_up_index(idx: ann.LayeredIndex):
+    end = store.next_id
+    if end > idx.synced:
+        ids, embs, alive = store.columns("ids", "embeddings", "alive", since=idx.synced)
+        keep = alive & (ids < end)
+        with index_lock:
+            idx.add_with_ids(embs[keep], ids[keep])
+        idx.synced = end
+    deleted = store.deleted_ids()
+    if deleted is not idx.seen_deleted:
+        gone = _gone(idx.synced)
+        with index_lock:
+            idx.remove_ids(gone)
+        idx.seen_deleted = deleted
+
+def _open_index() -> ann.LayeredIndex | None:
+    """
+    The published snapshot, mapped, caught up with the store. Without a
+    usable one, one is built first (or, if another process is building
+    it, waited for).
+    """
+    if not len(store):
+        return None
+    for _ in range(3):
+        key = ann.snapshot_key(INDEX_SNAPSHOT)
+        base, trained, covered = ann.load_snapshot(INDEX_SNAPSHOT, index_cfg, mmap=True)
+        if base is not None and covered <= store.next_id:
+            idx = ann.LayeredIndex(base, store.dim, covered, trained, key)
+            _catch_up_index(idx)
+            return idx
+        with _file_lock(INDEX_SNAPSHOT + ".lock"):
+            if ann.snapshot_key(INDEX_SNAPSHOT) == key:
+                _build_snapshot(retrain=True)
+    raise RuntimeError(f"no usable index snapshot at {INDEX_SNAPSHOT}")
+
+def _publish_index(retrain: bool = False):
+    with _file_lock(INDEX_SNAPSHOT + ".lock", wait=False) as held:
+        # skip if another process is at it, or published since we looked
+        held = held and index is not None and index.key == ann.snapshot_key(INDEX_SNAPSHOT)
+        if held:
+            _build_snapshot(retrain)
+    if held:
+        with _commit_lock:
+            _sync()
+
+# BM25 index over the same chunk ids
+def _catch_up_lexical(lex: LexicalIndex):
+    end = store.next_id
+    if end > lex.covered:
+        ids, alive = store.columns("ids", "alive", since=lex.covered)
+        new = ids[alive & (ids < end)]
+        for at in range(0, len(new), 10_000):
+            batch = new[at:at + 10_000]
+            lex.add(batch, [store.chunk(int(i)) for i in batch])
+        lex.covered = end
+    deleted = store.deleted_ids()
+    if deleted is not lex.seen_deleted:
+        lex.remove(_gone(lex.covered))
+        lex.seen_deleted = deleted
+
+def _open_lexical() -> LexicalIndex:
+    key = LexicalIndex.snapshot_key(LEXICAL_SNAPSHOT)
+    lex = LexicalIndex.load(LEXICAL_SNAPSHOT)
+    if lex is None or lex.covered > store.next_id:
+        lex = LexicalIndex()
+        lex.key = key
+    _catch_up_lexical(lex)
+    return lex
+
+def _save_lexical():
+    with _file_lock(LEXICAL_SNAPSHOT + ".lock", wait=False) as held:
+        held = held and lexical.key == LexicalIndex.snapshot_key(LEXICAL_SNAPSHOT)
+        if held:
+            lexical.save(LEXICAL_SNAPSHOT)
+    if held and loaded("lexical"):
+        with _commit_lock:
+            _sync()
+
+def _sync():
+    """
+    Bring the loaded indexes up to date with the store: swap to snapshots
+    published since (by any process), then add the chunks committed and
+    drop the chunks deleted since. Caller holds _commit_lock.
+    """
+    global index, lexical
+    if loaded("index"):
+        if index is None or index.key != ann.snapshot_key(INDEX_SNAPSHOT):
+            fresh = _open_index()
+            with index_lock:
+                index = fresh
+        else:
+            _catch_up_index(index)
+    if loaded("lexical"):
+        if lexical.key != LexicalIndex.snapshot_key(LEXICAL_SNAPSHOT):
+            lexical = _open_lexical()
+        else:
+            _catch_up_lexical(lexical)
+
+def _maybe_publish():
+    idx = index
+    if idx is not None:
+        retrain = ann.needs_rebuild(idx, idx.trained_on, index_cfg)
+        if (retrain or idx.delta.ntotal >= INDEX_DELTA_MAX
+                or len(idx.excluded) >= TOMBSTONE_RATIO * max(idx.ntotal, 1)):
+            threading.Thread(target=_publish_index, args=(retrain,), name="index-snapshot",
+                             daemon=True).start()
+    if lexical is not None and lexical.unsaved >= LEXICAL_SAVE_EVERY:
+        threading.Thread(target=_save_lexical, name="lexical-snapshot", daemon=True).start()
+
+_checked_at = 0.0
+
+def stale() -> bool:
+    """
+    True if another process may have committed, deleted or published a
+    snapshot since this one last caught up. Checked at most every
+    STORE_REFRESH_S seconds; otherwise False without touching the disk.
+    """
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at < REFRESH_S:
+        return False
+    _checked_at = now
+    return (store.stale()
+            or (loaded("index") and index is not None and index.key != ann.snapshot_key(INDEX_SNAPSHOT))
+            or (loaded("lexical") and lexical.key != LexicalIndex.snapshot_key(LEXICAL_SNAPSHOT)))
+
+def refresh():
+    """
+    Catch up with what other worker processes wrote: reload the store
+    manifest and bring the loaded indexes up to date. Blocking.
+    """
+    with _commit_lock:
+        store.refresh()
+        _sync()
+
+def encode(texts: list[str], batch_size: int = 64) -> np.ndarray:
+    """
+    Embed texts into normalized float32 vectors.
+    """
+    load_embedder()
+    return embedder.encode(texts, batch_size)
+
+def split_new(texts: list[str]) -> tuple[list[str], int]:
+    """
+    Drop chunks whose normalized text is already stored (or repeated within
+    `texts`). Returns (chunks to embed, number of chunks reused).
+    """
+    seen, new = set(), []
+    for t in texts:
+        h = chunk_hash(t)
+        if h in seen or store.find_chunk(h) is not None:
+            continue
+        seen.add(h)
+        new.append(t)
+    return new, len(texts) - len(new)
+
+def commit(embs: np.ndarray, texts: list[str], files: dict | None = None, meta: dict | None = None):
+    """
+    Persist rows as one new store segment, then publish them to the
+    indexes (with whatever other processes committed before). Blocking;
+    call from a worker thread when on the event loop.
+    """
+    load_all()
+    with _commit_lock:
+        store.append(embs, texts, files=files, meta=meta)
+        _sync()
+    _maybe_publish()
+
+def delete_doc(doc_id: int, keep=(), before_id: int | None = None, drop_record: bool = True) -> int:
+    """
+    Delete a document's chunks (see SegmentStore.delete_doc) and drop them
+    from the indexes. Returns the number of chunks deleted. Blocking.
+    """
+    load_all()
+    with _commit_lock:
+        killed = store.delete_doc(doc_id, keep=keep, before_id=before_id, drop_record=drop_record)
+        _sync()
+    _maybe_publish()
+    return len(killed)
+
+class PendingBatch:
+    """
+    Chunks waiting to be embedded and committed together, filled by a
+    streaming ingest until it holds `size` chunks. Chunks that are already
+    stored or already pending are dropped on add(); the batch remembers, per
+    document, which reused chunks it already owned (`kept`, chunk ids) and
+    which belong to another document (`shared`, hex digests), so deleting or
+    replacing either document leaves the other intact. File records attached
+    to the batch are committed with its rows.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size  = size
+        self.texts: list[str] = []
+        self.pages: list[int] = []
+        self.docs:  list[int] = []
+        self.files: dict[str, dict] = {}
+        self.kept:   dict[int, set[int]] = {}
+        self.shared: dict[int, set[str]] = {}
+        self._seen: dict[bytes, int] = {}   # pending hash -> doc
+
+    def add(self, text: str, page: int = 0, doc: int = -1) -> bool:
+        """
+        Queue a chunk; returns False if it was a duplicate (reused).
+        """
+        h = chunk_hash(text)
+        if h in self._seen:
+            owner = self._seen[h]
+        elif (chunk_id := store.find_chunk(h)) is not None:
+            owner = store.meta_at(chunk_id)["doc_id"]
+            if owner == doc:
+                self.kept.setdefault(doc, set()).add(chunk_id)
+                return False
+        else:
+            self._seen[h] = doc
+            self.texts.append(text)
+            self.pages.append(page)
+            self.docs.append(doc)
+            return True
+        if owner != doc:
+            self.shared.setdefault(doc, set()).add(h.hex())
+        return False
+
+    def full(self) -> bool:
+        return len(self.texts) >= self.size
+
+    def discard(self, doc: int) -> int:
+        """
+        Drop a document's pending rows and reuse records, e.g. when its file
+        failed part-way. Returns the number of rows dropped.
+        """
+        rows = [i for i, d in enumerate(self.docs) if d != doc]
+        dropped = len(self.docs) - len(rows)
+        self.texts = [self.texts[i] for i in rows]
+        self.pages = [self.pages[i] for i in rows]
+        self.docs  = [self.docs[i] for i in rows]
+        self._seen = {h: d for h, d in self._seen.items() if d != doc}
+        self.kept.pop(doc, None)
+        self.shared.pop(doc, None)
+        return dropped
 
-# load or create FAISS index & metadata
-if os.path.exists(INDEX_PATH):
-    index  = faiss.read_index(INDEX_PATH)
-    chunks = list(np.load(META_PATH, allow_pickle=True))
-else:
-    index  = None
-    chunks = []
+    def flush(self) -> int:
+        """
+        Encode and commit everything pending; returns the number of new
+        chunks. Blocking.
+        """
+        n = len(self.texts)
+        if self.texts or self.files:
+            with metrics.stage("ingest", "encode"):
+                embs = encode(self.texts, self.size) if self.texts else None
+            with metrics.stage("ingest", "index_write"):
+                commit(embs, self.texts, self.files, {"pages": self.pages, "docs": self.docs})
+        self.texts, self.pages, self.docs, self.files, self._seen = [], [], [], {}, {}
+        return n
 
-async def embed_and_store(texts: list[str]):
+async def embed_and_store(texts: list[str]) -> dict:
     """
-    Embed a list of text chunks and store them in the FAISS index.
+    Embed a list of text chunks, append them as a new store segment and add
+    them to the in-memory FAISS index. Chunks already stored are reused.
     """
-    embs = embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
-    global index, chunks
-    if index is None:
-        dim   = embs.shape[1]
-        index = faiss.IndexFlatIP(dim)
-    index.add(embs)
-    chunks.extend(texts)
-    faiss.write_index(index, INDEX_PATH)
-    np.save(META_PATH, np.array(chunks, dtype=object))
+    texts, reused = split_new(texts)
+    if texts:
+        commit(encode(texts), texts)
+    return {"chunks_new": len(texts), "chunks_reused": reused}
 
-async def retrieve(question: str, k: int = 5) -> list[str]:
+def filter_mask(filters: dict | None) -> np.ndarray | None:
     """
-    Retrieve the top-k most relevant chunks for a question.
+    Ids of the live chunks selected by `filters`, evaluated on the metadata
+    columns; None when there is nothing to filter. Keys:
+      doc_ids                    documents to search in
+      tags                       documents carrying any of these tags
+      added_after, added_before  upload time range, unix seconds
     """
-    q_emb = embedder.encode([question], convert_to_numpy=True, normalize_embeddings=True)
-    D, I  = index.search(q_emb, k)
-    return [chunks[i] for i in I[0]]
+    if not filters or not any(v is not None for v in filters.values()):
+        return None
+    ids, docs, added, mask = store.columns("ids", "docs", "added", "alive")
+    wanted = None
+    if filters.get("doc_ids") is not None:
+        wanted = set(filters["doc_ids"])
+    if filters.get("tags"):
+        tagged = set(store.docs_tagged(filters["tags"]))
+        wanted = tagged if wanted is None else wanted & tagged
+    if wanted is not None:
+        mask &= np.isin(docs, list(wanted))
+    if filters.get("added_after") is not None:
+        mask &= added >= filters["added_after"]
+    if filters.get("added_before") is not None:
+        mask &= added < filters["added_before"]
+    return ids[mask]
+
+def search(questions: list[str], k: int, filters: dict | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Encode many questions in one call and run one batched index.search.
+    Returns (query embeddings, scores, ids); ids are -1 where nothing matched.
+    With `filters`, only the selected chunks are searched: the selection is
+    handed to FAISS as an id bitmap, so top-k is taken among them.
+    """
+    with metrics.stage("retrieval", "encode"):
+        q_embs = encode(questions)
+    load_index()
+    n = len(questions)
+    empty = np.zeros((n, k), dtype=np.float32), np.full((n, k), -1, dtype=np.int64)
+    if index is None or index.ntotal == 0:
+        return (q_embs, *empty)
+    sel = None
+    with metrics.stage("retrieval", "filter"):
+        selected = filter_mask(filters)
+    if selected is not None:
+        if not len(selected):
+            return (q_embs, *empty)
+        mask = np.zeros(int(selected[-1]) + 1, dtype=bool)
+        mask[selected] = True
+        bits = np.packbits(mask, bitorder="little")
+        sel  = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+    with metrics.stage("retrieval", "search"), index_lock:
+        D, I = index.search(q_embs, k, sel=sel)
+    return q_embs, D, I
+
+batcher = RetrievalBatcher(search)
+
+def lexical_search(question: str, k: int, filters: dict | None = None) -> np.ndarray:
+    """
+    Ids of the top-k chunks by BM25, optionally restricted by `filters`.
+    """
+    load_lexical()
+    allowed = filter_mask(filters)
+    if allowed is not None and not len(allowed):
+        return np.zeros(0, dtype=np.int64)
+    with metrics.stage("retrieval", "lexical"):
+        return lexical.search(question, k, allowed)[1]
+
+def fuse(rankings: list[list[int]], k: int) -> list[int]:
+    """
+    Reciprocal-rank fusion: each id scores sum(1 / (RRF_K + rank)) over the
+    rankings it appears in; returns the top k.
+    """
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking, 1):
+            scores[i] = scores.get(i, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+async def _dense(question: str, k: int, filters: dict | None) -> tuple[np.ndarray, list[int]]:
+    if filters:
+        # filtered searches carry their own selector, so they skip the batcher
+        q_embs, _, I = await asyncio.to_thread(search, [question], k, filters)
+        q_emb, ids = q_embs[0], I[0]
+    else:
+        q_emb, _, ids = await batcher.submit(question, k)
+    return q_emb, [int(i) for i in ids if i >= 0]
+
+async def retrieve_hits(question: str, k: int = 5, filters: dict | None = None,
+                        mode: str | None = None) -> tuple[np.ndarray | None, list[int], list[str]]:
+    """
+    Like retrieve(), but also returns the query embedding (None in lexical
+    mode, which never runs the embedder) and chunk ids.
+    """
+    mode = _check_mode(mode)
+    if mode == "dense":
+        q_emb, ids = await _dense(question, k, filters)
+    elif mode == "lexical":
+        q_emb, ids = None, (await asyncio.to_thread(lexical_search, question, k, filters)).tolist()
+    else:
+        depth = max(k, HYBRID_DEPTH)
+        (q_emb, dense), lex = await asyncio.gather(
+            _dense(question, depth, filters),
+            asyncio.to_thread(lexical_search, question, depth, filters),
+        )
+        ids = fuse([dense, lex.tolist()], k)
+    return _hits(mode, q_emb, ids)
+
+async def retrieve_hits_many(questions: list[str], k: int = 5, filters: dict | None = None,
+                             mode: str | None = None) -> list[tuple[np.ndarray | None, list[int], list[str]]]:
+    """
+    retrieve_hits() for many questions at once: one encode and one
+    index.search for all of them (called directly, not through the
+    micro-batcher), and the lexical rankings in one worker thread.
+    """
+    mode = _check_mode(mode)
+    if not questions:
+        return []
+    depth = k if mode != "hybrid" else max(k, HYBRID_DEPTH)
+
+    async def dense():
+        if mode == "lexical":
+            return [None] * len(questions), None
+        q_embs, _, I = await asyncio.to_thread(search, questions, depth, filters)
+        return list(q_embs), [[int(i) for i in row if i >= 0] for row in I]
+
+    async def lexical_many():
+        if mode == "dense":
+            return None
+        return await asyncio.to_thread(lambda: [lexical_search(q, depth, filters).tolist() for q in questions])
+
+    (q_embs, dense_ids), lex_ids = await asyncio.gather(dense(), lexical_many())
+    out = []
+    for j in range(len(questions)):
+        if mode == "dense":
+            ids = dense_ids[j]
+        elif mode == "lexical":
+            ids = lex_ids[j]
+        else:
+            ids = fuse([dense_ids[j], lex_ids[j]], k)
+        out.append(_hits(mode, q_embs[j], ids))
+    return out
+
+def _check_mode(mode: str | None) -> str:
+    mode = mode or RETRIEVAL_MODE
+    if mode not in MODES:
+        raise ValueError(f"retrieval mode must be one of {MODES}, got {mode!r}")
+    return mode
+
+def _hits(mode: str, q_emb: np.ndarray | None, ids: list[int]) -> tuple[np.ndarray | None, list[int], list[str]]:
+    # a chunk deleted after the search ran is dropped from the results
+    ids = [i for i in ids if store.contains(i)]
+    metrics.CHUNKS_RETRIEVED.inc(len(ids), mode=mode)
+    return q_emb, ids, [chunks[i] for i in ids]
+
+async def retrieve(question: str, k: int = 5, filters: dict | None = None,
+                   mode: str | None = None) -> list[str]:
+    """
+    Retrieve the top-k most relevant chunks for a question, optionally
+    restricted by metadata `filters` (see filter_mask). `mode` is "dense"
+    (embeddings), "lexical" (BM25) or "hybrid" (both, fused by reciprocal
+    rank); RETRIEVAL_MODE by default. Concurrent unfiltered dense searches
+    are micro-batched into a single encode + search.
+    """
+    _, _, docs = await retrieve_hits(question, k, filters, mode)
+    return docs
+
+def citations(ids: list[int]) -> list[dict]:
+    """
+    Source metadata (document, filename, page) for retrieved chunk ids.
+    """
+    return [store.meta_at(i) for i in ids]
 
 # ─── HOLISTIC UPLOAD -> CHUNK -> EMBED ────────────────────────────────────────
-async def chunk_and_embed(path: str, chunk_size: int = 500):
+def _stream_document(path: str, chunk_size: int, batch_size: int) -> dict:
+    batch = PendingBatch(batch_size)
+    doc   = store.reserve_doc_id()
+    new = reused = n = 0
+    for chunk, page in iter_chunks(iter_pages(path), chunk_size):
+        if not chunk:
+            continue
+        n += 1
+        if not batch.add(chunk, page, doc):
+            reused += 1
+        if batch.full():
+            new += batch.flush()
+    batch.files[file_sha256(path)] = {
+        "name": os.path.basename(path), "chunks": n, "added_at": time.time(), "doc": doc, "tags": [],
+        "shared": sorted(batch.shared.pop(doc, ())),
+    }
+    new += batch.flush()
+    return {"chunks_new": new, "chunks_reused": reused}
+
+async def chunk_and_embed(path: str, chunk_size: int = 500, batch_size: int = 256):
     """
-    Read a PDF, chunk its text, and embed+store those chunks.
+    Stream a document (PDF, DOCX or text) page by page through the chunker
+    and embed+store the chunks in batches of `batch_size`, so memory does
+    not grow with the document.
     """
-    text = ""
-    reader = PdfReader(path)
-    for page in reader.pages:
-        page_text = page.extract_text() or ""
-        text += page_text.replace("\n", " ")
-    cks = chunk_text(text, size=chunk_size)
-    await embed_and_store(cks)
+    return await asyncio.to_thread(_stream_document, path, chunk_size, batch_size)
@@ -0,0 +1,114 @@
+import os
+import time
+import asyncio
+import logging
+import importlib
+
+from app.core import llm, retrieval
+
+# ─── STARTUP / READINESS ──────────────────────────────────────────────────────
+#
+# The app starts serving right away (/health is a liveness probe) while
+# warm_up() loads the heavy resources in the background: the legacy store
+# migration, then the FAISS and BM25 indexes, in parallel with the embedder
+# and the LLM. A warm-up query then runs one retrieval end to end. /ready
+# reports ready only once every component is up; each component's load time
+# is logged, so slow cold starts show where the time goes.
+#
+# An unreachable LLM does not fail startup: it is retried every
+# READY_RETRY_S seconds and the service stays not-ready until it answers.
+
+WARMUP_QUERY      = os.getenv("WARMUP_QUERY", "onboarding policy")   # "" disables
+READY_RETRY_S     = float(os.getenv("READY_RETRY_S", "5"))
+ONBOARDING_PREWARM = os.getenv("ONBOARDING_PREWARM", "0") == "1"
+
+COMPONENTS = ("store", "embedder", "index", "lexical", "llm", "warmup")
+
+log = logging.getLogger("uvicorn.error")
+
+status: dict[str, dict] = {name: {"ready": False, "seconds": None, "error": None} for name in COMPONENTS}
+started_at = time.monotonic()
+ready_after: float | None = None
+
+
+def ready() -> bool:
+    return all(c["ready"] for c in status.values())
+
+
+def _done(name: str, seconds: float):
+    status[name].update(ready=True, seconds=round(seconds, 3), error=None)
+    log.info("startup: %s ready in %.2fs", name, seconds)
+
+
+async def _load(name: str, fn):
+    """
+    Run a blocking retrieval loader in a thread; the time it took comes from
+    retrieval.load_times, so a loader another caller already ran is free.
+    """
+    try:
+        await asyncio.to_thread(fn)
+    except Exception as e:
+        status[name]["error"] = str(e)
+        log.exception("startup: %s failed", name)
+        raise
+    _done(name, retrieval.load_times.get(name, 0.0))
+
+
+async def _llm():
+    while True:
+        t0 = time.perf_counter()
+        try:
+            await llm.warm_up()
+        except Exception as e:
+            if status["llm"]["error"] != str(e):
+                log.warning("startup: llm not reachable (%s), retrying every %gs", e, READY_RETRY_S)
+            status["llm"]["error"] = str(e)
+            await asyncio.sleep(READY_RETRY_S)
+            continue
+        _done("llm", time.perf_counter() - t0)
+        return
+
+
+async def _warmup_query():
+    t0 = time.perf_counter()
+    if WARMUP_QUERY:
+        await retrieval.retrieve(WARMUP_QUERY)
+    _done("warmup", time.perf_counter() - t0)
+
+
+async def warm_up():
+    """
+    Load everything, in parallel where the dependencies allow. Run as a
+    background task from the app lifespan.
+    """
+    global ready_after
+
+    async def indexes():
+        await _load("store", retrieval.load_store)
+        await asyncio.gather(_load("index", retrieval.load_index), _load("lexical", retrieval.load_lexical))
+
+    llm_task = asyncio.create_task(_llm())
+    try:
+        await asyncio.gather(indexes(), _load("embedder", retrieval.load_embedder))
+        await _warmup_query()
+        if ONBOARDING_PREWARM:
+            # registers the post-ingest prewarm hook; importing LangChain is slow
+            await asyncio.to_thread(importlib.import_module, "app.core.langchain_onboarding_agent")
+        await llm_task
+    except Exception:
+        llm_task.cancel()
+        return
+    ready_after = time.monotonic() - started_at
+    log.info(
+        "startup: ready in %.2fs (%s)", ready_after,
+        ", ".join(f"{n} {c['seconds']:.2f}s" for n, c in status.items()),
+    )
+
+
+def report() -> dict:
+    return {
+        "ready":      ready(),
+        "uptime_s":   round(time.monotonic() - started_at, 3),
+        "ready_after_s": round(ready_after, 3) if ready_after is not None else None,
+        "components": status,
+    }
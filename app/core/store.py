@@ -0,0 +1,920 @@
+import os
+import re
+import json
+import time
+import fcntl
+import bisect
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+# ─── SEGMENTED VECTOR STORE ───────────────────────────────────────────────────
+#
+# <root>/
+#   MANIFEST.json      committed, ordered list of segments (+ generation)
+#   wal.log            segments that were written but may not be in the manifest
+#   LOCK, COMPACT.lock flock()ed by the process writing / compacting
+#   tomb-000007.npy    int64 ids of deleted chunks (name recorded in the manifest)
+#   seg-000001/        one immutable segment
+#     embeddings.npy   float32 (n, dim)
+#     offsets.npy      int64 (n + 1,) byte offsets into text.bin
+#     text.bin         utf-8 chunk text, concatenated
+#     hashes.npy       uint8 (n, 32) sha256 of each chunk's normalized text
+#     <column>.npy     one file per metadata column, see META_COLUMNS
+#
+# Uploads only ever write a new small segment, so the cost of a commit is
+# proportional to the upload, not the corpus. Compaction merges a run of
+# segments into one in the background and swaps it in through the manifest.
+#
+# Every chunk has a stable id (the `ids` column, ascending in row order) that
+# is also its FAISS label. Deleting a document only records its chunk ids as
+# tombstones; compaction later rewrites the segments without them, which
+# moves rows but never changes an id.
+#
+# Per-chunk metadata is stored column-wise next to the embeddings, so filters
+# are evaluated as vectorized masks over whole columns. Document-level
+# records (filename, content hash, tags) live in the manifest's "files" map
+# and are joined through the `docs` column.
+#
+# Several processes (uvicorn/gunicorn workers) can open the same store; the
+# segments are mapped read-only, so their pages are shared through the page
+# cache rather than copied into every worker. Writes from all of them are
+# serialized by an flock() on LOCK (see SegmentStore.writer), and each write
+# bumps the manifest generation. Other processes pick the new version up with
+# refresh(), which costs one stat() of the manifest when nothing changed.
+
+MANIFEST   = "MANIFEST.json"
+WAL        = "wal.log"
+LOCK       = "LOCK"
+COMPACT_LOCK = "COMPACT.lock"
+COMPACT_AT = int(os.getenv("STORE_COMPACT_SEGMENTS", "16"))
+# compact once this fraction of rows is deleted
+TOMBSTONE_RATIO = float(os.getenv("STORE_TOMBSTONE_RATIO", "0.2"))
+
+# name -> (dtype, fill value for rows written before the column existed)
+META_COLUMNS = {
+    "ids":      (np.int64, -1),     # stable chunk id; older segments get their positions
+    "pages":    (np.int32, 0),      # source page (0 = unknown)
+    "docs":     (np.int32, -1),     # document id (-1 = unknown)
+    "added":    (np.float64, 0.0),  # upload time, unix seconds
+    "year_min": (np.int16, 0),      # smallest / largest year mentioned (0 = none)
+    "year_max": (np.int16, 0),
+}
+
+YEAR_PATTERN = re.compile(r"\b(19[0-9]{2}|20[0-9]{2})\b")
+
+
+def chunk_hash(text: str) -> bytes:
+    """
+    SHA-256 of a chunk's whitespace-normalized text.
+    """
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+
+
+def chunk_years(text: str) -> tuple[int, int]:
+    """
+    (smallest, largest) year between 1900 and 2099 mentioned in a chunk,
+    or (0, 0).
+    """
+    years = [int(y) for y in YEAR_PATTERN.findall(text)]
+    return (min(years), max(years)) if years else (0, 0)
+
+
+def _meta_rows(texts: list[str], meta: dict | None) -> dict[str, np.ndarray]:
+    """
+    Complete metadata columns for `texts`: given columns are kept, years are
+    detected from the text and the rest get their fill value.
+    """
+    meta = dict(meta or {})
+    if "year_min" not in meta or "year_max" not in meta:
+        years = np.array([chunk_years(t) for t in texts], dtype=np.int16).reshape(-1, 2)
+        meta.setdefault("year_min", years[:, 0])
+        meta.setdefault("year_max", years[:, 1])
+    out = {}
+    for name, (dtype, fill) in META_COLUMNS.items():
+        col = meta.get(name)
+        out[name] = (np.full(len(texts), fill, dtype=dtype) if col is None
+                     else np.ascontiguousarray(col, dtype=dtype))
+        if len(out[name]) != len(texts):
+            raise ValueError(f"metadata column {name!r} must have one value per chunk")
+    return out
+
+
+def _hash_rows(texts) -> np.ndarray:
+    if not texts:
+        return np.zeros((0, 32), dtype=np.uint8)
+    return np.frombuffer(b"".join(chunk_hash(t) for t in texts), dtype=np.uint8).reshape(-1, 32)
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _save_npy(path: str, arr: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, arr, allow_pickle=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class Segment:
+    """
+    Read-only view of one segment directory. Arrays are memory-mapped, so
+    opening a segment costs nothing until its rows are touched.
+    """
+
+    def __init__(self, path: str):
+        self.path       = path
+        self.name       = os.path.basename(path)
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.offsets    = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        text_path = os.path.join(path, "text.bin")
+        if os.path.getsize(text_path):
+            self.text = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            self.text = np.zeros(0, dtype=np.uint8)
+        hashes_path = os.path.join(path, "hashes.npy")
+        # segments written before chunk hashing get theirs computed on open
+        if os.path.exists(hashes_path):
+            self.hashes = np.load(hashes_path, mmap_mode="r")
+        else:
+            self.hashes = _hash_rows([self.chunk(i) for i in range(len(self))])
+        self.meta: dict[str, np.ndarray] = {}
+        missing = []
+        for name in META_COLUMNS:
+            col_path = os.path.join(path, f"{name}.npy")
+            if os.path.exists(col_path):
+                self.meta[name] = np.load(col_path, mmap_mode="r")
+            else:
+                missing.append(name)
+        if missing:
+            # older segments: years are recovered from the text, the rest filled
+            filled = _meta_rows([self.chunk(i) for i in range(len(self))], self.meta)
+            for name in missing:
+                self.meta[name] = filled[name]
+        # written before chunk ids: the store assigns them from the position
+        self.legacy_ids = "ids" in missing
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def chunk(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.text[start:end].tobytes().decode("utf-8")
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.meta["ids"]
+
+    @staticmethod
+    def write(path: str, embs: np.ndarray, texts: list[str], hashes: np.ndarray | None = None,
+              meta: dict | None = None):
+        """
+        Write a complete segment to `path` via a temp dir + rename, so a
+        segment directory either exists in full or not at all.
+        """
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        encoded = [t.encode("utf-8") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+        _save_npy(os.path.join(tmp, "embeddings.npy"),
+                  np.ascontiguousarray(embs, dtype=np.float32))
+        _save_npy(os.path.join(tmp, "offsets.npy"), offsets)
+        _write_file(os.path.join(tmp, "text.bin"), b"".join(encoded))
+        _save_npy(os.path.join(tmp, "hashes.npy"),
+                  _hash_rows(texts) if hashes is None else np.ascontiguousarray(hashes))
+        for name, col in _meta_rows(texts, meta).items():
+            _save_npy(os.path.join(tmp, f"{name}.npy"), col)
+        _fsync_dir(tmp)
+
+        os.rename(tmp, path)
+        _fsync_dir(os.path.dirname(path))
+
+
+class HashIndex:
+    """
+    chunk hash -> id of the chunk stored with it. Stored compactly as sorted
+    64-bit hash prefixes plus ids; candidates are confirmed against the full
+    32-byte hash in the segment. Recent additions sit in a small dict until
+    they are merged into the sorted arrays.
+    """
+
+    MERGE_AT = 4096
+
+    def __init__(self):
+        self._keys    = np.zeros(0, dtype=np.uint64)
+        self._ids     = np.zeros(0, dtype=np.int64)
+        self._pending: dict[bytes, int] = {}
+
+    @staticmethod
+    def _prefix(digests: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(digests[:, :8]).view("<u8").ravel()
+
+    def add(self, digests: np.ndarray, ids: np.ndarray):
+        # a digest can only be re-added after its chunk was deleted, so the
+        # newest id wins
+        for d, i in zip(np.asarray(digests), np.asarray(ids)):
+            self._pending[d.tobytes()] = int(i)
+        if len(self._pending) >= self.MERGE_AT:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        digests = np.frombuffer(b"".join(self._pending), dtype=np.uint8).reshape(-1, 32)
+        keys = np.concatenate([self._keys, self._prefix(digests)])
+        ids  = np.concatenate([self._ids, np.fromiter(self._pending.values(), dtype=np.int64)])
+        order = np.lexsort((-ids, keys))
+        self._keys, self._ids = keys[order], ids[order]
+        self._pending = {}
+
+    def candidates(self, digest: bytes) -> list[int]:
+        hit = self._pending.get(digest)
+        key = np.frombuffer(digest[:8], dtype="<u8")[0]
+        lo  = np.searchsorted(self._keys, key, side="left")
+        hi  = np.searchsorted(self._keys, key, side="right")
+        found = [int(i) for i in self._ids[lo:hi]]
+        return ([hit] if hit is not None else []) + found
+
+
+class ChunkView:
+    """
+    Chunk strings addressed by chunk id (the FAISS label). Iterates over the
+    live chunks in order.
+    """
+
+    def __init__(self, store: "SegmentStore"):
+        self._store = store
+
+    def __len__(self) -> int:
+        return self._store.live_count()
+
+    def __getitem__(self, chunk_id: int) -> str:
+        return self._store.chunk(chunk_id)
+
+    def __iter__(self):
+        segments, _ = self._store.snapshot()
+        deleted = self._store.deleted_ids()
+        for seg in segments:
+            dead = np.isin(seg.ids, deleted)
+            for i in range(len(seg)):
+                if not dead[i]:
+                    yield seg.chunk(i)
+
+
+class SegmentStore:
+    """
+    Append-only store of (embedding, chunk text) rows split across immutable
+    segments. Crash safety comes from the write order:
+
+      1) write the segment under a temp name, fsync, rename into place
+      2) append an intent record to the WAL
+      3) atomically replace the manifest
+      4) truncate the WAL
+
+    On open, WAL records are replayed against the manifest and any segment
+    directory (or tombstone file) that neither references is removed as
+    debris.
+
+    Every write runs inside writer(): the in-process lock plus an flock() on
+    LOCK, so writes are serialized across worker processes too, and each one
+    starts from a refresh() so it builds on the latest manifest.
+    """
+
+    def __init__(self, root: str):
+        self.root        = root
+        self._lock       = threading.RLock()
+        self._compacting = threading.Lock()
+        self._depth      = 0    # writer() nesting, flock held while > 0
+        self._manifest_key = None
+        os.makedirs(root, exist_ok=True)
+        self._lock_fd    = os.open(os.path.join(root, LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                self._manifest = self._recover()
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        self._next_doc   = max(
+            [self._manifest.get("next_doc", 0)]
+            + [rec["doc"] + 1 for rec in self._manifest.get("files", {}).values() if "doc" in rec]
+        )
+        self._view       = self._open_segments(self._manifest["segments"])
+        self._index_docs()
+        self._deleted    = self._read_tombstones(self._manifest)
+        segments, _ = self.snapshot()
+        self._next_id    = max(
+            self._manifest.get("next_id", 0),
+            int(segments[-1].ids[-1]) + 1 if segments else 0,
+        )
+        self._hashes     = HashIndex()
+        for seg in segments:
+            self._hashes.add(seg.hashes, seg.ids)
+        self._hashes._merge()
+
+    # ── manifest / WAL ──────────────────────────────────────────────────────
+    def _read_manifest(self) -> dict:
+        path = os.path.join(self.root, MANIFEST)
+        if not os.path.exists(path):
+            return {"generation": 0, "next_segment": 1, "dim": None, "segments": [], "files": {}}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: dict):
+        path = os.path.join(self.root, MANIFEST)
+        _write_file(path + ".tmp", json.dumps(manifest, indent=2).encode("utf-8"))
+        os.replace(path + ".tmp", path)
+        _fsync_dir(self.root)
+        self._manifest_key = self._stat_manifest()
+
+    def _stat_manifest(self):
+        try:
+            st = os.stat(os.path.join(self.root, MANIFEST))
+        except FileNotFoundError:
+            return None
+        # replaced, never rewritten in place: a new inode means a new version
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _log(self, record: dict):
+        with open(os.path.join(self.root, WAL), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate_wal(self):
+        open(os.path.join(self.root, WAL), "w").close()
+
+    def _recover(self) -> dict:
+        manifest = self._read_manifest()
+        wal_path = os.path.join(self.root, WAL)
+        replayed = False
+
+        if os.path.exists(wal_path):
+            with open(wal_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            for line in lines:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn final write; nothing after it was committed
+                segs = manifest["segments"]
+                # a compaction that dropped every row writes no segment
+                if rec["segment"] and not os.path.isdir(os.path.join(self.root, rec["segment"])):
+                    continue
+                if rec["op"] == "add" and rec["segment"] not in segs:
+                    segs.append(rec["segment"])
+                    manifest["dim"] = manifest["dim"] or rec.get("dim")
+                    manifest.setdefault("files", {}).update(rec.get("files") or {})
+                    replayed = True
+                elif rec["op"] == "compact" and all(s in segs for s in rec["inputs"]):
+                    at = segs.index(rec["inputs"][0])
+                    segs[at:at + len(rec["inputs"])] = [rec["segment"]] if rec["segment"] else []
+                    manifest["tombstones"] = rec.get("tombstones")
+                    replayed = True
+                if rec["segment"]:
+                    num = int(rec["segment"].split("-")[1])
+                    manifest["next_segment"] = max(manifest["next_segment"], num + 1)
+
+        if replayed:
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+        self._truncate_wal()
+        self._manifest_key = self._stat_manifest()
+
+        # another process may be writing a compacted segment right now
+        with self._compact_lock() as free:
+            if free:
+                live = set(manifest["segments"]) | {manifest.get("tombstones")}
+                for name in os.listdir(self.root):
+                    if name.startswith("seg-") and name not in live:
+                        shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                    elif name.startswith("tomb-") and name not in live:
+                        os.unlink(os.path.join(self.root, name))
+        return manifest
+
+    @contextmanager
+    def _compact_lock(self):
+        """
+        Non-blocking: yields False if another thread or process holds it.
+        """
+        if not self._compacting.acquire(blocking=False):
+            yield False
+            return
+        fd = os.open(os.path.join(self.root, COMPACT_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)   # releases the flock
+            self._compacting.release()
+
+    @contextmanager
+    def writer(self):
+        """
+        Exclusive write access across threads and processes. The store is
+        refreshed on entry, so a write always builds on the latest version.
+        Reentrant.
+        """
+        with self._lock:
+            if self._depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                if self._depth == 1:
+                    self.refresh()
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def stale(self) -> bool:
+        """
+        True if the manifest on disk is not the one this process last read
+        or wrote: another process wrote since.
+        """
+        return self._stat_manifest() != self._manifest_key
+
+    def refresh(self) -> bool:
+        """
+        Pick up what other processes committed. One stat() when nothing
+        changed; otherwise the manifest and tombstones are re-read, new
+        segments opened (open ones are reused) and their hashes indexed.
+        Returns True if the generation changed.
+        """
+        if not self.stale():
+            return False
+        with self._lock:
+            old_gen, old_next = self.generation, self._next_id
+            for attempt in range(5):
+                key = self._stat_manifest()
+                manifest = self._read_manifest()
+                try:
+                    view    = self._open_segments(manifest["segments"])
+                    deleted = self._read_tombstones(manifest)
+                    break
+                except FileNotFoundError:
+                    # a compaction removed files of the version just read
+                    if attempt == 4:
+                        raise
+            # the view first: readers take next_id as the bound of what it holds
+            self._view     = view
+            self._deleted  = deleted
+            self._manifest, self._manifest_key = manifest, key
+            self._next_id  = max(self._next_id, manifest.get("next_id", 0))
+            self._next_doc = max(self._next_doc, manifest.get("next_doc", 0))
+            self._index_docs()
+            for seg in view[0]:
+                if len(seg) and seg.ids[-1] >= old_next:
+                    at = int(np.searchsorted(seg.ids, old_next))
+                    self._hashes.add(seg.hashes[at:], seg.ids[at:])
+            return manifest["generation"] != old_gen
+
+    def _open_segments(self, names: list[str]) -> tuple:
+        opened   = {seg.name: seg for seg in getattr(self, "_view", ((), []))[0]}
+        segments = tuple(opened.get(n) or Segment(os.path.join(self.root, n)) for n in names)
+        starts, n = [], 0
+        for seg in segments:
+            if seg.legacy_ids:
+                # only segments from before chunk ids lack them, and nothing
+                # could be deleted then, so ids are positions
+                seg.meta["ids"] = np.arange(n, n + len(seg), dtype=np.int64)
+                seg.legacy_ids = False
+            starts.append(n)
+            n += len(seg)
+        starts.append(n)
+        firsts = [int(seg.ids[0]) for seg in segments]
+        # swapped in as one tuple so readers never see a half-updated list
+        return segments, starts, firsts
+
+    def _index_docs(self):
+        self._docs = {
+            rec["doc"]: {**rec, "sha256": sha}
+            for sha, rec in self._manifest.get("files", {}).items() if "doc" in rec
+        }
+        self._owners = {int(k): v for k, v in self._manifest.get("owners", {}).items()}
+
+    def _read_tombstones(self, manifest: dict) -> np.ndarray:
+        name = manifest.get("tombstones")
+        if name:
+            return np.load(os.path.join(self.root, name), allow_pickle=False)
+        return np.zeros(0, dtype=np.int64)
+
+    # ── read side ───────────────────────────────────────────────────────────
+    def snapshot(self) -> tuple[tuple[Segment, ...], list[int]]:
+        return self._view[:2]
+
+    def __len__(self) -> int:
+        """
+        Stored rows, including deleted ones not yet compacted away.
+        """
+        return self._view[1][-1]
+
+    def live_count(self) -> int:
+        return len(self) - len(self._deleted)
+
+    @property
+    def generation(self) -> int:
+        return self._manifest["generation"]
+
+    @property
+    def dim(self):
+        return self._manifest["dim"]
+
+    @property
+    def next_id(self) -> int:
+        """
+        Id the next stored chunk will get; every id below it was assigned.
+        """
+        return self._next_id
+
+    @property
+    def chunks(self) -> ChunkView:
+        return ChunkView(self)
+
+    def _locate(self, chunk_id: int) -> tuple[Segment, int] | None:
+        segments, _, firsts = self._view
+        s = bisect.bisect_right(firsts, chunk_id) - 1
+        if s < 0:
+            return None
+        ids = segments[s].ids
+        r = int(np.searchsorted(ids, chunk_id))
+        if r < len(ids) and ids[r] == chunk_id:
+            return segments[s], r
+        return None
+
+    def _row(self, chunk_id: int) -> tuple[Segment, int]:
+        hit = self._locate(chunk_id)
+        if hit is None:
+            raise KeyError(f"unknown chunk id {chunk_id}")
+        return hit
+
+    def chunk(self, chunk_id: int) -> str:
+        seg, r = self._row(chunk_id)
+        return seg.chunk(r)
+
+    def contains(self, chunk_id: int) -> bool:
+        """
+        True if the chunk is stored and not deleted.
+        """
+        return self._locate(chunk_id) is not None and not self.is_deleted(chunk_id)
+
+    def deleted_ids(self) -> np.ndarray:
+        """
+        Sorted ids of deleted chunks not yet compacted away.
+        """
+        return self._deleted
+
+    def is_deleted(self, chunk_id: int) -> bool:
+        deleted = self._deleted
+        j = int(np.searchsorted(deleted, chunk_id))
+        return j < len(deleted) and deleted[j] == chunk_id
+
+    def alive(self, since: int = 0) -> np.ndarray:
+        """
+        Boolean mask of live rows among chunks with id >= since.
+        """
+        return self.columns("alive", since=since)[0]
+
+    def embedding_at(self, chunk_id: int) -> np.ndarray:
+        seg, r = self._row(chunk_id)
+        return np.asarray(seg.embeddings[r])
+
+    def hash_at(self, chunk_id: int) -> bytes:
+        seg, r = self._row(chunk_id)
+        return seg.hashes[r].tobytes()
+
+    def meta_at(self, chunk_id: int) -> dict:
+        """
+        Metadata of a chunk, joined with its document record: doc_id,
+        filename, page, added_at, years.
+        """
+        seg, r = self._row(chunk_id)
+        row = {name: col[r].item() for name, col in seg.meta.items()}
+        doc_id = self._owners.get(chunk_id, row["docs"])
+        doc = self.doc(doc_id) if doc_id >= 0 else None
+        return {
+            "chunk_id": chunk_id,
+            "doc_id":   doc_id if doc_id >= 0 else None,
+            "filename": doc["name"] if doc else None,
+            "page":     row["pages"] or None,
+            "added_at": row["added"] or None,
+            "years":    [row["year_min"], row["year_max"]] if row["year_min"] else [],
+        }
+
+    def columns(self, *names: str, since: int = 0) -> list[np.ndarray]:
+        """
+        Aligned arrays over the chunks with id >= since, all read from one
+        snapshot so a concurrent compaction cannot skew them. Names are
+        metadata columns (see META_COLUMNS), "embeddings" or "alive" (False
+        for deleted chunks not yet compacted away).
+        """
+        segments, _ = self.snapshot()
+        deleted, owners = self._deleted, self._owners
+        parts = [
+            (seg, int(np.searchsorted(seg.ids, since)))
+            for seg in segments if len(seg) and seg.ids[-1] >= since
+        ]
+        out = []
+        for name in names:
+            if name == "embeddings":
+                arrays = [np.asarray(seg.embeddings[o:]) for seg, o in parts]
+                empty  = np.zeros((0, self.dim or 0), dtype=np.float32)
+            elif name == "alive":
+                arrays = [~np.isin(seg.ids[o:], deleted) for seg, o in parts]
+                empty  = np.zeros(0, dtype=bool)
+            else:
+                arrays = [np.asarray(seg.meta[name][o:]) for seg, o in parts]
+                empty  = np.zeros(0, dtype=META_COLUMNS[name][0])
+            col = np.concatenate(arrays) if arrays else empty
+            if name == "docs" and owners:
+                # chunks kept for another document after their own was deleted
+                ids = np.concatenate([seg.ids[o:] for seg, o in parts])
+                moved = np.fromiter(owners, dtype=np.int64)
+                at = np.searchsorted(ids, moved)
+                ok = at < len(ids)
+                ok[ok] = ids[at[ok]] == moved[ok]
+                col[at[ok]] = np.fromiter(owners.values(), dtype=np.int32)[ok]
+            out.append(col)
+        return out
+
+    def column(self, name: str, since: int = 0) -> np.ndarray:
+        """
+        One metadata column over the chunks with id >= since.
+        """
+        return self.columns(name, since=since)[0]
+
+    def doc(self, doc_id: int) -> dict | None:
+        """
+        File record of a document id (name, sha256, chunks, added_at, tags).
+        """
+        return self._docs.get(doc_id)
+
+    def docs(self) -> list[dict]:
+        return list(self._docs.values())
+
+    def docs_tagged(self, tags) -> list[int]:
+        """
+        Ids of documents carrying any of `tags`.
+        """
+        tags = set(tags)
+        return [d["doc"] for d in self._docs.values() if tags & set(d.get("tags", ()))]
+
+    def doc_chunks(self, doc_id: int) -> np.ndarray:
+        """
+        Ids of the live chunks attributed to a document.
+        """
+        ids, docs, alive = self.columns("ids", "docs", "alive")
+        return ids[(docs == doc_id) & alive]
+
+    def find_chunk(self, digest: bytes) -> int | None:
+        """
+        Id of a live stored chunk with this hash, or None.
+        """
+        for chunk_id in self._hashes.candidates(digest):
+            hit = self._locate(chunk_id)
+            if hit is not None and hit[0].hashes[hit[1]].tobytes() == digest \
+                    and not self.is_deleted(chunk_id):
+                return chunk_id
+        return None
+
+    def find_file(self, sha256: str) -> dict | None:
+        """
+        Record of a previously ingested file with this content hash, or None.
+        """
+        return self._manifest.get("files", {}).get(sha256)
+
+    def embeddings(self, since: int = 0) -> np.ndarray:
+        """
+        Embeddings of the chunks with id >= since, as one float32 array.
+        """
+        return self.columns("embeddings", since=since)[0]
+
+    def tombstone_ratio(self) -> float:
+        return len(self._deleted) / len(self) if len(self) else 0.0
+
+    # ── write side ──────────────────────────────────────────────────────────
+    def reserve_doc_id(self) -> int:
+        """
+        A fresh document id, for tagging rows before their file is committed.
+        Recorded in the manifest, so no other process hands it out again.
+        """
+        with self.writer():
+            doc_id = self._next_doc
+            self._next_doc += 1
+            # the data is unchanged, so the generation is too
+            manifest = {**self._manifest, "next_doc": self._next_doc}
+            self._write_manifest(manifest)
+            self._manifest = manifest
+            return doc_id
+
+    def append(self, embs: np.ndarray, texts: list[str], files: dict | None = None,
+               meta: dict | None = None):
+        """
+        Durably add rows as a new segment. `files` maps the content hash of
+        each source file to a small record, committed together with the rows;
+        a record for a document id replaces that document's previous record.
+        `meta` holds per-row metadata columns (see META_COLUMNS), with the
+        upload time defaulting to now. Returns the id of the first new chunk.
+        """
+        if texts and len(embs) != len(texts):
+            raise ValueError("embeddings and texts must have the same length")
+        with self.writer():
+            first = self._next_id
+            if not texts and not files:
+                return first
+            manifest = dict(self._manifest)
+            replaced = {rec["doc"] for rec in (files or {}).values() if "doc" in rec}
+            manifest["files"] = {
+                **{sha: rec for sha, rec in manifest.get("files", {}).items() if rec.get("doc") not in replaced},
+                **(files or {}),
+            }
+            manifest["next_doc"] = self._next_doc
+            if not texts:
+                # nothing new to index, but remember the files
+                self._write_manifest(manifest)
+                self._manifest = manifest
+                self._index_docs()
+                return first
+
+            hashes = _hash_rows(texts)
+            ids    = np.arange(first, first + len(texts), dtype=np.int64)
+            name = f"seg-{self._manifest['next_segment']:06d}"
+            meta = {"added": np.full(len(texts), time.time()), **(meta or {}), "ids": ids}
+            Segment.write(os.path.join(self.root, name), embs, texts, hashes, meta)
+            self._log({"op": "add", "segment": name, "dim": int(embs.shape[1]), "files": files or {}})
+
+            manifest["segments"]     = manifest["segments"] + [name]
+            manifest["next_segment"] = manifest["next_segment"] + 1
+            manifest["next_id"]      = first + len(texts)
+            manifest["generation"]   = manifest["generation"] + 1
+            manifest["dim"]          = manifest["dim"] or int(embs.shape[1])
+            self._write_manifest(manifest)
+            self._truncate_wal()
+
+            self._view     = self._open_segments(manifest["segments"])
+            self._manifest = manifest
+            self._next_id  = first + len(texts)
+            self._index_docs()
+            self._hashes.add(hashes, ids)
+
+        if len(self._manifest["segments"]) >= COMPACT_AT:
+            self.compact_in_background()
+        return first
+
+    def _write_tombstones(self, manifest: dict, deleted: np.ndarray) -> dict:
+        """
+        Write `deleted` as a new tombstone file and point `manifest` at it.
+        """
+        name = f"tomb-{manifest['generation'] + 1:06d}.npy"
+        if len(deleted):
+            _save_npy(os.path.join(self.root, name), np.asarray(deleted, dtype=np.int64))
+            manifest["tombstones"] = name
+        else:
+            manifest["tombstones"] = None
+        return manifest
+
+    def _drop_old_tombstones(self, old: str | None):
+        if old and old != self._manifest.get("tombstones"):
+            try:
+                os.unlink(os.path.join(self.root, old))
+            except FileNotFoundError:
+                pass
+
+    def delete_doc(self, doc_id: int, keep=(), before_id: int | None = None,
+                   drop_record: bool = True) -> np.ndarray:
+        """
+        Tombstone a document's chunks and (unless `drop_record` is False)
+        forget its file record. Chunks that another live document reused are
+        kept and attributed to that document; `keep` ids are kept too, and
+        with `before_id` only chunks with smaller ids are considered (for
+        replacing a document in place). Returns the deleted ids.
+        """
+        with self.writer():
+            owned = self.doc_chunks(doc_id)
+            if before_id is not None:
+                owned = owned[owned < before_id]
+            owned_set = set(owned.tolist())
+            reowned: dict[int, int] = {}
+            for rec in self._docs.values():
+                if rec["doc"] == doc_id:
+                    continue
+                for digest in rec.get("shared", ()):
+                    chunk_id = self.find_chunk(bytes.fromhex(digest))
+                    if chunk_id in owned_set:
+                        reowned.setdefault(chunk_id, rec["doc"])
+            kill = np.setdiff1d(owned, np.fromiter([*reowned, *keep], dtype=np.int64))
+            if not len(kill) and not reowned and not drop_record:
+                return kill
+            killed = set(kill.tolist())
+            owners = {k: v for k, v in self._owners.items() if k not in killed}
+            owners.update(reowned)
+
+            old = self._manifest.get("tombstones")
+            manifest = dict(self._manifest)
+            if drop_record:
+                manifest["files"] = {
+                    sha: rec for sha, rec in manifest.get("files", {}).items() if rec.get("doc") != doc_id
+                }
+            manifest["owners"] = {str(k): v for k, v in owners.items()}
+            deleted = np.union1d(self._deleted, kill)
+            self._write_tombstones(manifest, deleted)
+            manifest["generation"] = manifest["generation"] + 1
+            self._write_manifest(manifest)
+
+            self._manifest = manifest
+            self._deleted  = deleted
+            self._index_docs()
+            self._drop_old_tombstones(old)
+
+        if self.tombstone_ratio() >= TOMBSTONE_RATIO:
+            self.compact_in_background()
+        return kill
+
+    def compact(self):
+        """
+        Merge every current segment into one, leaving out deleted chunks.
+        Rows keep their order and ids, so the FAISS index is unaffected;
+        readers holding the previous snapshot keep using the old segments.
+        At most one compaction runs at a time across processes.
+        """
+        with self._compact_lock() as free:
+            if free:
+                self._compact()
+
+    def _compact(self):
+        with self.writer():
+            segments, _ = self.snapshot()
+            deleted = self._deleted
+            if len(segments) < 2 and not len(deleted):
+                return
+            name = f"seg-{self._manifest['next_segment']:06d}"
+            manifest = {**self._manifest, "next_segment": self._manifest["next_segment"] + 1}
+            self._write_manifest(manifest)
+            self._manifest = manifest
+
+        # the heavy part runs outside the lock; appends and deletes keep going
+        keep   = [~np.isin(s.ids, deleted) for s in segments]
+        embs   = np.concatenate([np.asarray(s.embeddings)[k] for s, k in zip(segments, keep)])
+        texts  = [s.chunk(i) for s, k in zip(segments, keep) for i in np.flatnonzero(k)]
+        hashes = np.concatenate([np.asarray(s.hashes)[k] for s, k in zip(segments, keep)])
+        meta   = {c: np.concatenate([np.asarray(s.meta[c])[k] for s, k in zip(segments, keep)])
+                  for c in META_COLUMNS}
+        dropped = np.concatenate([np.asarray(s.ids)[~k] for s, k in zip(segments, keep)])
+        if texts:
+            Segment.write(os.path.join(self.root, name), embs, texts, hashes, meta)
+        else:
+            name = None
+
+        inputs = [s.name for s in segments]
+        with self.writer():
+            old = self._manifest.get("tombstones")
+            manifest = dict(self._manifest)
+            remaining = np.setdiff1d(self._deleted, dropped)
+            self._write_tombstones(manifest, remaining)
+            self._log({"op": "compact", "segment": name, "inputs": inputs,
+                       "tombstones": manifest["tombstones"]})
+            segs = list(manifest["segments"])
+            segs[0:len(inputs)] = [name] if name else []
+            manifest["segments"]   = segs
+            gone = set(dropped.tolist())
+            manifest["owners"]     = {k: v for k, v in manifest.get("owners", {}).items()
+                                      if int(k) not in gone}
+            manifest["generation"] = manifest["generation"] + 1
+            self._write_manifest(manifest)
+            self._truncate_wal()
+            self._view     = self._open_segments(segs)
+            self._manifest = manifest
+            self._deleted  = remaining
+            self._index_docs()
+            self._drop_old_tombstones(old)
+
+        # open mmaps of the old segments stay valid after unlink, in
+        # this process and in any other
+        for s in segments:
+            shutil.rmtree(s.path, ignore_errors=True)
+
+    def compact_in_background(self):
+        threading.Thread(target=self.compact, name="store-compaction", daemon=True).start()
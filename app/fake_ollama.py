@@ -0,0 +1,74 @@
+"""
+Minimal stand-in for the Ollama HTTP API, for local testing and benchmarks.
+
+    uvicorn app.fake_ollama:app --port 11434
+
+Implements /api/generate (streamed NDJSON or a single JSON body), /api/tags
+and /api/version. Latency is configurable to mimic a CPU-bound model:
+  FAKE_OLLAMA_PREFILL_MS   delay before the first token   (default 200)
+  FAKE_OLLAMA_TOKEN_MS     delay between tokens           (default 20)
+"""
+import os
+import json
+import time
+import asyncio
+import datetime
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+
+PREFILL_MS = float(os.getenv("FAKE_OLLAMA_PREFILL_MS", "200"))
+TOKEN_MS   = float(os.getenv("FAKE_OLLAMA_TOKEN_MS", "20"))
+
+REPLY = (
+    "Based on the provided excerpts, the policy states that staff must complete "
+    "the required onboarding steps during their first week and follow all safety "
+    "procedures described in the handbook."
+)
+
+app = FastAPI(title="Fake Ollama")
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def _tokens(num_predict: int) -> list[str]:
+    words = REPLY.split(" ")
+    words = (words * (num_predict // len(words) + 1))[:num_predict]
+    return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+@app.post("/api/generate")
+async def generate(req: Request):
+    body   = await req.json()
+    model  = body.get("model", "mistral")
+    n      = int((body.get("options") or {}).get("num_predict") or 64)
+    tokens = _tokens(min(n, len(REPLY.split(" "))))
+    start  = time.perf_counter_ns()
+
+    def final(text: str) -> dict:
+        return {
+            "model": model, "created_at": _now(), "response": text, "done": True,
+            "done_reason": "stop", "total_duration": time.perf_counter_ns() - start,
+            "prompt_eval_count": len(body.get("prompt", "").split()),
+            "eval_count": len(tokens),
+        }
+
+    if not body.get("stream", True):
+        await asyncio.sleep((PREFILL_MS + TOKEN_MS * len(tokens)) / 1000)
+        return JSONResponse(final("".join(tokens)))
+
+    async def lines():
+        await asyncio.sleep(PREFILL_MS / 1000)
+        for tok in tokens:
+            yield json.dumps({"model": model, "created_at": _now(), "response": tok, "done": False}) + "\n"
+            await asyncio.sleep(TOKEN_MS / 1000)
+        yield json.dumps(final("")) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "mistral:latest", "model": "mistral:latest"}]}
+
+@app.get("/api/version")
+async def version():
+    return {"version": "0.0.0-fake"}
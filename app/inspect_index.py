@@ -1,14 +1,35 @@
-import numpy as np, faiss
-from sentence_transformers import SentenceTransformer
+import os
 
-chunks = np.load("app/chunks.npy", allow_pickle=True)
-print(f"Loaded {len(chunks)} chunks.")
-print("Snippet:", chunks[0][:100].replace('\n',' '), "...")
+from app.core import ann, embedding
+from app.core.retrieval import STORE_DIR
+from app.core.store import SegmentStore
 
-idx = faiss.read_index("app/faiss.index")
+store  = SegmentStore(STORE_DIR)
+chunks = store.chunks
+segments, _ = store.snapshot()
+print(f"Loaded {len(chunks)} chunks from {len(segments)} segment(s), generation {store.generation}.")
+first = next(iter(chunks))
+print("Snippet:", first[:100].replace('\n',' '), "...")
+
+# same index the API would serve: trained snapshot if present, else built fresh
+cfg = ann.index_config()
+idx, trained_on, covered = ann.load_snapshot(os.path.join(STORE_DIR, "index.faiss"), cfg)
+source = "snapshot"
+if idx is None:
+    ids, embs, alive = store.columns("ids", "embeddings", "alive")
+    idx = ann.build_index(embs[alive], cfg, dim=store.dim, ids=ids[alive])
+    trained_on, source = int(alive.sum()), "built"
+else:
+    ids, embs, alive = store.columns("ids", "embeddings", "alive", since=covered)
+    idx.add_with_ids(embs[alive], ids[alive])
+info = ann.describe(idx)
 print(f"Index dimension: {idx.d}, total vectors: {idx.ntotal}")
+print(f"Index type: {info['type']} ({info['class']}, {source}, trained on {trained_on}; configured INDEX_TYPE={cfg['type']})")
+params = {k: v for k, v in info.items() if k not in ("type", "class", "d", "ntotal")}
+if params:
+    print("Index params:", ", ".join(f"{k}={v}" for k, v in params.items()))
 
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-v = embedder.encode([chunks[0]], convert_to_numpy=True, normalize_embeddings=True)
+embedder = embedding.make_embedder()
+v = embedder.encode([first])
 D, I = idx.search(v, 1)
-print("Top match ID:", I[0][0], "— distance:", D[0][0])
\ No newline at end of file
+print("Top match ID:", I[0][0], "— distance:", D[0][0])
@@ -1,17 +1,130 @@
-from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
-from fastapi.staticfiles import StaticFiles
+import os
+import re
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 
 from app.routers import upload, query
+from app.core import ann, embedding, ingest, llm, metrics, reports, retrieval, startup
+from app.core.answer_cache import answer_cache
+from app.utils import file_utils
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load models and indexes in the background; /ready flips once done
+    task = asyncio.create_task(startup.warm_up(), name="warm-up")
+    yield
+    task.cancel()
 
 app = FastAPI(
     title="Private QA Assistant",
     version="0.1.0",
     openapi_version="3.1.0",
+    lifespan=lifespan,
 )
 
-# serve /app/reports as /reports
-app.mount("/reports", StaticFiles(directory="app/reports"), name="reports")
+@app.middleware("http")
+async def hot_reload(request: Request, call_next):
+    # with several workers, pick up what the others committed (or a newer
+    # index snapshot) before handling the request; see retrieval.refresh
+    if retrieval.stale():
+        with metrics.stage("store", "refresh"):
+            await asyncio.to_thread(retrieval.refresh)
+    return await call_next(request)
+
+class RequestSizeLimit:
+    """
+    Refuse a request body over UPLOAD_MAX_REQUEST_MB (413): from its
+    Content-Length before it is read, and in any case while it streams in,
+    so a chunked upload with no Content-Length is stopped too. Per-file
+    limits are enforced while saving (see file_utils).
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = file_utils.UPLOAD_MAX_REQUEST_MB * 2**20
+        too_large = JSONResponse(
+            {"detail": f"Request body larger than {file_utils.UPLOAD_MAX_REQUEST_MB:g} MB"}, status_code=413
+        )
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            return await too_large(scope, receive, send)
+
+        received, over, started = 0, False, False
+
+        async def counted():
+            # past the limit the app sees the client as gone, and whatever
+            # it answers to that is replaced by the 413
+            nonlocal received, over
+            if over:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                over = received > limit
+                if over:
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def unless_over(message):
+            nonlocal started
+            if not over:
+                started = True
+                await send(message)
+
+        try:
+            await self.app(scope, counted, unless_over)
+        except Exception:
+            if not over:
+                raise
+        if over and not started:
+            await too_large(scope, receive, send)
+
+app.add_middleware(RequestSizeLimit)
+
+TRACE_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+PARAM    = re.compile(r"{(\w+)(?::\w+)?}")
+UNTRACED = {"/health", "/ready", "/metrics"}   # probes and scrapes are not logged
+
+def _route(request: Request) -> str:
+    """
+    The matched route template with its router prefix (/upload/jobs/{job_id}),
+    so the metric labels stay bounded whatever the paths.
+    """
+    route = request.scope.get("route")
+    if route is None:
+        return "/reports" if request.url.path.startswith("/reports/") else "unmatched"
+    # routers are included without their prefix in the route: recover it
+    # from the part of the path in front of the route's own
+    path = request.url.path
+    own = PARAM.sub(lambda m: str(request.path_params.get(m.group(1), "")), route.path)
+    return path[:len(path) - len(own)] + route.path if path.endswith(own) else route.path
+
+@app.middleware("http")
+async def observe(request: Request, call_next):
+    # outermost: one trace per request, returned as X-Trace-Id
+    given = request.headers.get("x-request-id", "")
+    status = 500
+    with metrics.trace(given if TRACE_ID.fullmatch(given) else None) as t:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Trace-Id"] = t.id
+            return response
+        finally:
+            route = _route(request)
+            metrics.HTTP_SECONDS.observe(t.elapsed(), method=request.method, route=route)
+            metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=str(status))
+            if route not in UNTRACED:
+                metrics.log_trace(t, f"{request.method} {request.url.path} {status}")
+
+# serve REPORT_DIR as /reports (cacheable; lock/temp files hidden)
+app.mount("/reports", reports.ReportFiles(directory=reports.REPORT_DIR), name="reports")
 
 # your existing routers
 app.include_router(upload.router, prefix="/upload", tags=["upload"])
@@ -19,8 +132,68 @@ app.include_router(query.router, prefix="/query", tags=["query"])
 
 @app.get("/health")
 async def health():
+    """
+    Liveness: the process is up (it may still be loading).
+    """
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: 200 once the embedder, indexes and LLM are warm, else 503.
+    """
+    report = startup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/stats")
+async def stats():
+    lexical = retrieval.lexical
+    return {
+        "retrieval_batcher": retrieval.batcher.stats(),
+        "embedder": {"backend": getattr(retrieval.embedder, "backend", None),
+                     "threads": embedding.EMBED_THREADS, "parity": retrieval.embedder_parity},
+        "startup": startup.report(),
+        "index": ann.describe(retrieval.index),
+        "store": {
+            "worker_pid":      os.getpid(),
+            "chunks":          retrieval.store.live_count(),
+            "deleted":         len(retrieval.store.deleted_ids()),
+            "tombstone_ratio": round(retrieval.store.tombstone_ratio(), 4),
+            "generation":      retrieval.store.generation,
+        },
+        "lexical": {"chunks": len(lexical) if lexical else 0, "terms": lexical.n_terms if lexical else 0,
+                    "mode": retrieval.RETRIEVAL_MODE},
+        "answer_cache": answer_cache.stats(),
+    }
+
+# read when /metrics is scraped
+metrics.Gauge("qa_ready", "1 once every startup component is loaded", fn=lambda: int(startup.ready()))
+metrics.Gauge("qa_index_vectors", "Vectors in the FAISS index",
+              fn=lambda: retrieval.index.ntotal if retrieval.index is not None else 0)
+metrics.Gauge("qa_store_chunks", "Live chunks in the store", fn=lambda: retrieval.store.live_count())
+metrics.Gauge("qa_store_tombstone_ratio", "Deleted share of stored chunks",
+              fn=lambda: retrieval.store.tombstone_ratio())
+metrics.Gauge("qa_store_generation", "Store generation (bumped by every write)",
+              fn=lambda: retrieval.store.generation)
+metrics.Gauge("qa_ingest_queue_depth", "Ingestion batches waiting for the worker", fn=ingest.queue_depth)
+metrics.Gauge("qa_llm_in_flight", "Generations running", fn=lambda: llm.llm_load()["in_flight"])
+metrics.Gauge("qa_llm_waiting", "Generations waiting for a slot", fn=lambda: llm.llm_load()["waiting"])
+metrics.Gauge("qa_answer_cache_entries", "Entries in the semantic answer cache",
+              fn=lambda: answer_cache.stats()["entries"])
+metrics.Counter("qa_answer_cache_lookups_total", "Answer cache lookups", ("result",),
+                fn=lambda: {("hit",): answer_cache.hits, ("miss",): answer_cache.misses})
+metrics.Counter("qa_retrieval_batches_total", "Micro-batched encode + search calls",
+                fn=lambda: retrieval.batcher.batches)
+metrics.Counter("qa_retrieval_batched_requests_total", "Retrievals served through the micro-batcher",
+                fn=lambda: retrieval.batcher.requests)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint (text format 0.0.4), for this worker.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse("/docs")
@@ -1,46 +1,419 @@
 # app/routers/query.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import datetime
+import contextvars
+from collections import OrderedDict
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Literal, Optional
 
-from app.core.guardrails import check_query
-from app.core.llm import generate_response
-from app.core.retrieval import retrieve
+from app.core import metrics
+from app.core.context import SEPARATOR, count_tokens, retrieve_context, retrieve_contexts
+from app.core.guardrails import check_query, guardrail
+from app.core.llm import OLLAMA_CONCURRENCY, acquire_slot, generate_response, stream_response
+from app.core.retrieval import citations, store
+from app.core.answer_cache import answer_cache
 from app.core.agent import run_agent                # analyzer
-from app.core.langchain_onboarding_agent import run_onboarding_agent_lc  # onboarding
+
+class QueryFilters(BaseModel):
+    doc_ids: Optional[list[int]] = None
+    tags: Optional[list[str]] = None
+    date_from: Optional[datetime.date] = None  # upload date, inclusive
+    date_to: Optional[datetime.date] = None    # upload date, inclusive
+
+    def to_dict(self) -> dict:
+        def ts(d: datetime.date) -> float:
+            return datetime.datetime.combine(d, datetime.time.min).timestamp()
+        return {
+            "doc_ids":      self.doc_ids,
+            "tags":         self.tags,
+            "added_after":  ts(self.date_from) if self.date_from else None,
+            "added_before": ts(self.date_to + datetime.timedelta(days=1)) if self.date_to else None,
+        }
 
 class QueryReq(BaseModel):
     question: str
     use_agent: bool = False
     agent_type: Optional[str] = None  # "analyzer" or "onboarding"
+    filters: Optional[QueryFilters] = None
+    # dense | lexical (BM25, best for exact terms) | hybrid; RETRIEVAL_MODE by default
+    mode: Optional[Literal["dense", "lexical", "hybrid"]] = None
+
+class BatchQueryReq(BaseModel):
+    questions: list[str]
+    filters: Optional[QueryFilters] = None
+    mode: Optional[Literal["dense", "lexical", "hybrid"]] = None
+    # NDJSON lines as answers finish; False: one JSON body in question order
+    stream: bool = True
+
+QUERY_BATCH_MAX         = int(os.getenv("QUERY_BATCH_MAX", "256"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", str(OLLAMA_CONCURRENCY)))
+AGENT_JOBS_KEPT         = 100
+
+# answered without calling the LLM when nothing relevant was retrieved
+NO_CONTEXT_ANSWER = "I couldn't find anything relevant to this question in the indexed documents."
+AGENT_TYPES             = ("analyzer", "onboarding")
+
+# agent runs started through POST /query/jobs, oldest first
+agent_jobs: "OrderedDict[str, dict]" = OrderedDict()
+_agent_tasks: set = set()
 
 router = APIRouter()
 
+def build_prompt(question: str, docs: list[str]) -> str:
+    return (
+        "Use only these excerpts to answer the question:\n\n"
+        + SEPARATOR.join(docs)
+        + f"\n\nQuestion: {question}\nAnswer:"
+    )
+
+WITHHELD = "Response withheld: contains a banned term"
+
+def _cache_answer(q_emb, ids: list[int], answer: str, generation: int):
+    """
+    Cache an answer only if it passes the output guardrail, so the cache
+    never holds text the stream would not have sent.
+    """
+    if guardrail.find(answer) is None:
+        answer_cache.put(q_emb, ids, answer, generation)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class _CleanupStream(StreamingResponse):
+    """
+    A StreamingResponse that awaits `cleanup()` however it ends: sent in
+    full, failed, or abandoned by a client that left before or during the
+    body (when neither the body's own finally nor a background task would
+    run).
+    """
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            await self.cleanup()
+
+def _check_agent_type(agent_type: str | None):
+    if agent_type not in AGENT_TYPES:
+        raise HTTPException(400, detail="agent_type must be 'analyzer' or 'onboarding'")
+
+async def _run_agent(agent_type: str | None, question: str) -> dict:
+    _check_agent_type(agent_type)
+    if agent_type == "analyzer":
+        return await run_agent(question)
+    # imported on first use: LangChain is slow to import
+    from app.core.langchain_onboarding_agent import run_onboarding_agent_lc
+    return await run_onboarding_agent_lc(question)
+
 @router.post("/")
 async def query(req: QueryReq):
     # 1) guardrail
-    await check_query(req.question)
+    with metrics.stage("query", "guardrail"):
+        await check_query(req.question)
 
     # 2) agent path
     if req.use_agent:
-        if req.agent_type == "analyzer":
-            return await run_agent(req.question)
-        elif req.agent_type == "onboarding":
-            return await run_onboarding_agent_lc(req.question)
-        else:
-            raise HTTPException(
-                400, detail="agent_type must be 'analyzer' or 'onboarding'"
-            )
-
-    # 3) RAG fallback (chatbot)
-    docs = await retrieve(req.question)
-    prompt = (
-        "Use only these excerpts to answer the question:\n\n"
-        + "\n\n---\n\n".join(docs)
-        + f"\n\nQuestion: {req.question}\nAnswer:"
-    )
+        return await _run_agent(req.agent_type, req.question)
+
+    # 3) RAG fallback (chatbot): over-fetched chunks packed into a token
+    #    budget (see core/context.py), served from the answer cache when a
+    #    near-identical question selected the same chunks
+    filters = req.filters.to_dict() if req.filters else None
+    with metrics.stage("query", "retrieve"):
+        q_emb, ids, docs, context = await retrieve_context(req.question, filters=filters, mode=req.mode)
+    if not docs:
+        return {"answer": NO_CONTEXT_ANSWER, "citations": [], "context": context}
+    generation = store.generation
+    cached = answer_cache.lookup(q_emb, ids, generation)
+    if cached is not None:
+        return {"answer": cached, "cached": True, "citations": citations(ids), "context": context}
+
+    with metrics.stage("query", "prompt"):
+        prompt = build_prompt(req.question, docs)
+    context["prompt_tokens"] = count_tokens(prompt)
     try:
         answer = await generate_response(prompt)
-        return {"answer": answer}
+        _cache_answer(q_emb, ids, answer, generation)
+        return {"answer": answer, "citations": citations(ids), "context": context}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(500, detail=f"LLM error: {e}")
\ No newline at end of file
+        raise HTTPException(500, detail=f"LLM error: {e}")
+
+@router.post("/stream")
+async def query_stream(req: QueryReq):
+    """
+    RAG chatbot answer streamed as Server-Sent Events:
+      event: token   data: {"token": "..."}
+      event: done    data: {"citations": [...], "context": {...}}
+      event: error   data: {"detail": "..."}
+    Generation is cut off as soon as the output guardrail trips.
+    """
+    with metrics.stage("query", "guardrail"):
+        await check_query(req.question)
+    if req.use_agent:
+        raise HTTPException(400, detail="Agents are not streamed; use POST /query/")
+
+    filters = req.filters.to_dict() if req.filters else None
+    with metrics.stage("query", "retrieve"):
+        q_emb, ids, docs, context = await retrieve_context(req.question, filters=filters, mode=req.mode)
+    if not docs:
+        async def no_context():
+            yield _sse("token", {"token": NO_CONTEXT_ANSWER})
+            yield _sse("done", {"citations": [], "context": context})
+        return StreamingResponse(no_context(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+    generation = store.generation
+    cited = citations(ids)
+    cached = answer_cache.lookup(q_emb, ids, generation)
+    if cached is not None:
+        # only scanned answers are cached; scanned again here, as terms may
+        # have been added to the guardrail since
+        term = guardrail.find(cached)
+
+        async def replay():
+            if term:
+                yield _sse("error", {"detail": WITHHELD})
+                return
+            yield _sse("token", {"token": cached})
+            yield _sse("done", {"cached": True, "citations": cited, "context": context})
+        return StreamingResponse(replay(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    with metrics.stage("query", "prompt"):
+        prompt = build_prompt(req.question, docs)
+    context["prompt_tokens"] = count_tokens(prompt)
+
+    # the LLM slot is held here, not inside the generator, so it is released
+    # however the response ends (see _CleanupStream), even if the generator
+    # is never iterated
+    release = await acquire_slot()
+    tokens = stream_response(prompt)
+
+    async def cleanup():
+        try:
+            await tokens.aclose()
+        finally:
+            release()
+
+    # wait for the first token before committing to a 200, so a busy or
+    # unreachable LLM still surfaces as a proper HTTP error
+    started = False
+    try:
+        first = await anext(tokens, "")
+        started = True
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, detail=f"LLM error: {e}")
+    finally:
+        if not started:
+            await cleanup()
+
+    async def events():
+        # output guardrail: the scanner holds back a few characters so a
+        # banned term is caught before any part of it reaches the client
+        scanner = guardrail.stream()
+        parts, term = [], None
+        try:
+            tok = first
+            while tok is not None and not term:
+                parts.append(tok)
+                safe, term = scanner.feed(tok)
+                if safe:
+                    yield _sse("token", {"token": safe})
+                tok = await anext(tokens, None)
+            if not term:
+                safe, term = scanner.close()
+                if safe:
+                    yield _sse("token", {"token": safe})
+            if term:
+                yield _sse("error", {"detail": WITHHELD})
+                return
+            _cache_answer(q_emb, ids, "".join(parts).strip(), generation)
+            yield _sse("done", {"citations": cited, "context": context})
+        except Exception as e:
+            yield _sse("error", {"detail": f"LLM error: {e}"})
+
+    return _CleanupStream(
+        events(), cleanup,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _error(e: Exception) -> dict:
+    if isinstance(e, HTTPException):
+        return {"error": {"status": e.status_code, "detail": e.detail}}
+    return {"error": {"status": 500, "detail": f"LLM error: {e}"}}
+
+@router.post("/batch")
+async def query_batch(req: BatchQueryReq):
+    """
+    Answer many chatbot questions in one request. Each question passes the
+    same guardrail as POST /query/; repeated questions (ignoring case and
+    spacing) are answered once. All of them are retrieved together, with
+    one batched encode and one index.search, then answered with at most
+    QUERY_BATCH_CONCURRENCY generations in flight. A failing question gets
+    an error line of its own and the rest of the batch carries on.
+
+    Streamed as NDJSON, one line per question as soon as it is answered:
+      {"index": 3, "question": "...", "answer": "...", "citations": [...], "context": {...}}
+      {"index": 4, "question": "...", "error": {"status": 400, "detail": "..."}}
+    followed by a {"summary": {...}} line. With "stream": false the answers
+    come back in question order as {"results": [...], "summary": {...}}.
+    """
+    if len(req.questions) > QUERY_BATCH_MAX:
+        raise HTTPException(413, detail=f"At most {QUERY_BATCH_MAX} questions per batch")
+    t0 = time.perf_counter()
+    filters = req.filters.to_dict() if req.filters else None
+
+    # 1) guardrail and dedup: positions of each distinct question
+    failed: list[tuple[list[int], dict]] = []
+    groups: dict[str, list[int]] = {}
+    with metrics.stage("query", "guardrail"):
+        for i, q in enumerate(req.questions):
+            try:
+                await check_query(q)
+            except HTTPException as e:
+                failed.append(([i], _error(e)))
+                continue
+            groups.setdefault(" ".join(q.split()).casefold(), []).append(i)
+    unique = list(groups.values())
+    questions = [req.questions[positions[0]] for positions in unique]
+
+    # 2) one batched retrieval for every distinct question
+    try:
+        with metrics.stage("query", "retrieve"):
+            contexts = await retrieve_contexts(questions, filters=filters, mode=req.mode)
+    except Exception as e:
+        contexts = None
+        failed.extend((positions, _error(HTTPException(500, detail=f"Retrieval error: {e}"))) for positions in unique)
+
+    # 3) generations, bounded
+    gate = asyncio.Semaphore(QUERY_BATCH_CONCURRENCY)
+
+    async def answer(j: int) -> tuple[list[int], dict]:
+        q_emb, ids, docs, context = contexts[j]
+        if not docs:
+            return unique[j], {"answer": NO_CONTEXT_ANSWER, "citations": [], "context": context}
+        generation = store.generation
+        cached = answer_cache.lookup(q_emb, ids, generation)
+        if cached is not None:
+            return unique[j], {"answer": cached, "cached": True, "citations": citations(ids), "context": context}
+        prompt = build_prompt(questions[j], docs)
+        context["prompt_tokens"] = count_tokens(prompt)
+        try:
+            async with gate:
+                text = await generate_response(prompt)
+        except Exception as e:
+            return unique[j], _error(e)
+        _cache_answer(q_emb, ids, text, generation)
+        return unique[j], {"answer": text, "citations": citations(ids), "context": context}
+
+    def lines(positions: list[int], result: dict):
+        for i in positions:
+            yield {"index": i, "question": req.questions[i], **result}
+
+    def summary(errors: int) -> dict:
+        return {"questions": len(req.questions), "distinct": len(unique), "errors": errors,
+                "seconds": round(time.perf_counter() - t0, 3)}
+
+    async def results():
+        tasks = [asyncio.create_task(answer(j)) for j in range(len(unique))] if contexts is not None else []
+        try:
+            for positions, result in failed:
+                yield positions, result
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if not req.stream:
+        rows, errors = [], 0
+        async for positions, result in results():
+            errors += len(positions) if "error" in result else 0
+            rows.extend(lines(positions, result))
+        return {"results": sorted(rows, key=lambda r: r["index"]), "summary": summary(errors)}
+
+    async def ndjson():
+        errors = 0
+        async for positions, result in results():
+            errors += len(positions) if "error" in result else 0
+            for row in lines(positions, result):
+                yield json.dumps(row) + "\n"
+        yield json.dumps({"summary": summary(errors)}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _agent_job(job: dict):
+    # its own trace: the request that started the job has already returned
+    with metrics.trace(job["job_id"][:16]) as t:
+        job.update(status="running", updated_at=time.time())
+        try:
+            result = await _run_agent(job["agent_type"], job["question"])
+            job.update(status="done", result=result, updated_at=time.time())
+        except HTTPException as e:
+            job.update(status="failed", error=str(e.detail), updated_at=time.time())
+        except Exception as e:
+            job.update(status="failed", error=f"{job['agent_type']} agent error: {e}", updated_at=time.time())
+    metrics.log_trace(t, f"agent job {job['agent_type']} {job['status']}")
+
+@router.post("/jobs", status_code=202)
+async def start_agent_job(req: QueryReq):
+    """
+    Run an agent in the background and return its job id at once; poll
+    GET /query/jobs/{job_id} for the result. A request for an agent that
+    already has a job for the same question queued or running joins that
+    job.
+    """
+    with metrics.stage("query", "guardrail"):
+        await check_query(req.question)
+    _check_agent_type(req.agent_type)
+    key = (req.agent_type, req.question)
+    for job in reversed(agent_jobs.values()):
+        if (job["agent_type"], job["question"]) == key and job["status"] in ("queued", "running"):
+            return {"job_id": job["job_id"], "status": job["status"]}
+
+    job_id = uuid.uuid4().hex
+    job = agent_jobs[job_id] = {
+        "job_id":     job_id,
+        "agent_type": req.agent_type,
+        "question":   req.question,
+        "status":     "queued",
+        "result":     None,
+        "error":      None,
+        "created_at": time.time(),
+        "updated_at": time.time(),
+    }
+    while len(agent_jobs) > AGENT_JOBS_KEPT:
+        agent_jobs.popitem(last=False)
+    # not tied to (or cancelled with) this request
+    task = asyncio.create_task(_agent_job(job), name=f"agent-{job_id[:8]}",
+                               context=contextvars.Context())
+    _agent_tasks.add(task)
+    task.add_done_callback(_agent_tasks.discard)
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/jobs/{job_id}")
+async def agent_job_status(job_id: str):
+    """
+    Status of an agent job: queued, running, done (with the agent's
+    response as "result") or failed (with "error").
+    """
+    job = agent_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, detail=f"Unknown job id: {job_id}")
+    return job
@@ -1,19 +1,103 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+import os
+import asyncio
+
+from fastapi import APIRouter, File, Form, Request, UploadFile, HTTPException
+from app.core import metrics
 from app.utils.file_utils import save_doc
-from app.core.retrieval import chunk_and_embed
+from app.core.ingest import enqueue, get_job
+from app.core.retrieval import delete_doc, store
 
 router = APIRouter()
 
-@router.post("/")
-async def upload(files: list[UploadFile] = File(...)):
+@router.post("/", status_code=202)
+async def upload(files: list[UploadFile] = File(...), tags: str = Form("")):
+    """
+    1) Stream each uploaded file to disk, hashing it on the way
+    2) Enqueue an ingestion job (extract→chunk→embed runs in the background)
+    `tags` (comma-separated) are attached to the documents for filtered search.
+    A file over the size limit or of a type not accepted fails the whole
+    upload (413 / 415) and nothing is kept.
+    """
+    saved = []
+    try:
+        with metrics.stage("upload", "save"):
+            for f in files:
+                saved.append(await save_doc(f))
+        tag_list = [t.strip() for t in tags.split(",") if t.strip()]
+        job_id = await enqueue([p for p, _ in saved], [f.filename for f in files], tag_list,
+                               shas=[sha for _, sha in saved])
+        return {
+            "message": f"{len(files)} document(s) queued for indexing.",
+            "job_id": job_id,
+            "status": "queued",
+        }
+    except Exception as e:
+        for path, _ in saved:
+            os.unlink(path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Status of an ingestion job: queued, running, done or failed.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job id: {job_id}")
+    return job
+
+@router.get("/docs")
+async def list_docs():
+    """
+    Indexed documents with their ids, for filtering queries.
+    """
+    return [
+        {"doc_id": d["doc"], "filename": d["name"], "chunks": d["chunks"],
+         "added_at": d["added_at"], "tags": d.get("tags", [])}
+        for d in store.docs()
+    ]
+
+@router.put("/{doc_id}", status_code=202)
+async def replace_doc(doc_id: int, request: Request, file: UploadFile = File(...),
+                      tags: str | None = Form(None)):
     """
-    1) Save each uploaded file
-    2) Run chunk_and_embed() to extract→chunk→embed
+    Upload a new version of a document. It is ingested under the same id,
+    chunks shared with the old version are kept, and the rest of the old
+    version is deleted once the new one is committed. Tags are kept unless
+    the `tags` field is sent; an empty one clears them.
     """
+    if store.doc(doc_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown document id: {doc_id}")
+    # FastAPI hands an empty form field over as None, like a missing one
+    if tags is None and "tags" in await request.form():
+        tags = ""
+    path = None
     try:
-        for f in files:
-            path = await save_doc(f)
-            await chunk_and_embed(path)
-        return {"message": f"{len(files)} document(s) uploaded and indexed."}
+        with metrics.stage("upload", "save"):
+            path, sha = await save_doc(file)
+        tag_list = [t.strip() for t in tags.split(",") if t.strip()] if tags is not None else None
+        job_id = await enqueue([path], [file.filename], tag_list, replace=doc_id, shas=[sha])
+        return {
+            "message": f"New version of document {doc_id} queued for indexing.",
+            "job_id": job_id,
+            "status": "queued",
+        }
     except Exception as e:
+        if path is not None:
+            os.unlink(path)
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/{doc_id}")
+async def remove_doc(doc_id: int):
+    """
+    Delete a document: its chunks stop matching queries immediately and are
+    compacted away in the background. Chunks another document shares stay.
+    """
+    if store.doc(doc_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown document id: {doc_id}")
+    deleted = await asyncio.to_thread(delete_doc, doc_id)
+    return {"doc_id": doc_id, "chunks_deleted": deleted}
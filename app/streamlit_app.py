@@ -1,13 +1,26 @@
 import os
+import json
+import time
 import random
+import threading
 import streamlit as st
 import requests
+from collections import OrderedDict
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
 # ─── Configuration ────────────────────────────────────────────────────────
 INTERNAL_API_URL = os.getenv("INTERNAL_API_URL", "http://127.0.0.1:8000")
 EXTERNAL_API_URL = os.getenv("EXTERNAL_API_URL", INTERNAL_API_URL)
 
+UI_CONNECT_TIMEOUT = float(os.getenv("UI_CONNECT_TIMEOUT", "5"))     # seconds
+UI_READ_TIMEOUT    = float(os.getenv("UI_READ_TIMEOUT", "120"))      # seconds between bytes, not in total
+UI_POOL_SIZE       = int(os.getenv("UI_POOL_SIZE", "16"))            # kept-alive connections to the API
+UI_POLL_S          = float(os.getenv("UI_POLL_S", "1"))              # agent job polling interval
+UI_AGENT_TIMEOUT   = float(os.getenv("UI_AGENT_TIMEOUT", "1800"))    # give up waiting on an agent job
+UI_CACHE_TTL       = float(os.getenv("UI_CACHE_TTL", "600"))         # seconds
+UI_CACHE_MAX       = int(os.getenv("UI_CACHE_MAX", "256"))           # entries
+
 # ─── Page & Layout Config ─────────────────────────────────────────────────
 st.set_page_config(
     page_title="AI Assistant",
@@ -30,12 +43,128 @@ if "authenticated" not in st.session_state:
 st.sidebar.title("🗂️ Navigation")
 page = st.sidebar.radio("Go to", ["Chatbot", "Document Analyzer", "Faculty Onboarding"])
 
-# ─── Cache wrapper for queries ─────────────────────────────────────────────
-@st.cache_data(show_spinner=False)
-def post_query(payload: dict) -> dict:
-    resp = requests.post(f"{INTERNAL_API_URL}/query/", json=payload)
-    resp.raise_for_status()
-    return resp.json()
+# ─── API client ───────────────────────────────────────────────────────────
+# One pooled session for the whole process (every browser session shares it),
+# so requests reuse kept-alive connections. Chatbot answers are streamed from
+# /query/stream and rendered as they arrive; agent runs are started as jobs
+# and polled, so no request stays open for the length of a run. Results are
+# kept in a process-wide cache bounded by UI_CACHE_TTL and UI_CACHE_MAX.
+
+@st.cache_resource
+def _session() -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=UI_POOL_SIZE)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+class _TTLCache:
+    """
+    LRU cache whose entries also expire after `ttl` seconds.
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self._entries: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            if time.monotonic() - hit[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return hit[1]
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def _cache() -> _TTLCache:
+    return _TTLCache(UI_CACHE_MAX, UI_CACHE_TTL)
+
+def _cache_key(kind: str, payload: dict) -> str:
+    return kind + ":" + json.dumps(payload, sort_keys=True)
+
+def _post(path: str, payload: dict, **kwargs) -> requests.Response:
+    resp = _session().post(f"{INTERNAL_API_URL}{path}", json=payload,
+                           timeout=(UI_CONNECT_TIMEOUT, UI_READ_TIMEOUT), **kwargs)
+    if not resp.ok:
+        # closed here, since a caller's `with` never gets the response; the
+        # body is read first so _detail() can still show it
+        with resp:
+            resp.content
+            resp.raise_for_status()
+    return resp
+
+def _detail(e: Exception) -> str:
+    if isinstance(e, requests.RequestException) and e.response is not None:
+        try:
+            return str(e.response.json().get("detail", e.response.text))
+        except ValueError:
+            return e.response.text
+    return str(e)
+
+def stream_query(question: str):
+    """
+    Yield the chatbot answer to `question` piece by piece, from the cache or
+    from /query/stream. Raises RuntimeError on an error event or when the
+    stream ends without one; only complete answers are cached.
+    """
+    payload = {"question": question}
+    key = _cache_key("chat", payload)
+    cached = _cache().get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts, event = [], None
+    with _post("/query/stream", payload, stream=True) as resp:
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[5:])
+                if event == "token":
+                    parts.append(data["token"])
+                    yield data["token"]
+                elif event == "error":
+                    raise RuntimeError(data.get("detail", "error"))
+                elif event == "done":
+                    _cache().put(key, "".join(parts))
+                    return
+    raise RuntimeError("The answer stream ended before the answer was complete.")
+
+def run_agent_job(agent_type: str, question: str) -> dict:
+    """
+    The agent's response, from the cache or by starting a /query/jobs job
+    and polling it until it finishes.
+    """
+    payload = {"question": question, "use_agent": True, "agent_type": agent_type}
+    key = _cache_key("agent", payload)
+    cached = _cache().get(key)
+    if cached is not None:
+        return cached
+    job_id = _post("/query/jobs", payload).json()["job_id"]
+    deadline = time.monotonic() + UI_AGENT_TIMEOUT
+    while time.monotonic() < deadline:
+        resp = _session().get(f"{INTERNAL_API_URL}/query/jobs/{job_id}",
+                              timeout=(UI_CONNECT_TIMEOUT, UI_READ_TIMEOUT))
+        resp.raise_for_status()
+        job = resp.json()
+        if job["status"] == "done":
+            _cache().put(key, job["result"])
+            return job["result"]
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"])
+        time.sleep(UI_POLL_S)
+    raise RuntimeError(f"{agent_type} agent still running after {UI_AGENT_TIMEOUT:.0f}s")
 
 # ─── Chatbot Page ─────────────────────────────────────────────────────────
 if page == "Chatbot":
@@ -45,28 +174,45 @@ if page == "Chatbot":
         st.session_state.chat_history = []
 
     q = st.text_input("Ask a question about your documents:", key="chat_question")
-    if st.button("Submit", key="chat_submit") and q:
-        with st.spinner("Thinking..."):
-            data = post_query({"question": q, "use_agent": False})
-        answer = data.get("answer", "No answer returned.")
-        st.session_state.chat_history.append((q, answer))
+    submitted = st.button("Submit", key="chat_submit") and q
 
     for i, (user_q, bot_a) in enumerate(st.session_state.chat_history, 1):
         st.markdown(f"**Q{i}:** {user_q}")
         st.markdown(f"**A{i}:** {bot_a}")
         st.markdown("---")
 
+    if submitted:
+        # rendered as the tokens arrive, below the earlier answers
+        n = len(st.session_state.chat_history) + 1
+        st.markdown(f"**Q{n}:** {q}")
+        placeholder = st.empty()
+        answer = ""
+        try:
+            with st.spinner("Thinking..."):
+                for token in stream_query(q):
+                    answer += token
+                    placeholder.markdown(f"**A{n}:** {answer}▌")
+            answer = answer or "No answer returned."
+            placeholder.markdown(f"**A{n}:** {answer}")
+        except (requests.RequestException, RuntimeError) as e:
+            # e.g. withheld by the output guardrail mid-stream: the partial
+            # text is replaced, not kept as if it were the answer
+            answer = f"Error: {_detail(e)}"
+            placeholder.error(answer)
+        st.markdown("---")
+        st.session_state.chat_history.append((q, answer))
+
 # ─── Document Analyzer ────────────────────────────────────────────────────
 elif page == "Document Analyzer":
     st.title("🔍 Document Analyzer Agent")
     st.write("Flags outdated or redundant policies.")
     if st.button("Run Document Analyzer", key="analyzer_submit"):
-        with st.spinner("Analyzing…"):
-            data = post_query({
-                "question":   "Analyze all policies",
-                "use_agent":  True,
-                "agent_type": "analyzer"
-            })
+        try:
+            with st.spinner("Analyzing…"):
+                data = run_agent_job("analyzer", "Analyze all policies")
+        except (requests.RequestException, RuntimeError) as e:
+            st.error(_detail(e))
+            st.stop()
         issues = data.get("issues_found", 0)
         st.success(f"Found **{issues}** issues.")
         report = data.get("report_path") or data.get("filename")
@@ -94,13 +240,8 @@ elif page == "Faculty Onboarding":
         ss.onboard_score = 0
 
     # Cached fetch so we don't re-call on every rerun
-    @st.cache_data(show_spinner=False)
     def _fetch_onboarding():
-        return post_query({
-            "question":   "Generate faculty onboarding materials",
-            "use_agent":  True,
-            "agent_type": "onboarding"
-        })
+        return run_agent_job("onboarding", "Generate faculty onboarding materials")
 
     def _next_step():
         ss.quiz_step += 1
@@ -132,8 +273,12 @@ elif page == "Faculty Onboarding":
 
     # ─── Step 1: Generate & cache checklist+quiz ─────────────────────────────
     if ss.quiz_step == 1 and ss.checklist_file is None:
-        with st.spinner("Fetching onboarding materials…"):
-            data = _fetch_onboarding()
+        try:
+            with st.spinner("Fetching onboarding materials…"):
+                data = _fetch_onboarding()
+        except (requests.RequestException, RuntimeError) as e:
+            st.error(_detail(e))
+            st.stop()
         # only expose the checklist via Excel
         ss.checklist_file = data.get("filename")
         # sample the quiz
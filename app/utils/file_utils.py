@@ -1,20 +1,168 @@
-import os, uuid
+import os, time, uuid, hashlib
 import aiofiles
 from pathlib import Path
 
-UPLOAD_DIR = Path("uploaded_docs")
-UPLOAD_DIR.mkdir(exist_ok=True)
+from fastapi import HTTPException
 
-async def save_doc(f):
+# ─── UPLOADS ──────────────────────────────────────────────────────────────────
+#
+# Uploaded files are copied to UPLOAD_DIR in UPLOAD_CHUNK_BYTES pieces (the
+# multipart parser has already spooled them to a temp file), hashed in the
+# same pass, into a .tmp- file that is renamed into place once complete: a
+# reader never sees a partial upload, and memory per upload stays at one
+# piece whatever the file size. A file over UPLOAD_MAX_FILE_MB (413), or
+# whose extension or leading bytes do not match an allowed type (415), is
+# rejected as soon as that shows, and its partial copy removed.
+
+UPLOAD_DIR = Path(os.getenv(
+    "UPLOAD_DIR", Path(__file__).resolve().parent.parent.parent / "uploaded_docs"
+)).resolve()
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
+UPLOAD_MAX_FILE_MB = float(os.getenv("UPLOAD_MAX_FILE_MB", "200"))
+UPLOAD_MAX_REQUEST_MB = float(os.getenv("UPLOAD_MAX_REQUEST_MB", "1024"))   # any request body (see main.py)
+UPLOAD_TYPES = {e.strip().lower() for e in os.getenv("UPLOAD_TYPES", ".pdf,.docx,.txt,.md").split(",") if e.strip()}
+TMP_MAX_AGE_S = 24 * 3600
+
+# leading bytes a file of each type must start with
+MAGIC = {".pdf": b"%PDF-", ".docx": b"PK\x03\x04"}
+
+
+def _check_type(ext: str, head: bytes, filename: str):
+    if ext not in UPLOAD_TYPES:
+        raise HTTPException(415, detail=f"{filename}: file type {ext or '(none)'} not accepted; "
+                                        f"allowed: {', '.join(sorted(UPLOAD_TYPES))}")
+    magic = MAGIC.get(ext)
+    if magic is not None and not head.startswith(magic):
+        raise HTTPException(415, detail=f"{filename}: content is not a valid {ext} file")
+    if magic is None and b"\0" in head:
+        raise HTTPException(415, detail=f"{filename}: binary content in a {ext} file")
+
+
+async def save_doc(f) -> tuple[str, str]:
     """
-    Save the raw uploaded file to disk and return its path.
+    Stream an uploaded file to UPLOAD_DIR; returns its path and the hex
+    SHA-256 of its bytes.
     """
-    ext = os.path.splitext(f.filename)[1]
-    fn  = f"{uuid.uuid4().hex}{ext}"
-    path = UPLOAD_DIR / fn
+    ext  = os.path.splitext(f.filename or "")[1].lower()
+    path = UPLOAD_DIR / f"{uuid.uuid4().hex}{ext}"
+    tmp  = UPLOAD_DIR / f".tmp-{path.name}"
+    limit = UPLOAD_MAX_FILE_MB * 2**20
+    h, size = hashlib.sha256(), 0
+    try:
+        async with aiofiles.open(tmp, "wb") as out:
+            while piece := await f.read(UPLOAD_CHUNK_BYTES):
+                if not size:
+                    _check_type(ext, piece, f.filename)
+                size += len(piece)
+                if size > limit:
+                    raise HTTPException(413, detail=f"{f.filename}: larger than {UPLOAD_MAX_FILE_MB:g} MB")
+                h.update(piece)
+                await out.write(piece)
+        if not size:
+            _check_type(ext, b"", f.filename)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return str(path), h.hexdigest()
+
+
+def remove_stale_uploads(max_age: float = TMP_MAX_AGE_S):
+    """
+    Delete .tmp- files left by uploads interrupted by a crash. Only old ones:
+    another worker may be writing a recent one.
+    """
+    cutoff = time.time() - max_age
+    for p in UPLOAD_DIR.glob(".tmp-*"):
+        try:
+            if p.stat().st_mtime < cutoff:
+                p.unlink()
+        except FileNotFoundError:
+            pass
+
+
+remove_stale_uploads()
+
+TEXT_BLOCK  = 1 << 16   # characters per piece when streaming plain text
+PAGE_WINDOW = 16        # pages per read_pages() window
 
-    # write the uploaded bytes to disk
-    async with aiofiles.open(path, "wb") as out:
-        await out.write(await f.read())
+def is_pdf(path: str) -> bool:
+    return path.lower().endswith(".pdf")
 
-    return str(path)
+def iter_pages(path: str):
+    """
+    Yield (page number, text) pieces of a saved document in reading order,
+    one page (PDF), paragraph (DOCX) or block (plain text) at a time, so
+    callers never hold the whole document. Pages are numbered from 1; plain
+    text advances a page at each form feed. Concatenating the pieces gives
+    the document text.
+    """
+    if is_pdf(path):
+        from PyPDF2 import PdfReader
+        reader = PdfReader(path)
+        for i, page in enumerate(reader.pages):
+            yield i + 1, (page.extract_text() or "").replace("\n", " ")
+    elif path.lower().endswith(".docx"):
+        yield from _iter_docx(path)
+    else:
+        page = 1
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for block in iter(lambda: f.read(TEXT_BLOCK), ""):
+                parts = block.replace("\n", " ").split("\f")
+                for j, part in enumerate(parts):
+                    if j:
+                        page += 1
+                    if part:
+                        yield page, part
+
+def _iter_docx(path: str):
+    try:
+        from docx import Document
+    except ImportError as e:
+        raise RuntimeError("DOCX uploads require python-docx") from e
+    body = Document(path).element.body
+    # Word records where it last rendered page breaks; fall back to the
+    # explicit breaks for files written by other tools
+    rendered = bool(body.xpath(".//w:lastRenderedPageBreak"))
+    breaks = ".//w:lastRenderedPageBreak" if rendered else './/w:br[@w:type="page"]'
+    page = 1
+    for p in body.xpath(".//w:p"):
+        text = "".join(p.xpath(".//w:t/text()"))
+        if text:
+            yield page, text + " "
+        page += len(p.xpath(breaks))
+
+def pdf_page_count(path: str) -> int:
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+def read_pages(path: str, start: int, count: int = PAGE_WINDOW) -> list[tuple[int, str]]:
+    """
+    Pages [start, start + count) of a PDF (0-based start) as (page, text).
+    Picklable and self-contained, so windows can be parsed in a process pool.
+    """
+    from PyPDF2 import PdfReader
+    pages = PdfReader(path).pages
+    return [
+        (i + 1, (pages[i].extract_text() or "").replace("\n", " "))
+        for i in range(start, min(start + count, len(pages)))
+    ]
+
+def extract_text(path: str) -> str:
+    """
+    Extract the plain text of a saved document (PDF, DOCX, otherwise UTF-8
+    text). Loads the whole text; prefer iter_pages() for large files.
+    """
+    return "".join(text for _, text in iter_pages(path))
+
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+    """
+    Hex SHA-256 of a file's bytes, read in blocks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(block), b""):
+            h.update(buf)
+    return h.hexdigest()
@@ -0,0 +1,123 @@
+"""
+Recall / latency / memory benchmark for the ANN index types in app/core/ann.py.
+
+    python -m benchmarks.ann_index                      # embeddings from the vector store
+    python -m benchmarks.ann_index --synthetic 200000   # clustered random vectors
+    python -m benchmarks.ann_index --types ivf_flat,hnsw --nprobe 4,16 --ef 32,128 --json out.json
+
+For every index type and query-time setting it reports recall@k against the
+exact flat baseline, p50/p99 single-query latency, build time and index size.
+"""
+import os
+import time
+import json
+import argparse
+
+import faiss
+import numpy as np
+
+from app.core import ann
+
+
+def synthetic(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(x)
+    return x
+
+
+def from_store() -> np.ndarray:
+    from app.core.store import SegmentStore
+    base = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+    store = SegmentStore(os.getenv("VECTORSTORE_DIR", os.path.join(base, "vectorstore")))
+    return store.embeddings()
+
+
+def make_queries(xb: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    # stored vectors plus noise: "questions" that land near real chunks
+    rng = np.random.default_rng(seed)
+    xq = xb[rng.integers(0, len(xb), n)] + 0.05 * rng.standard_normal((n, xb.shape[1])).astype(np.float32)
+    xq = np.ascontiguousarray(xq, dtype=np.float32)
+    faiss.normalize_L2(xq)
+    return xq
+
+
+def run(index, xq, k, gt, params=None) -> dict:
+    lat = []
+    found = np.empty((len(xq), k), dtype=np.int64)
+    for i in range(len(xq)):
+        t0 = time.perf_counter()
+        _, I = index.search(xq[i:i + 1], k, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+        found[i] = I[0]
+    recall = np.mean([len(set(found[i]) & set(gt[i])) / k for i in range(len(xq))])
+    return {
+        "recall_at_k": round(float(recall), 4),
+        "p50_ms":      round(float(np.percentile(lat, 50)), 4),
+        "p99_ms":      round(float(np.percentile(lat, 99)), 4),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--synthetic", type=int, default=0, help="use N synthetic vectors instead of the store")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("-k", type=int, default=5)
+    ap.add_argument("--types", default="flat,ivf_flat,ivf_pq,hnsw")
+    ap.add_argument("--nprobe", default="1,4,16,64")
+    ap.add_argument("--ef", default="16,32,64,128")
+    ap.add_argument("--json", help="also write results to this file")
+    args = ap.parse_args()
+
+    xb = synthetic(args.synthetic, args.dim) if args.synthetic else from_store()
+    if not len(xb):
+        raise SystemExit("No embeddings in the store; pass --synthetic N.")
+    xq = make_queries(xb, args.queries)
+
+    flat = faiss.IndexFlatIP(xb.shape[1])
+    flat.add(xb)
+    _, gt = flat.search(xq, args.k)
+
+    results = []
+    for kind in args.types.split(","):
+        cfg = dict(ann.index_config(), type=kind)
+        t0 = time.perf_counter()
+        index = ann.build_index(xb, cfg)
+        build_s = time.perf_counter() - t0
+        info = ann.describe(index)
+        base = {
+            "type":        kind,
+            "built_as":    info["type"],
+            "n":           len(xb),
+            "build_s":     round(build_s, 3),
+            "index_bytes": int(faiss.serialize_index(index).size),
+        }
+
+        if info["type"] in ("ivf_flat", "ivf_pq"):
+            sweep = [("nprobe", int(v), ann.search_params(index, nprobe=int(v))) for v in args.nprobe.split(",")]
+        elif info["type"] == "hnsw":
+            sweep = [("ef_search", int(v), ann.search_params(index, ef_search=int(v))) for v in args.ef.split(",")]
+        else:
+            sweep = [(None, None, None)]
+
+        for name, value, params in sweep:
+            row = dict(base, **run(index, xq, args.k, gt, params))
+            if name:
+                row[name] = value
+            results.append(row)
+            print(
+                f"{kind:9s} {(name or '') + ('=' + str(value) if name else ''):14s} "
+                f"recall@{args.k}={row['recall_at_k']:.3f}  p50={row['p50_ms']:.3f}ms  "
+                f"p99={row['p99_ms']:.3f}ms  size={row['index_bytes'] / 2**20:.1f}MiB  "
+                f"build={row['build_s']:.2f}s"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n": len(xb), "queries": len(xq), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
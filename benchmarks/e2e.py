@@ -0,0 +1,375 @@
+"""
+End-to-end benchmark: the real FastAPI app, in-process, on a synthetic PDF
+corpus, answering through a local fake Ollama server.
+
+    python -m benchmarks.e2e
+    python -m benchmarks.e2e --docs 20,100,400 --pages 12 --concurrency 1,8,32 --json e2e.json
+    python -m benchmarks.e2e --token-ms 5 --prefill-ms 50 --modes dense,hybrid
+
+The corpus is grown in steps (--docs is cumulative). After each step it
+records ingest throughput (uploads through POST /upload until the job is
+done: pages/s, chunks/s) and a full analyzer run (state reset first, so the
+runtime is that of the whole corpus). On the final corpus it measures
+retrieve() p50/p99 per retrieval mode and POST /query throughput and
+latency at each concurrency level, with the answer cache off unless
+--answer-cache. Peak RSS (this process and the ingest worker processes) is
+taken after every phase.
+
+Everything runs in a scratch directory (vector store, uploads, reports), so
+the app's own data is never touched. Results go to stdout and, with --json,
+to a file that also records the git commit and settings, for comparing
+versions.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = [
+    "parental leave", "remote work", "expense reimbursement", "laboratory safety", "travel booking",
+    "conflict of interest", "grading appeals", "office hours", "sabbatical leave", "data retention",
+    "teaching load", "grant budgets", "student privacy", "equipment loans", "emergency procedures",
+    "vendor gifts", "course evaluations", "hiring committees", "payroll deadlines", "building access",
+]
+VERBS = ["must", "should", "may", "is required to", "is expected to"]
+ACTORS = ["faculty members", "staff", "department chairs", "new hires", "graduate assistants", "supervisors"]
+ACTIONS = [
+    "submit form {form} to the dean's office", "complete the online training", "notify human resources",
+    "keep records for {n} years", "obtain written approval in advance", "attend the orientation session",
+    "file receipts within {n} days", "review the handbook section on {topic}", "contact the compliance office",
+]
+
+
+# ─── SYNTHETIC CORPUS ─────────────────────────────────────────────────────────
+def _sentence(rng: random.Random, topic: str) -> str:
+    action = rng.choice(ACTIONS).format(form=f"HR-{rng.randint(100, 999)}", n=rng.randint(2, 90), topic=topic)
+    year = rng.randint(2012, 2026)
+    return f"Under the {year} {topic} policy, {rng.choice(ACTORS)} {rng.choice(VERBS)} {action}."
+
+
+def page_text(rng: random.Random, lines: int) -> list[str]:
+    topic = rng.choice(TOPICS)
+    return [_sentence(rng, topic) for _ in range(lines)]
+
+
+def _escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: list[list[str]]):
+    """
+    Minimal PDF (Helvetica, one text object per page) that PyPDF2 extracts.
+    """
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        body = " T* ".join(f"({_escape(line)}) Tj" for line in lines)
+        stream = f"BT /F1 9 Tf 12 TL 36 806 Td {body} ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(out)
+
+
+def make_corpus(folder: str, first: int, count: int, pages: int, lines: int, dup_rate: float,
+                seed: int = 0) -> list[str]:
+    """
+    Documents first..first+count-1 as PDFs. A `dup_rate` fraction of pages
+    repeats an earlier page, so the dedup and analyzer paths do real work.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths, seen = [], []
+    for d in range(first, first + count):
+        rng = random.Random(seed * 1_000_003 + d)
+        doc = []
+        for _ in range(pages):
+            if seen and rng.random() < dup_rate:
+                doc.append(rng.choice(seen))
+            else:
+                doc.append(page_text(rng, lines))
+                seen.append(doc[-1])
+        seen = seen[-200:]
+        path = os.path.join(folder, f"policy-{d:05d}.pdf")
+        write_pdf(path, doc)
+        paths.append(path)
+    return paths
+
+
+def make_questions(n: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    forms = ["What is the {t} policy for {a}?", "How do {a} handle {t}?", "Which form covers {t}?",
+             "Summarize the rules on {t}.", "When must {a} report {t} issues?"]
+    return [rng.choice(forms).format(t=rng.choice(TOPICS), a=rng.choice(ACTORS)) for _ in range(n)]
+
+
+# ─── MEASUREMENT HELPERS ──────────────────────────────────────────────────────
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in KiB on Linux (bytes on macOS)
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / 2**20
+    return {
+        "self":     round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1),
+    }
+
+
+def percentiles(lat_ms: list[float]) -> dict:
+    if not lat_ms:
+        return {"p50_ms": None, "p99_ms": None}
+    return {"p50_ms": round(float(np.percentile(lat_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(lat_ms, 99)), 3)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_fake_ollama(port: int):
+    import uvicorn
+    from app import fake_ollama
+
+    server = uvicorn.Server(uvicorn.Config(fake_ollama.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="fake-ollama", daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise SystemExit("fake Ollama did not start")
+        time.sleep(0.05)
+    return server
+
+
+# ─── PHASES ───────────────────────────────────────────────────────────────────
+async def ingest(client, paths: list[str], pages: int, per_upload: int) -> dict:
+    t0 = time.perf_counter()
+    jobs = []
+    for at in range(0, len(paths), per_upload):
+        files = [("files", (os.path.basename(p), open(p, "rb"), "application/pdf"))
+                 for p in paths[at:at + per_upload]]
+        try:
+            r = await client.post("/upload/", files=files)
+        finally:
+            for _, (_, f, _) in files:
+                f.close()
+        r.raise_for_status()
+        jobs.append(r.json()["job_id"])
+    chunks = reused = 0
+    for job_id in jobs:
+        while True:
+            job = (await client.get(f"/upload/jobs/{job_id}")).json()
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        if job["status"] == "failed":
+            raise SystemExit(f"ingest job failed: {job['error']}")
+        chunks += job["chunks"]
+        reused += job["chunks_reused"]
+    seconds = time.perf_counter() - t0
+    return {
+        "docs":          len(paths),
+        "pages":         len(paths) * pages,
+        "chunks":        chunks,
+        "chunks_reused": reused,
+        "seconds":       round(seconds, 3),
+        "pages_per_s":   round(len(paths) * pages / seconds, 2),
+        "chunks_per_s":  round(chunks / seconds, 2),
+    }
+
+
+async def analyzer(client) -> dict:
+    from app.core import agent, retrieval
+
+    # a fresh run over the whole corpus, not just what was added since
+    for path in (agent.STATE_PATH, agent.FINDINGS_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+    t0 = time.perf_counter()
+    r = await client.post("/query/", json={"question": "analyze", "use_agent": True, "agent_type": "analyzer"})
+    r.raise_for_status()
+    out = r.json()
+    # chunks_analyzed is a span of chunk ids, which are not dense: count live chunks
+    return {"seconds": round(time.perf_counter() - t0, 3), "chunks": retrieval.store.live_count(),
+            "issues": out["issues_found"]}
+
+
+async def retrieve_latency(questions: list[str], modes: list[str], k: int) -> dict:
+    from app.core import retrieval
+
+    out = {}
+    for mode in modes:
+        lat = []
+        for q in questions:
+            t0 = time.perf_counter()
+            await retrieval.retrieve(q, k, mode=mode)
+            lat.append((time.perf_counter() - t0) * 1000)
+        out[mode] = {"n": len(lat), **percentiles(lat)}
+    return out
+
+
+async def query_load(client, questions: list[str], concurrency: int, n: int) -> dict:
+    gate = asyncio.Semaphore(concurrency)
+    lat, statuses = [], {}
+
+    async def one(q: str):
+        async with gate:
+            t0 = time.perf_counter()
+            r = await client.post("/query/", json={"question": q})
+            ms = (time.perf_counter() - t0) * 1000
+        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+        if r.status_code == 200:
+            lat.append(ms)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(questions[i % len(questions)]) for i in range(n)))
+    seconds = time.perf_counter() - t0
+    return {
+        "concurrency": concurrency,
+        "requests":    n,
+        "ok":          len(lat),
+        "statuses":    {str(k): v for k, v in sorted(statuses.items())},
+        "seconds":     round(seconds, 3),
+        "req_per_s":   round(len(lat) / seconds, 2),
+        **percentiles(lat),
+    }
+
+
+async def run(args, workdir: str) -> dict:
+    import httpx
+    from app.core import retrieval, startup
+    from app.main import app
+
+    # the repo's legacy faiss.index / chunks.npy must not be migrated into the scratch store
+    retrieval.INDEX_PATH = os.path.join(workdir, "faiss.index")
+    retrieval.META_PATH = os.path.join(workdir, "chunks.npy")
+    results: dict = {"startup": None, "steps": [], "retrieve": None, "query": [], "peak_rss_mb": {}}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        # the lifespan does not run under ASGITransport: warm up explicitly
+        t0 = time.perf_counter()
+        await startup.warm_up()
+        results["startup"] = {"seconds": round(time.perf_counter() - t0, 3), **startup.report()}
+        results["peak_rss_mb"]["startup"] = peak_rss_mb()
+
+        done = 0
+        for target in (int(d) for d in args.docs.split(",")):
+            paths = make_corpus(os.path.join(workdir, "corpus"), done, target - done, args.pages,
+                                args.lines, args.dup_rate, args.seed)
+            step = {"corpus_docs": target, "ingest": await ingest(client, paths, args.pages, args.per_upload)}
+            step["analyzer"] = await analyzer(client)
+            step["peak_rss_mb"] = peak_rss_mb()
+            results["steps"].append(step)
+            done = target
+            ing, an = step["ingest"], step["analyzer"]
+            print(f"docs={target:<6d} ingest {ing['pages_per_s']:8.1f} pages/s {ing['chunks_per_s']:8.1f} chunks/s"
+                  f"  analyzer {an['seconds']:7.2f}s over {an['chunks']} chunks"
+                  f"  rss {step['peak_rss_mb']['self']:.0f} MiB (+{step['peak_rss_mb']['children']:.0f})")
+
+        questions = make_questions(args.queries, args.seed + 1)
+        results["retrieve"] = await retrieve_latency(questions, args.modes.split(","), args.k)
+        for mode, row in results["retrieve"].items():
+            print(f"retrieve {mode:8s} p50={row['p50_ms']:.2f}ms p99={row['p99_ms']:.2f}ms")
+        results["peak_rss_mb"]["retrieve"] = peak_rss_mb()
+
+        for c in (int(c) for c in args.concurrency.split(",")):
+            row = await query_load(client, questions, c, max(args.requests, c))
+            results["query"].append(row)
+            print(f"/query c={c:<4d} {row['req_per_s']:7.2f} req/s  p50={row['p50_ms']}ms  "
+                  f"p99={row['p99_ms']}ms  statuses={row['statuses']}")
+        results["peak_rss_mb"]["query"] = peak_rss_mb()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", default="20,100", help="cumulative corpus sizes, in documents")
+    ap.add_argument("--pages", type=int, default=8, help="pages per document")
+    ap.add_argument("--lines", type=int, default=30, help="sentences per page")
+    ap.add_argument("--dup-rate", type=float, default=0.05, help="fraction of pages repeating an earlier one")
+    ap.add_argument("--per-upload", type=int, default=10, help="files per POST /upload")
+    ap.add_argument("--queries", type=int, default=200, help="distinct questions")
+    ap.add_argument("--modes", default="dense,lexical,hybrid")
+    ap.add_argument("-k", type=int, default=5)
+    ap.add_argument("--concurrency", default="1,8,32")
+    ap.add_argument("--requests", type=int, default=100, help="/query requests per concurrency level")
+    ap.add_argument("--prefill-ms", type=float, default=200, help="fake LLM delay before the first token")
+    ap.add_argument("--token-ms", type=float, default=20, help="fake LLM delay between tokens")
+    ap.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache on")
+    ap.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="also write results to this file")
+    args = ap.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="qa-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    json_path = os.path.abspath(args.json) if args.json else None
+    port = free_port()
+    # settings are read at import time, so they are set before the app is imported
+    os.environ.update({
+        "VECTORSTORE_DIR":        os.path.join(workdir, "vectorstore"),
+        "UPLOAD_DIR":             os.path.join(workdir, "uploaded_docs"),
+        "REPORT_DIR":             os.path.join(workdir, "reports"),
+        "OLLAMA_HOST":            f"http://127.0.0.1:{port}",
+        "FAKE_OLLAMA_PREFILL_MS": str(args.prefill_ms),
+        "FAKE_OLLAMA_TOKEN_MS":   str(args.token_ms),
+    })
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_THRESHOLD"] = "2"   # cosine never reaches it
+    sys.path.insert(0, ROOT)
+
+    start_fake_ollama(port)
+    t0 = time.time()
+    results = asyncio.run(run(args, workdir))
+    report = {
+        "meta": {
+            "commit":     git_commit(),
+            "started_at": t0,
+            "python":     platform.python_version(),
+            "platform":   platform.platform(),
+            "cpus":       os.cpu_count(),
+            "settings":   vars(args),
+            "env":        {k: v for k, v in os.environ.items()
+                           if k.startswith(("INDEX_", "EMBED_", "RETRIEVAL_", "OLLAMA_", "INGEST_", "BM25_"))},
+        },
+        **results,
+    }
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {json_path}")
+    print(f"scratch data in {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Throughput / latency / memory / parity benchmark for the embedding backends
+in app/core/embedding.py, on a sample of chunks from the vector store.
+
+    python -m benchmarks.embedders
+    python -m benchmarks.embedders --backends torch,onnx-int8 --threads 1,4 --sample 1000 --json out.json
+
+Each backend runs in a fresh process, so load time and resident memory are
+its own. It reports model load time, RSS after loading, batch encode
+throughput, p50/p99 single-query latency, parity (cosine against the
+reference backend's vectors for the same chunks) and recall@k of retrieving
+the sample with queries embedded by the backend, against the reference
+backend's exact top-k. The reference is the first backend listed.
+"""
+import os
+import time
+import json
+import argparse
+import multiprocessing as mp
+
+import faiss
+import numpy as np
+
+
+def sample_chunks(n: int, seed: int = 0) -> list[str]:
+    from app.core.store import SegmentStore
+    base = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+    store = SegmentStore(os.getenv("VECTORSTORE_DIR", os.path.join(base, "vectorstore")))
+    ids, alive = store.columns("ids", "alive")
+    ids = ids[alive]
+    pick = np.random.default_rng(seed).choice(ids, min(n, len(ids)), replace=False)
+    return [store.chunk(int(i)) for i in np.sort(pick)]
+
+
+def make_queries(texts: list[str], n: int, seed: int = 1) -> list[str]:
+    # the opening words of sampled chunks: short "questions" with a known source
+    rng = np.random.default_rng(seed)
+    return [" ".join(texts[i].split()[:12]) for i in rng.integers(0, len(texts), n)]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(backend: str, threads: int, texts: list[str], queries: list[str], batch: int, out):
+    from app.core import embedding
+
+    base = rss_mb()
+    t0 = time.perf_counter()
+    emb = embedding.make_embedder(backend, threads=threads)
+    load_s = time.perf_counter() - t0
+    emb.encode(queries[:4])  # first call allocates
+
+    t0 = time.perf_counter()
+    xb = emb.encode(texts, batch)
+    encode_s = time.perf_counter() - t0
+
+    lat = []
+    xq = np.empty((len(queries), emb.dim), dtype=np.float32)
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        xq[i] = emb.encode([q])[0]
+        lat.append((time.perf_counter() - t0) * 1000)
+
+    out.put({
+        "load_s":       round(load_s, 3),
+        "rss_mb":       round(rss_mb() - base, 1),
+        "texts_per_s":  round(len(texts) / encode_s, 1),
+        "p50_ms":       round(float(np.percentile(lat, 50)), 3),
+        "p99_ms":       round(float(np.percentile(lat, 99)), 3),
+        "xb":           xb,
+        "xq":           xq,
+    })
+
+
+def measure(backend: str, threads: int, texts, queries, batch: int) -> dict:
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    p = ctx.Process(target=_measure, args=(backend, threads, texts, queries, batch, out))
+    p.start()
+    try:
+        return out.get()
+    finally:
+        p.join()
+
+
+def topk(xb: np.ndarray, xq: np.ndarray, k: int) -> np.ndarray:
+    index = faiss.IndexFlatIP(xb.shape[1])
+    index.add(xb)
+    return index.search(xq, k)[1]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backends", default="torch,onnx,onnx-int8")
+    ap.add_argument("--threads", default="0", help="EMBED_THREADS values to try (0: all cores)")
+    ap.add_argument("--sample", type=int, default=2000, help="chunks taken from the store")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=64)
+    ap.add_argument("-k", type=int, default=5)
+    ap.add_argument("--json", help="also write results to this file")
+    args = ap.parse_args()
+
+    texts = sample_chunks(args.sample)
+    if not texts:
+        raise SystemExit("No chunks in the store; ingest some documents first.")
+    queries = make_queries(texts, args.queries)
+
+    ref, results = None, []
+    for backend in args.backends.split(","):
+        for threads in (int(t) for t in args.threads.split(",")):
+            row = measure(backend, threads, texts, queries, args.batch)
+            xb, xq = row.pop("xb"), row.pop("xq")
+            if ref is None:
+                ref = (xb, xq, topk(xb, xq, args.k))
+            sims = np.sum(xb * ref[0], axis=1)
+            found = topk(xb, xq, args.k)
+            row = {
+                "backend":       backend,
+                "threads":       threads,
+                **row,
+                "parity_min":    round(float(sims.min()), 6),
+                "parity_mean":   round(float(sims.mean()), 6),
+                "recall_at_k":   round(float(np.mean([
+                    len(set(found[i]) & set(ref[2][i])) / args.k for i in range(len(xq))
+                ])), 4),
+            }
+            results.append(row)
+            print(
+                f"{backend:9s} threads={threads:<3d} load={row['load_s']:.2f}s  rss={row['rss_mb']:.0f}MiB  "
+                f"{row['texts_per_s']:.0f} texts/s  p50={row['p50_ms']:.2f}ms  p99={row['p99_ms']:.2f}ms  "
+                f"parity min={row['parity_min']:.4f} mean={row['parity_mean']:.4f}  "
+                f"recall@{args.k}={row['recall_at_k']:.3f}"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n": len(texts), "queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
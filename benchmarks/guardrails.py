@@ -0,0 +1,68 @@
+"""
+Per-query cost of the guardrail matcher as the banned-term list grows.
+
+    python -m benchmarks.guardrails
+    python -m benchmarks.guardrails --sizes 35,1000,10000 --queries 2000
+
+Compares the compiled single-pass matcher (app/core/guardrails.py) with the
+previous approach of running one regex per term on every request.
+"""
+import re
+import time
+import random
+import string
+import argparse
+
+from app.core.guardrails import TermMatcher, bad_words
+
+QUESTIONS = [
+    "What is the policy on accepting gifts from vendors?",
+    "How many vacation days do new faculty members get in their first year?",
+    "Summarize the safety procedures for the chemistry laboratory.",
+    "Who do I contact about payroll questions and direct deposit forms?",
+    "Is there a dress code for classroom instruction and office hours?",
+]
+
+
+def make_terms(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    terms = list(bad_words)
+    while len(terms) < n:
+        terms.append("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12))))
+    return terms[:n]
+
+
+def per_term(terms: list[str], q: str):
+    for term in terms:
+        if re.search(rf"\b{term}\b", q, re.IGNORECASE):
+            return term
+    return None
+
+
+def timed(fn, queries: list[str]) -> float:
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - t0) / len(queries) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="35,100,1000,5000")
+    ap.add_argument("--queries", type=int, default=1000)
+    args = ap.parse_args()
+
+    queries = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.queries)]
+    print(f"{'terms':>7} {'compile ms':>11} {'compiled us/q':>14} {'per-term us/q':>14}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        terms = make_terms(n)
+        t0 = time.perf_counter()
+        matcher = TermMatcher(terms)
+        compile_ms = (time.perf_counter() - t0) * 1000
+        compiled = timed(matcher.find, queries)
+        naive = timed(lambda q: per_term(terms, q), queries[: max(50, args.queries // 20)])
+        print(f"{n:>7} {compile_ms:>11.1f} {compiled:>14.1f} {naive:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
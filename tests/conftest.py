@@ -0,0 +1,74 @@
+import os
+import time
+import socket
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+
+# ─── TEST SETUP ───────────────────────────────────────────────────────────────
+#
+# The app's modules open the vector store, the upload and the report
+# directories when they are imported, so all three are pointed at a scratch
+# directory before anything from app/ is imported. Embeddings come from a deterministic bag-of-words
+# embedder instead of the sentence-transformers model, so the tests need no
+# model download, and the LLM is the stand-in in app/fake_ollama.py.
+
+SCRATCH = tempfile.mkdtemp(prefix="qa-tests-")
+os.environ["VECTORSTORE_DIR"] = os.path.join(SCRATCH, "vectorstore")
+os.environ["UPLOAD_DIR"]      = os.path.join(SCRATCH, "uploads")
+os.environ["REPORT_DIR"]      = os.path.join(SCRATCH, "reports")
+
+from app.core import embedding, retrieval  # noqa: E402
+
+
+class HashEmbedder(embedding.Embedder):
+    """
+    Each word adds 1 to a hashed dimension; rows L2-normalized.
+    """
+    backend = "hash"
+    dim = 384
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                out[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1, norms)
+
+
+# no legacy faiss.index / chunks.npy to migrate into the scratch store
+retrieval.INDEX_PATH = os.path.join(SCRATCH, "faiss.index")
+retrieval.META_PATH  = os.path.join(SCRATCH, "chunks.npy")
+retrieval.embedder   = HashEmbedder()
+retrieval.load_times["embedder"] = 0.0
+
+
+@pytest.fixture(scope="session")
+def fake_ollama():
+    """
+    app/fake_ollama.py served on a free port, with short latencies, as the
+    LLM the app talks to.
+    """
+    import uvicorn
+    from app import fake_ollama
+    from app.core import llm
+
+    fake_ollama.PREFILL_MS, fake_ollama.TOKEN_MS = 5, 1
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_ollama.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="fake-ollama", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "fake Ollama did not start"
+        time.sleep(0.02)
+    llm.ollama_host = f"http://127.0.0.1:{port}"
+    yield fake_ollama
+    server.should_exit = True
+    thread.join(5)
@@ -0,0 +1,70 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+from app.core import agent, ingest, reports
+from app.core import langchain_onboarding_agent as onboarding
+from app.core.retrieval import delete_doc, store
+
+
+@pytest.fixture(autouse=True)
+def fresh_worker(monkeypatch):
+    monkeypatch.setattr(reports, "REPORT_FORMAT", "csv")
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+
+
+async def _ingest(path: str):
+    job_id = await ingest.enqueue([path], [path.rsplit("/", 1)[1]])
+    while ingest.get_job(job_id)["status"] in ("queued", "running"):
+        await asyncio.sleep(0.01)
+
+
+def _findings() -> list[dict]:
+    with open(agent.FINDINGS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_concurrent_runs_record_each_finding_once(tmp_path):
+    path = tmp_path / "handbook.txt"
+    path.write_text(" ".join(
+        f"Rule {n} of the handbook was last revised in 1998 by committee {n}." for n in range(20)
+    ))
+
+    async def run():
+        await _ingest(str(path))
+        return await asyncio.gather(agent.run_agent("analyze"), agent.run_agent("analyze"))
+
+    first, second = asyncio.run(run())
+    rows = _findings()
+    keys = [(r["chunk_id"], r["issue"]) for r in rows]
+    assert len(keys) == len(set(keys))
+    assert first["new_issues"] + second["new_issues"] == len(rows)
+    assert any(r["issue"] == "outdated" for r in rows)
+    # REPORT_DIR comes from the environment (see conftest.py)
+    assert os.path.dirname(first["report_path"]) == os.environ["REPORT_DIR"]
+    # whichever ran second found nothing new
+    assert 0 in (first["chunks_analyzed"], second["chunks_analyzed"])
+
+
+def test_onboarding_cache_follows_the_documents_not_the_index(tmp_path):
+    path = tmp_path / "welcome.txt"
+    path.write_text("Welcome to the faculty. Keys are collected at the front desk on day one.")
+    asyncio.run(_ingest(str(path)))
+    key, generation = onboarding._cache_key(), store.generation
+
+    store.compact()
+    assert store.generation != generation
+    assert onboarding._cache_key() == key
+
+    extra = tmp_path / "parking.txt"
+    extra.write_text("Parking permits are issued by campus security.")
+    asyncio.run(_ingest(str(extra)))
+    added = onboarding._cache_key()
+    assert added != key
+
+    doc = next(d["doc"] for d in store.docs() if d["name"] == "parking.txt")
+    delete_doc(doc)
+    assert onboarding._cache_key() == key != added
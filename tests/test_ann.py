@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from app.core import ann
+
+
+def _corpus(n: int = 4000, dim: int = 32, seed: int = 0) -> np.ndarray:
+    # clustered, L2-normalized rows: what sentence embeddings look like to an IVF
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(40, dim))
+    x = centers[rng.integers(0, 40, n)] + 0.3 * rng.normal(size=(n, dim))
+    x = x.astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _cfg(kind: str, **over) -> dict:
+    return {**ann.index_config(), "type": kind, "nlist": 64, "nprobe": 16, "pq_m": 8, "pq_nbits": 8,
+            "hnsw_m": 16, "ef_construction": 80, "ef_search": 64, **over}
+
+
+def _recall(I: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(I.tolist(), truth.tolist())]))
+
+
+@pytest.mark.parametrize("kind, floor, over", [
+    ("ivf_flat", 0.9, {}),
+    ("ivf_pq", 0.3, {"pq_m": 16, "pq_nbits": 4}),   # lossy; 8 bits needs ~10k training vectors
+    ("hnsw", 0.9, {}),
+])
+def test_index_types_find_the_exact_neighbours(kind, floor, over):
+    embs = _corpus()
+    ids = np.arange(len(embs), dtype=np.int64) * 7 + 3   # stable chunk ids, not positions
+    queries = embs[:50] + 0.01
+    _, truth = ann.build_index(embs, _cfg("flat"), ids=ids).search(queries, 10)
+
+    index = ann.build_index(embs, _cfg(kind, **over), ids=ids)
+    _, I = index.search(queries, 10)
+
+    assert ann.describe(index)["type"] == kind
+    assert set(I.ravel().tolist()) <= set(ids.tolist())
+    assert _recall(I, truth) >= floor
+
+
+def test_small_corpus_gets_a_flat_stand_in_until_it_can_train():
+    cfg = _cfg("ivf_flat")
+    index = ann.build_index(_corpus(20), cfg)
+    assert ann.describe(index)["type"] == "flat"
+    assert not ann.needs_rebuild(index, 0, cfg)
+    index.add_with_ids(_corpus(30, seed=1), np.arange(20, 50))
+    assert ann.needs_rebuild(index, 0, cfg)
+
+
+def test_trained_index_is_rebuilt_once_it_outgrows_its_sample():
+    cfg = _cfg("ivf_flat", rebuild_factor=2)
+    embs = _corpus(2000)
+    index = ann.build_index(embs, cfg)
+    assert not ann.needs_rebuild(index, len(embs), cfg)
+    more = _corpus(2500, seed=1)
+    index.add_with_ids(more, np.arange(2000, 4500))
+    assert ann.needs_rebuild(index, len(embs), cfg)
+
+
+def test_search_params_override_the_defaults_per_call():
+    embs = _corpus()
+    index = ann.build_index(embs, _cfg("ivf_flat", nprobe=1))
+    assert ann.describe(index)["nprobe"] == 1
+    params = ann.search_params(index, nprobe=10_000)
+    assert params.nprobe == ann.describe(index)["nlist"]   # capped at nlist
+    _, narrow = index.search(embs[:50], 10)
+    _, wide = index.search(embs[:50], 10, params=params)
+    _, truth = ann.build_index(embs, _cfg("flat")).search(embs[:50], 10)
+    assert _recall(wide, truth) == 1.0 >= _recall(narrow, truth)
+
+
+def test_remove_ids_drops_vectors_except_from_hnsw():
+    embs = _corpus(1000)
+    flat = ann.build_index(embs, _cfg("flat"))
+    assert ann.remove_ids(flat, [0, 1, 2])
+    _, I = flat.search(embs[:3], 1)
+    assert not {0, 1, 2} & set(I.ravel().tolist())
+
+    hnsw = ann.build_index(embs, _cfg("hnsw"))
+    assert not ann.remove_ids(hnsw, [0])
+    assert hnsw.ntotal == 1000
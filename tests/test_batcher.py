@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from app.core.batcher import RetrievalBatcher
+
+
+class FakeSearch:
+    """
+    Records each call; row i of the results is question i's number, so a
+    caller handed the wrong row is easy to spot.
+    """
+
+    def __init__(self, gate: threading.Event | None = None):
+        self.calls: list[list[str]] = []
+        self.gate = gate
+
+    def __call__(self, questions: list[str], k: int):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.calls.append(list(questions))
+        n = np.array([int(q.split()[-1]) for q in questions], dtype=np.float32)
+        embs = n[:, None] * np.ones((1, 4), dtype=np.float32)
+        D = n[:, None] + np.arange(k, dtype=np.float32)
+        I = n[:, None].astype(np.int64) * 100 + np.arange(k)
+        return embs, D, I
+
+
+def test_concurrent_calls_share_one_search():
+    search = FakeSearch()
+    batcher = RetrievalBatcher(search, window_ms=50, max_batch=32)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(f"question {n}", 2 + n % 3) for n in range(10)))
+
+    results = asyncio.run(run())
+    assert search.calls == [[f"question {n}" for n in range(10)]]
+    for n, (emb, D, I) in enumerate(results):
+        k = 2 + n % 3
+        assert emb[0] == n
+        assert I.tolist() == [n * 100 + j for j in range(k)]
+        assert len(D) == k
+    assert batcher.stats()["batch_sizes"] == {10: 1}
+
+
+def test_batches_are_capped_and_callers_queue_for_the_next():
+    gate = threading.Event()
+    search = FakeSearch(gate)
+    batcher = RetrievalBatcher(search, window_ms=20, max_batch=4)
+
+    async def run():
+        tasks = [asyncio.create_task(batcher.submit(f"q {n}", 1)) for n in range(6)]
+        await asyncio.sleep(0.05)
+        # the first batch is running; these queue up behind it
+        tasks += [asyncio.create_task(batcher.submit(f"q {n}", 1)) for n in range(6, 9)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    assert [len(c) for c in search.calls] == [4, 4, 1]
+    assert [int(I[0]) for _, _, I in results] == [n * 100 for n in range(9)]
+    stats = batcher.stats()
+    assert stats["requests"] == 9 and stats["batch_sizes"] == {1: 1, 4: 2}
+
+
+def test_a_failed_search_fails_its_batch_only():
+    calls = []
+
+    def search(questions, k):
+        calls.append(questions)
+        if len(calls) == 1:
+            raise RuntimeError("index busy")
+        return FakeSearch()(questions, k)
+
+    batcher = RetrievalBatcher(search, window_ms=20)
+
+    async def run():
+        first = await asyncio.gather(batcher.submit("a 1", 1), batcher.submit("b 2", 1),
+                                     return_exceptions=True)
+        return first, await batcher.submit("c 3", 1)
+
+    first, (_, _, I) = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in first)
+    assert I.tolist() == [300]
+
+
+def test_cancelled_caller_is_left_out_of_the_batch():
+    gate = threading.Event()
+    search = FakeSearch(gate)
+    batcher = RetrievalBatcher(search, window_ms=20)
+
+    async def run():
+        busy = asyncio.create_task(batcher.submit("q 0", 1))
+        await asyncio.sleep(0.05)
+        # queued behind the running batch, then abandoned
+        gone = asyncio.create_task(batcher.submit("q 1", 1))
+        kept = asyncio.create_task(batcher.submit("q 2", 1))
+        await asyncio.sleep(0.01)
+        gone.cancel()
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        return await busy, await kept
+
+    asyncio.run(run())
+    assert search.calls == [["q 0"], ["q 2"]]
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from app.core.retrieval import Chunker, chunk_text, iter_chunks
+from app.utils import file_utils
+
+
+def _reference(text: str, size: int = 500) -> list[str]:
+    # chunk_text() as it was before the streaming chunker
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            split = text.rfind(".", start, end)
+            end = split + 1 if split > start else end
+        chunks.append(text[start:end].strip())
+        start = end
+    return chunks
+
+
+def _text(rng: random.Random, n: int) -> str:
+    # sentences of random length, some far longer than a chunk (no period to cut at)
+    out = []
+    while sum(map(len, out)) < n:
+        words = rng.choice([rng.randint(1, 12), rng.randint(40, 200)])
+        out.append(" ".join(f"w{rng.randint(0, 999)}" for _ in range(words)) + rng.choice([". ", ".", " "]))
+    return "".join(out)
+
+
+def _pieces(text: str, rng: random.Random) -> list[tuple[int, str]]:
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, 30)))
+    bounds = [0, *cuts, len(text)]
+    return [(i + 1, text[a:b]) for i, (a, b) in enumerate(zip(bounds, bounds[1:]))]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_chunks_as_chunking_the_whole_text(seed):
+    rng = random.Random(seed)
+    text = _text(rng, rng.randint(1, 6000))
+    size = rng.choice([50, 200, 500])
+    chunks = [c for c, _ in iter_chunks(_pieces(text, rng), size)]
+    assert chunks == _reference(text, size) == chunk_text(text, size)
+
+
+def test_buffer_stays_within_one_chunk():
+    rng = random.Random(0)
+    chunker = Chunker(200)
+    for page, piece in _pieces(_text(rng, 20000), rng):
+        chunker.feed(page, piece)
+        assert len(chunker.buf) <= 200
+
+
+def test_chunks_are_tagged_with_the_page_they_start_on():
+    pages = [(1, "First page. It ends mid"), (2, "way through a sentence. Second page."), (3, ""),
+             (4, " Fourth page.")]
+    out = list(iter_chunks(pages, size=30))
+    assert [c for c, _ in out] == _reference("".join(t for _, t in pages), 30)
+    assert out == [
+        ("First page.", 1),
+        ("It ends midway through a sent", 1),
+        ("ence. Second page.", 2),
+        ("Fourth page.", 4),
+    ]
+
+
+def test_plain_text_pages_follow_form_feeds(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_utils, "TEXT_BLOCK", 7)   # pieces cut mid-page too
+    path = tmp_path / "doc.txt"
+    path.write_text("page one\nline two\fpage two\f\fpage four")
+    by_page: dict[int, str] = {}
+    for page, text in file_utils.iter_pages(str(path)):
+        by_page[page] = by_page.get(page, "") + text
+    assert by_page == {1: "page one line two", 2: "page two", 4: "page four"}
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from app.core import embedding, retrieval
+
+
+def test_backend_without_encode_fails_when_built():
+    class Incomplete(embedding.Embedder):
+        backend = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_parity_of_a_backend_with_its_own_vectors():
+    texts = ["remote work needs approval", "the VPN is required"]
+    reference = retrieval.embedder.encode(texts)
+    assert embedding.parity(retrieval.embedder, texts, reference) == {"n": 2, "min": 1.0, "mean": 1.0}
+    assert embedding.parity(retrieval.embedder, [], np.zeros((0, 384)))["n"] == 0
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        embedding.make_embedder("tensorflow")
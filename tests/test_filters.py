@@ -0,0 +1,93 @@
+import time
+import asyncio
+import datetime
+
+import httpx
+import pytest
+
+from app.core import ingest, retrieval
+from app.core.retrieval import store
+from app.main import app
+from app.routers.query import QueryFilters
+
+DOCS = {"alpha.txt": ["hr"], "beta.txt": ["it"], "gamma.txt": []}
+
+
+@pytest.fixture(scope="module")
+def docs(tmp_path_factory) -> dict[str, int]:
+    """
+    Three two-page documents on the same topic, so an unfiltered search
+    mixes them; name -> doc id.
+    """
+    folder = tmp_path_factory.mktemp("filters")
+
+    async def run():
+        ids = {}
+        for name, tags in DOCS.items():
+            stem = name.split(".")[0]
+            path = folder / name
+            path.write_text("\f".join(
+                f"Parental leave requests go to the {stem} office, page {p}. "
+                + " ".join(f"{stem}{p}w{w}" for w in range(30)) + "."
+                for p in (1, 2)
+            ))
+            job_id = await ingest.enqueue([str(path)], [name], tags)
+            while ingest.get_job(job_id)["status"] in ("queued", "running"):
+                await asyncio.sleep(0.01)
+            ids[name] = ingest.get_job(job_id)["doc_ids"][0]
+        return ids
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(ingest, "_queue", None)
+        mp.setattr(ingest, "_worker", None)
+        return asyncio.run(run())
+
+
+def _hit_docs(filters: dict | None, k: int = 4) -> list[int]:
+    _, _, I = retrieval.search(["parental leave requests office"], k, filters)
+    return [store.meta_at(int(i))["doc_id"] for i in I[0] if i >= 0]
+
+
+def test_doc_filter_takes_top_k_among_the_selected_chunks(docs):
+    hits = _hit_docs({"doc_ids": [docs["beta.txt"]]}, k=4)
+    # beta has fewer chunks than k: all of them, and nothing else
+    assert hits == [docs["beta.txt"]] * len(store.doc_chunks(docs["beta.txt"]))
+
+
+def test_tag_filter(docs):
+    assert set(_hit_docs({"tags": ["hr"]})) == {docs["alpha.txt"]}
+    assert set(_hit_docs({"tags": ["hr", "it"]}, k=50)) == {docs["alpha.txt"], docs["beta.txt"]}
+    # filters combine: a document must match every one
+    assert _hit_docs({"tags": ["hr"], "doc_ids": [docs["gamma.txt"]]}) == []
+
+
+def test_upload_date_filter(docs):
+    later = time.time() + 3600
+    assert _hit_docs({"added_after": later}) == []
+    assert _hit_docs({"added_before": later, "doc_ids": [docs["gamma.txt"]]})
+
+
+def test_date_to_includes_the_whole_day():
+    today = datetime.date.today()
+    f = QueryFilters(date_from=today, date_to=today).to_dict()
+    assert f["added_after"] <= time.time() < f["added_before"]
+    assert f["added_before"] - f["added_after"] == pytest.approx(86400, abs=3600)   # DST days
+
+
+def test_query_cites_the_filtered_document_and_page(docs, fake_ollama):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/query/", json={
+                "question": "Where do parental leave requests go?",
+                "filters": {"doc_ids": [docs["gamma.txt"]]},
+            })
+
+    r = asyncio.run(run())
+    assert r.status_code == 200
+    cites = r.json()["citations"]
+    assert cites and all(c["doc_id"] == docs["gamma.txt"] and c["filename"] == "gamma.txt" for c in cites)
+    for c in cites:
+        # a chunk starts with its page's heading sentence or its page's words
+        text = store.chunk(c["chunk_id"])
+        assert text.startswith("Parental") and f"page {c['page']}." in text \
+            or text.startswith(f"gamma{c['page']}w")
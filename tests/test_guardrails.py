@@ -0,0 +1,91 @@
+import os
+import random
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.guardrails import Guardrail, TermMatcher, check_query
+
+TERMS = ["hell", "insider", "insider trading", "weed"]
+
+
+def _stream(matcher: TermMatcher, tokens: list[str]) -> tuple[str, str | None]:
+    scanner = matcher.stream()
+    out = []
+    for tok in tokens:
+        safe, term = scanner.feed(tok)
+        out.append(safe)
+        if term:
+            return "".join(out), term
+    safe, term = scanner.close()
+    return "".join(out) + safe, term
+
+
+def _split(text: str, rng: random.Random) -> list[str]:
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, min(20, len(text) - 1))))
+    return [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+
+
+def test_whole_words_any_case():
+    m = TermMatcher(TERMS)
+    assert m.find("What the HELL is this") == "hell"
+    assert m.find("Hello, shellfish and tumbleweeds") is None
+    assert m.find("no Insider   Trading here") == "insider   trading"
+    assert m.find("an insider's view") == "insider"
+    assert TermMatcher([]).find("anything") is None
+
+
+def test_stream_never_emits_part_of_a_term():
+    m = TermMatcher(TERMS)
+    text = "The policy on remote work is clear. Insider trading is forbidden. More text follows."
+    start = text.index("Insider")
+    rng = random.Random(0)
+    for _ in range(200):
+        out, term = _stream(m, _split(text, rng))
+        assert term == "insider trading" or term == "insider"
+        assert text.startswith(out) and len(out) <= start
+
+
+def test_stream_releases_clean_text_unchanged():
+    m = TermMatcher(TERMS)
+    # near misses across token boundaries: "hell" + "o", "inside" + "r..."
+    text = "Say hello to the insiders club; the seaweed-free shell is fine."
+    rng = random.Random(1)
+    for _ in range(200):
+        assert _stream(m, _split(text, rng)) == (text, None)
+
+
+def test_term_at_the_very_end_is_caught_on_close():
+    m = TermMatcher(TERMS)
+    tokens = ["The answer, after a long and careful look, is: what the ", "he", "ll"]
+    out, term = _stream(m, tokens)
+    assert term == "hell"
+    assert out and tokens[0].startswith(out)
+
+
+def test_terms_file_is_reloaded_when_it_changes(tmp_path):
+    path = tmp_path / "terms.txt"
+    path.write_text("# banned\nalpha\nbeta gamma  # two words\n")
+    guard = Guardrail(["default"], str(path), reload_s=0)
+    assert guard.find("Alpha release") == "alpha"
+    assert guard.find("beta  gamma") == "beta  gamma"
+    assert guard.find("the default") is None   # the file replaces the defaults
+
+    path.write_text("delta\n")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert guard.find("alpha") is None
+    assert guard.find("Delta") == "delta"
+
+
+def test_missing_terms_file_keeps_the_defaults(tmp_path):
+    guard = Guardrail(["default"], str(tmp_path / "absent.txt"), reload_s=0)
+    assert guard.find("by default") == "default"
+
+
+def test_check_query_rejects_a_banned_question():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(check_query("Is this CLASSIFIED?"))
+    assert e.value.status_code == 400
+    asyncio.run(check_query("Is this classy?"))
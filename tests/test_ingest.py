@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from app.core import ingest, retrieval
+from app.core.retrieval import store
+from app.utils.file_utils import file_sha256
+
+
+@pytest.fixture(autouse=True)
+def fresh_worker(monkeypatch):
+    # each test runs its own event loop: the queue and worker belong to it
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+
+
+def _write(tmp_path, name: str, pages: int) -> str:
+    # one sentence of words unique to the file and page per form-feed page
+    path = tmp_path / name
+    stem = name.split(".")[0]
+    path.write_text("\f".join(
+        " ".join(f"{stem}p{p}w{w}" for w in range(60)) + "." for p in range(pages)
+    ))
+    return str(path)
+
+
+async def _run(paths: list[str]) -> dict:
+    job_id = await ingest.enqueue(paths, [p.rsplit("/", 1)[1] for p in paths])
+    while ingest.get_job(job_id)["status"] in ("queued", "running"):
+        await asyncio.sleep(0.01)
+    return ingest.get_job(job_id)
+
+
+def _live_docs() -> set[int]:
+    docs, alive = store.columns("docs", "alive")
+    return set(docs[alive].tolist())
+
+
+def test_failed_file_is_dropped_and_the_job_goes_on(tmp_path, monkeypatch):
+    # small batches, so the failing file commits some rows before it fails
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 4)
+    read_pages = ingest._read_pages
+
+    async def failing(loop, path):
+        async for window in read_pages(loop, path):
+            yield window
+            if path.endswith("bad.txt"):
+                raise ValueError("corrupt page")
+
+    monkeypatch.setattr(ingest, "_read_pages", failing)
+    good1 = _write(tmp_path, "good1.txt", 3)
+    bad   = _write(tmp_path, "bad.txt", 40)
+    good2 = _write(tmp_path, "good2.txt", 3)
+
+    job = asyncio.run(_run([good1, bad, good2]))
+
+    assert job["status"] == "done"
+    assert [f["file"] for f in job["files_failed"]] == ["bad.txt"]
+    assert "corrupt page" in job["error"]
+    assert len(job["doc_ids"]) == 2
+    assert store.find_file(file_sha256(good2)) is not None
+    assert store.find_file(file_sha256(bad)) is None
+    # every live chunk belongs to a recorded document
+    assert all(store.doc(d) is not None for d in _live_docs())
+    assert job["chunks"] == sum(store.doc(d)["chunks"] for d in job["doc_ids"])
+
+    # a later, successful upload of the same file starts from nothing
+    monkeypatch.setattr(ingest, "_read_pages", read_pages)
+    retry = asyncio.run(_run([bad]))
+    assert retry["status"] == "done"
+    assert retry["chunks_reused"] == 0 and retry["chunks_new"] > 0
+
+
+def test_job_fails_when_no_file_makes_it(tmp_path, monkeypatch):
+    async def failing(loop, path):
+        raise ValueError("unreadable")
+        yield
+
+    monkeypatch.setattr(ingest, "_read_pages", failing)
+    before = _live_docs()
+    job = asyncio.run(_run([_write(tmp_path, "lost.txt", 2)]))
+
+    assert job["status"] == "failed"
+    assert job["doc_ids"] == []
+    assert "unreadable" in job["error"]
+    assert _live_docs() == before
+
+
+def test_failed_replacement_keeps_only_the_old_version(tmp_path, monkeypatch):
+    old = _write(tmp_path, "manual.txt", 3)
+    doc = asyncio.run(_run([old]))["doc_ids"][0]
+    old_chunks = set(store.doc_chunks(doc).tolist())
+
+    # the new version commits some batches, then fails
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 4)
+    read_pages = ingest._read_pages
+
+    async def failing(loop, path):
+        async for window in read_pages(loop, path):
+            yield window
+            raise ValueError("corrupt page")
+
+    monkeypatch.setattr(ingest, "_read_pages", failing)
+    new = _write(tmp_path, "manualv2.txt", 40)
+    first_new = store.next_id
+
+    async def replace():
+        job_id = await ingest.enqueue([new], ["manual-v2.txt"], replace=doc)
+        while ingest.get_job(job_id)["status"] in ("queued", "running"):
+            await asyncio.sleep(0.01)
+        return ingest.get_job(job_id)
+
+    job = asyncio.run(replace())
+    assert job["status"] == "failed"
+    assert store.doc(doc)["name"] == "manual.txt"
+    assert set(store.doc_chunks(doc).tolist()) == old_chunks
+    # the new version did commit rows, and none of them is left to find
+    assert store.next_id > first_new
+    assert not any(store.contains(i) for i in range(first_new, store.next_id))
+    _, _, hits = retrieval.search(["manualv2p0w1 manualv2p0w2 manualv2p0w3"], 10)
+    assert all(i < first_new for i in hits[0].tolist())
+
+
+def test_revision_reuses_unchanged_chunks_and_skips_repeats(tmp_path, monkeypatch):
+    first = _write(tmp_path, "guide.txt", 4)
+    # same pages plus one more, and an exact copy of it in the same job
+    revision = tmp_path / "guide-v2.txt"
+    revision.write_text(open(first).read() + "\f" + " ".join(f"guidep9w{w}" for w in range(60)) + ".")
+    copy = tmp_path / "guide-v2-copy.txt"
+    copy.write_bytes(revision.read_bytes())
+
+    encoded = []
+    encode = retrieval.embedder.encode
+
+    def counting(texts, *args, **kwargs):
+        encoded.extend(texts)
+        return encode(texts, *args, **kwargs)
+
+    async def run():
+        v1 = await _run([first])
+        monkeypatch.setattr(retrieval.embedder, "encode", counting)
+        return v1, await _run([str(revision), str(copy)])
+
+    v1, v2 = asyncio.run(run())
+
+    assert v2["status"] == "done" and len(v2["doc_ids"]) == 1
+    assert v2["files_skipped"] == [{"file": "guide-v2-copy.txt", "duplicate_of": "guide-v2.txt"}]
+    assert v2["chunks_reused"] == v1["chunks"]
+    # only the new page was encoded and stored
+    assert v2["chunks_new"] == len(encoded) > 0
+    assert all("guidep9" in t and "guidep0" not in t for t in encoded)
+    assert encoded == [store.chunk(i) for i in store.doc_chunks(v2["doc_ids"][0])]
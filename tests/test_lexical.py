@@ -0,0 +1,105 @@
+import os
+import math
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core import retrieval
+from app.core.lexical import LexicalIndex, tokenize
+
+CHUNKS = [
+    "Form HR-104 covers parental leave requests.",
+    "Parental leave is sixteen weeks; see the leave policy.",
+    "Laptops are returned to IT within two weeks, as in 2019.",
+    "The travel policy v2.1 replaced the 2015 rules.",
+]
+
+
+def _index(ids=range(len(CHUNKS)), texts=CHUNKS) -> LexicalIndex:
+    idx = LexicalIndex()
+    idx.add(list(ids), list(texts))
+    return idx
+
+
+def _bm25(query: str, texts: list[str], k1: float = 1.2, b: float = 0.75) -> list[float]:
+    docs = [tokenize(t) for t in texts]
+    avgdl = sum(map(len, docs)) / len(docs)
+    scores = []
+    for doc in docs:
+        s = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in d for d in docs)
+            tf = doc.count(term)
+            if tf:
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                s += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(s)
+    return scores
+
+
+def test_compounds_are_indexed_whole_and_by_their_parts():
+    assert tokenize("Form HR-104, v2.1") == ["form", "hr-104", "hr", "104", "v2.1", "v2", "1"]
+
+
+def test_scores_are_bm25():
+    idx = _index()
+    for query in ("parental leave", "HR-104", "policy weeks"):
+        scores, ids = idx.search(query, 10)
+        expected = _bm25(query, CHUNKS)
+        assert ids.tolist() == sorted((i for i, s in enumerate(expected) if s),
+                                      key=lambda i: -expected[i])
+        assert scores.tolist() == pytest.approx([expected[i] for i in ids])
+
+
+def test_allowed_and_removed_chunks():
+    idx = _index()
+    assert idx.search("leave", 10, allowed=np.array([1, 2]))[1].tolist() == [1]
+    idx.remove([0])
+    assert idx.search("parental", 10)[1].tolist() == [1]
+    assert idx.lookup("hr-104").tolist() == []
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "lexical")
+    idx = _index()
+    idx.remove([3])
+    idx.save(path)
+
+    loaded = LexicalIndex.load(path)
+    assert loaded.covered == 4 and len(loaded) == 3
+    for query in ("parental leave", "weeks", "travel"):
+        assert [a.tolist() for a in loaded.search(query, 10)] == [a.tolist() for a in idx.search(query, 10)]
+    assert loaded.years(2020) == {2: 2019}
+
+    # chunks added after the snapshot are searched together with it
+    loaded.add([4, 5], ["Parental leave for adoptive parents.", "Form HR-200 is for overtime."])
+    loaded.remove([1])
+    assert loaded.search("parental", 10)[1].tolist() == [4, 0]
+    loaded.save(path)
+    again = LexicalIndex.load(path)
+    assert again.search("parental", 10)[1].tolist() == [4, 0]
+    assert again.lookup("hr").tolist() == [0, 5]
+    # the earlier snapshot directory is gone
+    assert len([n for n in os.listdir(tmp_path) if n.startswith("lexical-")]) == 1
+
+
+def test_reciprocal_rank_fusion():
+    # 1: 1/61 + 1/62, 3: 1/63 + 1/61, 2: 1/62, 4: 1/63
+    assert retrieval.fuse([[1, 2, 3], [3, 1, 4]], 3) == [1, 3, 2]
+    assert retrieval.fuse([[], [7]], 5) == [7]
+
+
+def test_exact_term_is_found_lexically_and_in_hybrid_mode():
+    target = "Expense claims use form FIN-9921 and are due within thirty days."
+    asyncio.run(retrieval.embed_and_store([target, "Claims about the cafeteria go to facilities."]))
+
+    async def run():
+        return [await retrieval.retrieve_hits("FIN-9921", 3, mode=mode) for mode in ("lexical", "hybrid")]
+
+    (q_lex, _, lexical), (q_hyb, _, hybrid) = asyncio.run(run())
+    assert q_lex is None and q_hyb is not None   # lexical mode never runs the embedder
+    assert lexical == [target]
+    assert target in hybrid
+    with pytest.raises(ValueError):
+        asyncio.run(retrieval.retrieve_hits("x", 3, mode="fuzzy"))
@@ -0,0 +1,196 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+
+from app.core import llm, retrieval
+from app.core.answer_cache import answer_cache
+from app.core.context import build_context, retrieve_context
+from app.main import app
+from app.routers import query
+from app.routers.query import NO_CONTEXT_ANSWER, QueryReq, WITHHELD
+
+POLICY = (
+    "Remote work requires manager approval. Employees working remotely must use the VPN "
+    "and keep work documents off personal devices."
+)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def indexed():
+    asyncio.run(retrieval.embed_and_store([POLICY]))
+
+
+async def _post(path: str, body: dict) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post(path, json=body)
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _idle() -> bool:
+    return llm.llm_load() == {"in_flight": 0, "waiting": 0}
+
+
+def test_query_answers_from_the_llm(fake_ollama):
+    r = asyncio.run(_post("/query/", {"question": "Do I need approval for remote work?"}))
+
+    assert r.status_code == 200
+    body = r.json()
+    assert body["answer"] == fake_ollama.REPLY
+    assert body["citations"] and body["context"]["chunks"] >= 1
+    assert _idle()
+
+
+def test_stream_sends_tokens_then_done(fake_ollama):
+    r = asyncio.run(_post("/query/stream", {"question": "Which VPN rules apply to remote employees?"}))
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _events(r.text)
+    assert [e for e, _ in events[:-1]] == ["token"] * (len(events) - 1)
+    assert "".join(d["token"] for _, d in events[:-1]) == fake_ollama.REPLY
+    assert events[-1][0] == "done" and events[-1][1]["citations"]
+    assert _idle()
+
+
+def test_stream_releases_the_slot_when_the_client_is_gone(fake_ollama):
+    async def run():
+        resp = await query.query_stream(QueryReq(question="Which devices may hold work documents?"))
+        assert llm.llm_load()["in_flight"] == 1
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise OSError("client went away")
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with pytest.raises(Exception):
+            await resp(scope, receive, send)
+        # released right away, not when the response is garbage-collected
+        assert _idle()
+
+    asyncio.run(run())
+
+
+def test_no_excerpts_no_generation(fake_ollama, monkeypatch):
+    async def refuse(prompt: str, max_tokens: int = 256):
+        raise AssertionError("the LLM was called")
+
+    monkeypatch.setattr(query, "generate_response", refuse)
+    r = asyncio.run(_post("/query/", {"question": "remote work", "filters": {"doc_ids": [10**6]}}))
+
+    assert r.status_code == 200
+    assert r.json()["answer"] == NO_CONTEXT_ANSWER and r.json()["citations"] == []
+
+
+def test_cached_answer_is_rescanned_before_replay(fake_ollama):
+    question = "Is a manager's approval needed to work remotely?"
+
+    async def run():
+        q_emb, ids, _, _ = await retrieve_context(question)
+        answer_cache.put(q_emb, ids, "Yes; otherwise they will kill the request.", retrieval.store.generation)
+        return await _post("/query/stream", {"question": question})
+
+    assert _events(asyncio.run(run()).text) == [("error", {"detail": WITHHELD})]
+
+
+def test_context_skips_chunks_removed_after_retrieval():
+    q_emb, ids, texts = asyncio.run(retrieval.retrieve_hits("remote work approval", 3))
+    # as if a delete + compaction dropped the best hit in between
+    gone = retrieval.store.next_id + 1000
+    out_ids, _, stats = build_context(q_emb, [gone, *ids], ["removed", *texts])
+
+    assert gone not in out_ids and out_ids
+    assert stats["gone"] == 1
+
+
+def test_unscanned_answers_are_not_cached(fake_ollama, monkeypatch):
+    question = "May remote employees keep documents on a personal laptop?"
+
+    async def generate(prompt: str, max_tokens: int = 256):
+        return "No, that would kill the audit."
+
+    monkeypatch.setattr(query, "generate_response", generate)
+
+    async def run():
+        r = await _post("/query/", {"question": question})
+        q_emb, ids, _, _ = await retrieve_context(question)
+        return r, answer_cache.lookup(q_emb, ids, retrieval.store.generation)
+
+    r, cached = asyncio.run(run())
+    assert r.status_code == 200
+    assert cached is None
+
+
+def test_batch_answers_repeated_questions_once(fake_ollama, monkeypatch):
+    calls = []
+    generate = query.generate_response
+
+    async def counted(prompt: str, max_tokens: int = 256):
+        calls.append(prompt)
+        return await generate(prompt, max_tokens)
+
+    monkeypatch.setattr(query, "generate_response", counted)
+    questions = [
+        "Who signs off on remote work for a team?",
+        "Is the VPN required when working from home?",
+        "Is this classified?",
+        "  who signs off on REMOTE work   for a team? ",
+    ]
+    r = asyncio.run(_post("/query/batch", {"questions": questions}))
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    summary = rows.pop()["summary"]
+    assert summary["questions"] == 4 and summary["distinct"] == 2 and summary["errors"] == 1
+    assert len(calls) == 2
+
+    by_index = {row["index"]: row for row in rows}
+    assert sorted(by_index) == [0, 1, 2, 3]
+    assert by_index[2]["error"]["status"] == 400
+    for i in (0, 1, 3):
+        assert by_index[i]["question"] == questions[i]
+        assert by_index[i]["answer"] == fake_ollama.REPLY and by_index[i]["citations"]
+    assert _idle()
+
+
+def test_batch_without_streaming_keeps_question_order(fake_ollama):
+    questions = ["Which network must remote staff use?", "Can work documents live on personal devices?"]
+    r = asyncio.run(_post("/query/batch", {"questions": questions, "stream": False}))
+
+    assert r.status_code == 200
+    body = r.json()
+    assert [row["index"] for row in body["results"]] == [0, 1]
+    assert [row["question"] for row in body["results"]] == questions
+    assert body["summary"]["distinct"] == 2 and body["summary"]["errors"] == 0
+
+
+def test_stream_generate_time_leaves_out_the_reader(fake_ollama, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(llm.metrics, "record", lambda pipeline, name, s: recorded.append((name, s)))
+
+    async def run():
+        release = await llm.acquire_slot()
+        try:
+            tokens = 0
+            async for _ in llm.stream_response("Summarize the remote work policy."):
+                tokens += 1
+                await asyncio.sleep(0.02)   # a slow client
+            return tokens
+        finally:
+            release()
+
+    tokens = asyncio.run(run())
+    generate = [s for name, s in recorded if name == "generate"]
+    assert tokens > 2 and len(generate) == 1
+    assert generate[0] < 0.02 * tokens / 2
@@ -0,0 +1,131 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from app.core import store as store_module
+from app.core.store import MANIFEST, WAL, SegmentStore
+
+
+class Crash(Exception):
+    pass
+
+
+def _append(store: SegmentStore, texts: list[str], files: dict | None = None, doc: int = -1) -> int:
+    embs = np.random.default_rng(len(store)).random((len(texts), 4), dtype=np.float32)
+    return store.append(embs, texts, files, meta={"docs": np.full(len(texts), doc)})
+
+
+def _crash_on_log(monkeypatch, store: SegmentStore, write: str | None = None):
+    """
+    The next WAL record is written (or only `write` of it, a torn line) and
+    the process dies right after.
+    """
+    log = store._log
+
+    def crashing(record):
+        if write is None:
+            log(record)
+        else:
+            with open(os.path.join(store.root, WAL), "a", encoding="utf-8") as f:
+                f.write(write)
+        raise Crash()
+
+    monkeypatch.setattr(store, "_log", crashing)
+
+
+def _segment_dirs(root) -> set[str]:
+    return {n for n in os.listdir(root) if n.startswith("seg-")}
+
+
+def _manifest(root) -> dict:
+    with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_wal_replays_an_append_the_manifest_missed(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path))
+    _append(store, ["alpha", "beta"])
+    # the segment and its WAL record are on disk, the manifest is not updated
+    _crash_on_log(monkeypatch, store)
+    with pytest.raises(Crash):
+        _append(store, ["gamma", "delta"], files={"f00d": {"name": "g.txt", "doc": 0}})
+    assert len(_manifest(tmp_path)["segments"]) == 1
+
+    reopened = SegmentStore(str(tmp_path))
+    assert len(reopened) == 4
+    assert [reopened.chunk(i) for i in range(4)] == ["alpha", "beta", "gamma", "delta"]
+    assert reopened.find_file("f00d")["name"] == "g.txt"
+    assert os.path.getsize(tmp_path / WAL) == 0
+    # the next append does not reuse a replayed segment name or id
+    assert _append(reopened, ["epsilon"]) == 4
+    assert len(_segment_dirs(tmp_path)) == 3
+
+
+def test_torn_wal_record_drops_the_uncommitted_segment(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path))
+    _append(store, ["alpha", "beta"])
+    _crash_on_log(monkeypatch, store, write='{"op": "add", "segm')
+    with pytest.raises(Crash):
+        _append(store, ["gamma"])
+    assert len(_segment_dirs(tmp_path)) == 2
+
+    reopened = SegmentStore(str(tmp_path))
+    assert len(reopened) == 2
+    assert _segment_dirs(tmp_path) == set(_manifest(tmp_path)["segments"])
+    assert _append(reopened, ["gamma"]) == 2
+
+
+def _store_with_deletions(root, monkeypatch) -> SegmentStore:
+    # compactions run only when the test starts one
+    monkeypatch.setattr(store_module, "TOMBSTONE_RATIO", 2.0)
+    store = SegmentStore(str(root))
+    for n in range(3):
+        _append(store, [f"doc {n} chunk {i}" for i in range(3)],
+                files={f"{n:04x}": {"name": f"{n}.txt", "doc": n}}, doc=n)
+    # chunk ids 0..8, doc n owns 3n..3n+2
+    assert store.delete_doc(1).tolist() == [3, 4, 5]
+    return store
+
+
+def test_compaction_interrupted_before_its_wal_record(tmp_path, monkeypatch):
+    store = _store_with_deletions(tmp_path, monkeypatch)
+    before = _manifest(tmp_path)
+    # the merged segment is written, the crash comes before it is logged
+    _crash_on_log(monkeypatch, store, write="")
+    with pytest.raises(Crash):
+        store.compact()
+    assert len(_segment_dirs(tmp_path)) == 4
+
+    reopened = SegmentStore(str(tmp_path))
+    assert reopened._manifest["segments"] == before["segments"]
+    assert _segment_dirs(tmp_path) == set(before["segments"])
+    assert reopened.deleted_ids().tolist() == [3, 4, 5]
+    assert reopened.live_count() == 6
+    assert [reopened.chunk(i) for i in (0, 8)] == ["doc 0 chunk 0", "doc 2 chunk 2"]
+    # the next compaction runs from scratch
+    reopened.compact()
+    assert len(reopened._manifest["segments"]) == 1
+    assert len(reopened) == 6
+
+
+def test_compaction_logged_but_not_committed_is_finished_on_open(tmp_path, monkeypatch):
+    store = _store_with_deletions(tmp_path, monkeypatch)
+    inputs = _manifest(tmp_path)["segments"]
+    _crash_on_log(monkeypatch, store)
+    with pytest.raises(Crash):
+        store.compact()
+    assert _manifest(tmp_path)["segments"] == inputs
+
+    reopened = SegmentStore(str(tmp_path))
+    segments = reopened._manifest["segments"]
+    assert len(segments) == 1 and segments[0] not in inputs
+    assert _segment_dirs(tmp_path) == set(segments)
+    # rows moved, ids did not; the compacted-away tombstones are gone
+    assert len(reopened) == 6
+    assert reopened.deleted_ids().tolist() == []
+    assert not any(reopened.contains(i) for i in (3, 4, 5))
+    assert [reopened.chunk(i) for i in (0, 6, 8)] == ["doc 0 chunk 0", "doc 2 chunk 0", "doc 2 chunk 2"]
+    assert reopened.find_file("0002")["doc"] == 2
+    assert _append(reopened, ["after"]) == 9
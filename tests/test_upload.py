@@ -0,0 +1,165 @@
+import asyncio
+
+import httpx
+
+from app.core import ingest, retrieval
+from app.core.retrieval import store
+from app.main import app
+from app.routers import upload
+from app.utils import file_utils
+
+
+async def _upload(files: list[tuple[str, bytes]], **kwargs) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/upload/", files=[("files", f) for f in files], **kwargs)
+
+
+async def _wait(job_id: str) -> dict:
+    while ingest.get_job(job_id)["status"] in ("queued", "running"):
+        await asyncio.sleep(0.01)
+    return ingest.get_job(job_id)
+
+
+def _saved() -> set:
+    return {p.name for p in file_utils.UPLOAD_DIR.iterdir()}
+
+
+def test_duplicate_upload_is_not_kept(monkeypatch):
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+    text = b"The library lends laptops to registered students for up to two weeks."
+
+    async def run():
+        first = await _wait((await _upload([("loans.txt", text)])).json()["job_id"])
+        kept = _saved()
+        second = await _wait((await _upload([("loans-copy.txt", text)])).json()["job_id"])
+        return first, kept, second
+
+    first, kept, second = asyncio.run(run())
+    assert len(first["doc_ids"]) == 1
+    assert second["files_skipped"] == [{"file": "loans-copy.txt", "duplicate_of": "loans.txt"}]
+    assert _saved() == kept
+
+
+def test_request_limit_applies_without_content_length(monkeypatch):
+    monkeypatch.setattr(file_utils, "UPLOAD_MAX_REQUEST_MB", 1 / 1024)   # 1 KiB
+    before = _saved()
+
+    async def chunked():
+        # a streamed body: sent chunked, with no Content-Length
+        yield b"--b\r\nContent-Disposition: form-data; name=\"files\"; filename=\"big.txt\"\r\n\r\n"
+        for _ in range(8):
+            yield b"x" * 512
+        yield b"\r\n--b--\r\n"
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/upload/", content=chunked(),
+                                     headers={"Content-Type": "multipart/form-data; boundary=b"})
+
+    r = asyncio.run(run())
+    assert r.status_code == 413
+    assert _saved() == before
+
+
+async def _call(method: str, url: str, **kwargs) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.request(method, url, **kwargs)
+
+
+def _sentences(*stems: str) -> bytes:
+    # one ~500-character sentence, so one chunk, per stem
+    return " ".join(" ".join(f"{s}w{w}" for w in range(60)) + "." for s in stems).encode()
+
+
+def _texts(doc_id: int) -> dict[int, str]:
+    return {int(i): store.chunk(int(i)) for i in store.doc_chunks(doc_id)}
+
+
+def test_deleted_document_stops_matching(monkeypatch):
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+
+    async def run():
+        job = await _wait((await _upload([("gone.txt", _sentences("gonea", "goneb"))])).json()["job_id"])
+        doc_id = job["doc_ids"][0]
+        chunk_ids = set(_texts(doc_id))
+        deleted = await _call("DELETE", f"/upload/{doc_id}")
+        _, _, hits = retrieval.search(["gonebw1 gonebw2 gonebw3"], 5)
+        again = await _call("DELETE", f"/upload/{doc_id}")
+        return doc_id, chunk_ids, deleted, hits, again
+
+    doc_id, chunk_ids, deleted, hits, again = asyncio.run(run())
+    assert deleted.status_code == 200
+    assert deleted.json() == {"doc_id": doc_id, "chunks_deleted": len(chunk_ids)}
+    assert store.doc(doc_id) is None
+    assert not any(store.contains(i) for i in chunk_ids)
+    assert not chunk_ids & set(hits[0].tolist())
+    assert again.status_code == 404
+
+
+def test_replaced_document_keeps_its_id_and_shared_chunks(monkeypatch):
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+
+    async def run():
+        job = await _wait((await _upload([("policy.txt", _sentences("keep", "old"))],
+                                         data={"tags": "hr"})).json()["job_id"])
+        doc_id = job["doc_ids"][0]
+        before = _texts(doc_id)
+        r = await _call("PUT", f"/upload/{doc_id}",
+                        files={"file": ("policy-v2.txt", _sentences("keep", "new"))})
+        return doc_id, before, await _wait(r.json()["job_id"])
+
+    doc_id, before, job = asyncio.run(run())
+    after = _texts(doc_id)
+    assert job["status"] == "done" and job["doc_ids"] == [doc_id]
+    assert job["chunks_deleted"] == 1
+    assert store.doc(doc_id)["name"] == "policy-v2.txt"
+    assert store.doc(doc_id)["tags"] == ["hr"]
+    # the unchanged chunk keeps its id, the dropped one is gone
+    kept = [i for i, t in before.items() if t.startswith("keepw0 ")]
+    old  = [i for i, t in before.items() if t.startswith("oldw0 ")]
+    assert kept and kept[0] in after
+    assert not store.contains(old[0])
+    assert sorted(t.split()[0] for t in after.values()) == ["keepw0", "neww0"]
+
+
+def test_replace_with_empty_tags_clears_them(monkeypatch):
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+
+    async def run():
+        job = await _wait((await _upload([("rota.txt", _sentences("rota"))],
+                                         data={"tags": "it,ops"})).json()["job_id"])
+        doc_id = job["doc_ids"][0]
+        kept = await _call("PUT", f"/upload/{doc_id}", files={"file": ("rota.txt", _sentences("rota", "v2"))})
+        await _wait(kept.json()["job_id"])
+        tags_kept = store.doc(doc_id)["tags"]
+        cleared = await _call("PUT", f"/upload/{doc_id}", files={"file": ("rota.txt", _sentences("rota", "v3"))},
+                              data={"tags": ""})
+        await _wait(cleared.json()["job_id"])
+        return tags_kept, store.doc(doc_id)["tags"]
+
+    tags_kept, tags_cleared = asyncio.run(run())
+    assert tags_kept == ["it", "ops"]
+    assert tags_cleared == []
+
+
+def test_failed_replace_upload_is_not_kept(monkeypatch):
+    monkeypatch.setattr(ingest, "_queue", None)
+    monkeypatch.setattr(ingest, "_worker", None)
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("queue unavailable")
+
+    async def run():
+        job = await _wait((await _upload([("memo.txt", _sentences("memo"))])).json()["job_id"])
+        monkeypatch.setattr(upload, "enqueue", broken)
+        before = _saved()
+        r = await _call("PUT", f"/upload/{job['doc_ids'][0]}", files={"file": ("memo.txt", _sentences("memo2"))})
+        return r, before
+
+    r, before = asyncio.run(run())
+    assert r.status_code == 500
+    assert _saved() == before